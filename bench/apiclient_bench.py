@@ -0,0 +1,89 @@
+'''
+requests/sec of apiclient against a local stub server.
+
+    python bench/apiclient_bench.py [requests] [concurrency]
+
+compares the request class registry with resolving Response[cls] on every call.
+'''
+import asyncio, os, sys, threading, time, timeit
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from autopcr.core.apiclient import apiclient
+from autopcr.core.sdkclient import sdkclient, account, platform
+from autopcr.model.models import *
+from autopcr.model import registry
+
+PAYLOAD = {
+    'data_headers': {'servertime': 1, 'result_code': 1, 'viewer_id': '1'},
+    'data': {'quest_list': [{'quest_id': i, 'clear_flg': 3, 'result_type': 2} for i in range(50)]},
+}
+
+class _handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = b64encode(apiclient._pack(PAYLOAD, apiclient._createkey()))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _stubsdk(sdkclient):
+    def __init__(self, port: int):
+        super().__init__(account('bench', 'bench', platform.Android))
+        self.port = port
+    @property
+    def apiroot(self) -> str:
+        return f'http://127.0.0.1:{self.port}/'
+    @property
+    def platform_id(self) -> str:
+        return '2'
+    @property
+    def reskey(self) -> str:
+        return ''
+
+def _old_resolve(cls):
+    response_cls = cls.__orig_bases__[0].__args__[0]
+    sample = cls.construct()
+    return registry.RequestInfo(Response[response_cls], response_cls, sample.url, sample.crypted)
+
+async def run(port: int, total: int, concurrency: int) -> float:
+    clients = [apiclient(_stubsdk(port)) for _ in range(concurrency)]
+    async def worker(client: apiclient, num: int):
+        for _ in range(num):
+            await client.request(HomeIndexRequest())
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(client, total // concurrency) for client in clients])
+    return total // concurrency * concurrency / (time.perf_counter() - start)
+
+async def compare(port: int, total: int, concurrency: int):
+    await run(port, concurrency, concurrency) # warm up
+    print(f'registry: {await run(port, total, concurrency):.0f} req/s')
+    registry_get = registry.get
+    registry.get = _old_resolve
+    try:
+        print(f'per call: {await run(port, total, concurrency):.0f} req/s')
+    finally:
+        registry.get = registry_get
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    lookup = timeit.timeit(lambda: registry.get(HomeIndexRequest), number=10000) / 10000 * 1e6
+    resolve = timeit.timeit(lambda: _old_resolve(HomeIndexRequest), number=10000) / 10000 * 1e6
+    print(f'type resolution: registry {lookup:.2f}us, per call {resolve:.2f}us')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        asyncio.run(compare(server.server_address[1], total, concurrency))
+    finally:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#type: ignore
+'''
+get_equip_demand of a full box, expanding recipes with a queue on every call
+against the precomputed equip_craft_closure.
+
+    python bench/craft_bench.py                  # latest db in cache/db, synthetic tables without one
+    python bench/craft_bench.py path/to/ver.db
+    python bench/craft_bench.py --synthetic
+
+the box has UNITS units at random ranks and slots, both ways must give the same demand.
+'''
+import glob, os, random, sys, time
+from collections import Counter
+from queue import SimpleQueue
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+UNITS = 200
+REPEAT = 20
+
+def queue_craft_equip(self, source):
+    '''craft_equip before the closure'''
+    result = Counter()
+    mana = 0
+    queue = SimpleQueue()
+    for key, value in source.items():
+        queue.put((key, value))
+    while not queue.empty():
+        key, value = queue.get()
+        if key in self.equip_craft:
+            for token in self.equip_craft[key]:
+                queue.put((token[0], token[1] * value))
+            mana += self.equip_craft_mana[key] * value
+        else:
+            result[key] += value
+    return result, mana
+
+def _prime(db, name, value):
+    setattr(db, f'__cached_{name}', value)
+    setattr(db, f'__cached_version_{name}', db.dbmgr.ver)
+
+def synthesize(db, rnd: random.Random):
+    from autopcr.model.enums import eInventoryType
+    equip = lambda id: (eInventoryType.Equip, id)
+    # tier 0 are fragments, each tier is crafted from the tiers below
+    tiers = [[100000 + i for i in range(120)]]
+    craft, mana = {}, {}
+    for tier in range(1, 6):
+        ids = [100000 + tier * 1000 + i for i in range(100)]
+        for id in ids:
+            below = [x for t in tiers for x in t]
+            craft[equip(id)] = [(equip(x), rnd.randint(1, 4)) for x in rnd.sample(below, rnd.randint(2, 4))]
+            mana[equip(id)] = rnd.randint(1, 10) * 1000
+        tiers.append(ids)
+    promotion, count = {}, {}
+    for unit_id in range(100101, 100101 + UNITS * 100, 100):
+        promotion[unit_id], count[unit_id] = {}, {}
+        for rank in range(1, 31):
+            slots = [rnd.choice(tiers[min(5, rank // 6 + 1)]) for _ in range(6)]
+            if rank == 30: # max rank opens slots 2, 4 and 6
+                slots[0] = slots[2] = slots[4] = 999999
+            promotion[unit_id][rank] = SimpleNamespace(**{f'equip_slot_{i + 1}': slot for i, slot in enumerate(slots)})
+            count[unit_id][rank] = Counter(equip(slot) for slot in slots if slot != 999999)
+    _prime(db, 'equip_craft', craft)
+    _prime(db, 'equip_craft_mana', mana)
+    _prime(db, 'unit_promotion', promotion)
+    _prime(db, 'unit_promotion_equip_count', count)
+
+def box(db, rnd: random.Random):
+    from autopcr.core.datamgr import datamgr
+    from autopcr.model.common import EquipSlot, UnitData
+    data = datamgr()
+    units = rnd.sample(sorted(db.unit_promotion), min(UNITS, len(db.unit_promotion)))
+    data.unit = {}
+    for unit_id in units:
+        rank = rnd.choice(sorted(db.unit_promotion[unit_id]))
+        data.unit[unit_id] = UnitData(id=unit_id, promotion_level=rank, equip_slot=[EquipSlot(is_slot=rnd.random() < 0.5) for _ in range(6)])
+    return data
+
+def measure(data, craft) -> tuple:
+    from autopcr.db.database import database
+    database.craft_equip, origin = craft, database.craft_equip
+    try:
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            # get_equip_demand tracks the box between calls, every run starts cold
+            data._demand_trackers.clear()
+            data._unit_equip_demand.clear()
+            ret = data.get_equip_demand()
+        return (time.perf_counter() - start) / REPEAT, ret
+    finally:
+        database.craft_equip = origin
+
+def main():
+    import autopcr.core.datamgr
+    from autopcr.constants import CACHE_DIR
+    from autopcr.db.database import db, database
+    from autopcr.db.dbmgr import dbmgr
+    rnd = random.Random(0)
+    if '--synthetic' in sys.argv:
+        dbs = []
+    elif len(sys.argv) > 1:
+        dbs = [sys.argv[1]]
+    else:
+        dbs = glob.glob(os.path.join(CACHE_DIR, 'db', '*.db'))
+    if dbs:
+        path = max(dbs)
+        name = os.path.basename(path).split('.')[0]
+        mgr = dbmgr()
+        mgr.open(path, int(name) if name.isdigit() else 0)
+        mgr.open_store(db.store_models())
+        db.update(mgr)
+    else:
+        db.dbmgr = SimpleNamespace(ver=0)
+        synthesize(db, rnd)
+    data = box(db, rnd)
+
+    start = time.perf_counter()
+    db.equip_craft_closure
+    closure = time.perf_counter() - start
+
+    queue, before = measure(data, queue_craft_equip)
+    closed, after = measure(data, database.craft_equip)
+    print(f"{len(data.unit)} units, {len(db.equip_craft)} craftable equips")
+    print(f"queue:   {queue * 1000:.2f}ms per get_equip_demand")
+    print(f"closure: {closed * 1000:.2f}ms per get_equip_demand, {closure * 1000:.2f}ms to build once")
+    if +before != +after:
+        print('demand differs')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#type: ignore
+'''
+compare `parse_obj(_no_null_key(obj))` with the compiled decoder.
+
+    python bench/decoder_bench.py                 # recorded payloads in cache/req_dump
+    python bench/decoder_bench.py --synthetic     # payloads generated from the models
+
+payloads are recorded by running with AUTOPCR_SERVER_DEBUG_LOG=true.
+'''
+import os, sys, time, random
+from enum import Enum
+from msgpack import unpackb
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON, SHAPE_LIST
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from autopcr.model.models import *
+from autopcr.model import decoder
+from autopcr.constants import CACHE_DIR
+
+TARGETS = ['LoadIndexResponse', 'HomeIndexResponse']
+
+def synthesize(cls, rnd: random.Random, width: int = 20, depth: int = 0):
+    ret = {}
+    for field in cls.__fields__.values():
+        tp = field.type_
+        if isinstance(tp, type) and issubclass(tp, BaseModel):
+            if depth > 4:
+                continue
+            value = lambda: synthesize(tp, rnd, width, depth + 1)
+        elif isinstance(tp, type) and issubclass(tp, Enum):
+            value = lambda: rnd.choice(list(tp)).value
+        elif tp is bool:
+            value = lambda: rnd.randint(0, 1)
+        elif tp is int:
+            value = lambda: rnd.randint(0, 1 << 20)
+        elif tp is float:
+            value = lambda: rnd.random()
+        elif tp is str:
+            value = lambda: str(rnd.randint(0, 1 << 20))
+        else:
+            continue
+        if field.shape == SHAPE_SINGLETON:
+            ret[field.alias] = value()
+        elif field.shape == SHAPE_LIST:
+            items = [value() for _ in range(rnd.randint(0, width))]
+            if rnd.random() < 0.2: # msgpack list encoding with null key
+                ret[field.alias] = {None: 0, **{i: v for i, v in enumerate(items)}}
+            else:
+                ret[field.alias] = items
+    return ret
+
+def load_payloads(synthetic: bool):
+    ret = []
+    for name in TARGETS:
+        cls = Response[globals()[name]]
+        if synthetic:
+            payload = {'data_headers': {'servertime': 1, 'result_code': 1}, 'data': synthesize(globals()[name], random.Random(name))}
+            ret.append((name, cls, payload))
+            continue
+        path = os.path.join(CACHE_DIR, 'req_dump', f'{name}.msgpack')
+        if not os.path.exists(path):
+            print(f'{name}: no recorded payload at {path}, skipped')
+            continue
+        with open(path, 'rb') as f:
+            ret.append((name, cls, unpackb(f.read(), strict_map_key=False)))
+    return ret
+
+def bench(func, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1000
+
+def main():
+    rounds = 20
+    for name, cls, payload in load_payloads('--synthetic' in sys.argv):
+        old = cls.parse_obj(decoder.no_null_key(payload))
+        new = decoder.decode(cls, payload)
+        if old != new:
+            print(f'{name}: decoded model differs from parse_obj')
+        old_ms = bench(lambda: cls.parse_obj(decoder.no_null_key(payload)), rounds)
+        new_ms = bench(lambda: decoder.decode(cls, payload), rounds)
+        print(f'{name}: no_null_key+parse_obj {old_ms:.2f}ms, compiled decoder {new_ms:.2f}ms, x{old_ms / new_ms:.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#type: ignore
+'''
+cold start of the `database` lazy properties, sqlite orm under each engine profile
+(AUTOPCR_DB_ENGINE) against the compiled store.
+
+    python bench/store_bench.py                  # latest db in cache/db
+    python bench/store_bench.py path/to/ver.db
+    python bench/store_bench.py --synthetic      # rows generated from the models
+
+each mode runs in a fresh process, reporting the time to evaluate every lazy property,
+the peak rss and a digest of the values so both modes can be checked to agree.
+'''
+import glob, hashlib, json, os, random, resource, subprocess, sys, tempfile, time
+from sqlalchemy import Float, Integer, REAL, UniqueConstraint, create_engine, insert
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+ROWS = 300
+
+MODES = [
+    ('sqlite default', False, 'default'),
+    ('sqlite readonly', False, 'readonly'),
+    ('sqlite memory', False, 'memory'),
+    ('store compile', True, 'readonly'), # the store is removed before the first store run
+    ('store mmap', True, 'readonly'),
+]
+
+def synthesize(path: str):
+    from autopcr.db.models import Base
+    engine = create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(engine)
+    rnd = random.Random(0)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            unique = set(column.name for constraint in table.constraints if isinstance(constraint, UniqueConstraint) for column in constraint.columns)
+            rows = []
+            for i in range(ROWS):
+                row = {}
+                for column in table.columns:
+                    if column.primary_key or column.unique or column.name in unique:
+                        row[column.name] = i + 1
+                    elif isinstance(column.type, Integer):
+                        row[column.name] = rnd.randint(0, 3)
+                    elif isinstance(column.type, (REAL, Float)):
+                        row[column.name] = rnd.random()
+                    else:
+                        row[column.name] = '2020/01/01 00:00:00' if 'time' in column.name else f'{column.name}{i}'
+                rows.append(row)
+            conn.execute(insert(table), rows)
+    engine.dispose()
+
+def digest(value, out):
+    if isinstance(value, dict) or hasattr(value, 'items') and hasattr(value, 'keys'):
+        for k, v in value.items():
+            out.update(repr(k).encode())
+            digest(v, out)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            digest(v, out)
+    elif isinstance(value, (set, frozenset)):
+        out.update(repr(sorted(map(repr, value))).encode())
+    elif hasattr(type(value), '__tablename__'):
+        for attr in inspect_columns(type(value).__tablename__):
+            out.update(repr(getattr(value, attr)).encode())
+    else:
+        out.update(repr(value).encode())
+
+def version(path: str) -> int:
+    name = os.path.basename(path).split('.')[0]
+    return int(name) if name.isdigit() else 0
+
+_columns = {}
+def inspect_columns(tablename: str):
+    if not _columns:
+        from autopcr.db.models import Base
+        for mapper in Base.registry.mappers:
+            _columns[mapper.class_.__tablename__] = [attr.key for attr in mapper.column_attrs]
+    return _columns[tablename]
+
+def child(path: str):
+    import autopcr.core.datamgr
+    from autopcr.db.database import db, lazy_property
+    from autopcr.db.dbmgr import dbmgr
+    mgr = dbmgr()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    mgr.open(path, version(path))
+    mgr.open_store(db.store_models())
+    db.update(mgr)
+    values, errors = {}, 0
+    for name, attr in vars(type(db)).items():
+        if isinstance(attr, lazy_property):
+            try:
+                values[name] = getattr(db, name)
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - start
+    result = {
+        'time': elapsed,
+        'rss': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024,
+        'properties': len(values),
+        'errors': errors,
+    }
+    out = hashlib.md5()
+    for name in sorted(values):
+        digest(values[name], out)
+    result['digest'] = out.hexdigest()
+    print(json.dumps(result))
+
+def run(path: str, store: bool, engine: str) -> dict:
+    env = dict(os.environ, AUTOPCR_DB_STORE='true' if store else 'false', AUTOPCR_DB_ENGINE=engine)
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', path], env=env, capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError(proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    from autopcr.constants import CACHE_DIR
+    if '--child' in sys.argv:
+        child(sys.argv[sys.argv.index('--child') + 1])
+        return
+    tmpdir = None
+    if '--synthetic' in sys.argv:
+        tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmpdir.name, '1.db')
+        synthesize(path)
+    elif len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        dbs = glob.glob(os.path.join(CACHE_DIR, 'db', '*.db'))
+        if not dbs:
+            print(f'no db in {os.path.join(CACHE_DIR, "db")}')
+            return
+        path = max(dbs)
+    store_path = os.path.join(os.path.dirname(path), f'{version(path)}.store')
+    if os.path.exists(store_path):
+        os.remove(store_path)
+    base = None
+    for name, store, engine in MODES:
+        ret = run(path, store, engine)
+        print(f"{name + ':':<17} {ret['time']:.2f}s, rss +{ret['rss']:.1f}MB, {ret['properties']} properties, {ret['errors']} failed")
+        base = base or ret
+        if ret['digest'] != base['digest']:
+            print(f'values of {name} differ from {MODES[0][0]}')
+    if tmpdir:
+        tmpdir.cleanup()
+
+if __name__ == '__main__':
+    main()
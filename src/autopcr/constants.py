@@ -9,8 +9,40 @@ CLIENT_POOL_SIZE_MAX = 100
 CLIENT_POOL_MAX_AGE = 3600 * 24
 CLIENT_POOL_MAX_CLIENT_ALIVE = 10
 CLIENT_POOL_MAX_FARMER_CLIENT_ALIVE = 2
+CLIENT_POOL_MEMORY_BUDGET = int(os.getenv("AUTOPCR_CLIENT_POOL_MEMORY_MB", "64")) * 1024 * 1024 # estimated, session, keys and snapshot size, see PoolClientWrapper.estimated_size
+CLIENT_POOL_REAP_INTERVAL = 60
+CLIENT_POOL_EXPIRE_MARGIN = 300 # idle sessions expiring within this many seconds are reaped
 SESSION_ERROR_MAX_RETRY = 2
-MAX_API_RUNNING = 8
+LOGIN_BOOTSTRAP_TTL = 300 # source_ini answers shared by logins on the same server
+MAX_API_RUNNING = 8 # initial in-flight window of a server
+MAX_API_RUNNING_PER_SERVER = 32
+MAX_API_RUNNING_GLOBAL = 64
+API_TARGET_LATENCY = 2.0
+
+HTTP_POOL_MAXSIZE = int(os.getenv("AUTOPCR_HTTP_POOL_MAXSIZE", "16")) # keep-alive connections per host
+HTTP_MAX_WORKERS = int(os.getenv("AUTOPCR_HTTP_MAX_WORKERS", "64"))
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 10
+
+CODEC_OFFLOAD_THRESHOLD = 64 * 1024 # responses larger than this are decoded off the event loop
+CODEC_MAX_WORKERS = 2
+
+CRON_JITTER_WINDOW = int(os.getenv("AUTOPCR_CRON_JITTER_WINDOW", "0")) # seconds, due accounts are spread over this window
+
+BATCH_CONCURRENCY = int(os.getenv("AUTOPCR_BATCH_CONCURRENCY", "8")) # accounts of a batch run in flight at once
+
+CRON_PREWARM_MINUTES = int(os.getenv("AUTOPCR_CRON_PREWARM_MINUTES", "3")) # log in this long before a cron slot, 0 to disable
+
+CRON_JOB_DEADLINE = 3600 * 23 # cron jobs still queued by then are dropped, before the same cron fires again
+
+STORAGE_FLUSH_DELAY = 1.0 # writes to the same file within this window are coalesced
+
+DB_STORE = strtobool(os.getenv("AUTOPCR_DB_STORE", "true")) # compile master data into an mmapped store, see db/store.py
+# build new master dbs in a spawned process, threads where spawning the app is not possible
+DB_BUILD_PROCESS = strtobool(os.getenv("AUTOPCR_DB_BUILD_PROCESS", "false" if 'ANDROID_ARGUMENT' in os.environ else "true"))
+DB_ENGINE_PROFILE = os.getenv("AUTOPCR_DB_ENGINE", "readonly") # default, readonly or memory, see db/dbmgr.py
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHE_SIZE = 64 * 1024 * 1024
 
 BSDK = '官服'
 QSDK = '渠道服'
@@ -19,6 +51,8 @@ BSDKNOLOGIN = '官服免登录'
 CHANNEL_OPTION = [BSDK, QSDK, BSDKNOLOGIN]
 
 DEBUG_LOG = strtobool(os.getenv("AUTOPCR_SERVER_DEBUG_LOG", "false"))
+TRACING = strtobool(os.getenv("AUTOPCR_SERVER_TRACING", "false"))
+TRACING_RESERVOIR_SIZE = 512
 
 ALLOW_REGISTER = strtobool(os.getenv("AUTOPCR_SERVER_ALLOW_REGISTER", 'true'))
 SUPERUSER = str(os.getenv("AUTOPCR_SERVER_SUPERUSER", ""))
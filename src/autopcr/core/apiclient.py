@@ -12,10 +12,14 @@ from hashlib import md5
 from Crypto.Cipher import AES
 from base64 import b64encode, b64decode
 from .sdkclient import sdkclient
-from ..constants import refresh_headers, DEBUG_LOG, MAX_API_RUNNING
-import time, datetime
+from .codec import codec, instance as default_codec
+from ..model import decoder, registry
+from ..constants import refresh_headers, CACHE_DIR, DEBUG_LOG, MAX_API_RUNNING, MAX_API_RUNNING_PER_SERVER, MAX_API_RUNNING_GLOBAL, API_TARGET_LATENCY, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+from pydantic import ValidationError
+import time, datetime, os
 import json
 from ..util.logger import instance as logger
+from ..util.tracing import instance as tracer, current_request
 
 class ApiException(Exception):
 
@@ -29,6 +33,8 @@ class NetworkException(Exception):
 
 TResponse = TypeVar('TResponse', bound=ResponseBase, covariant=True)
 
+limiter = freqlimiter.AdaptiveLimiter(MAX_API_RUNNING_GLOBAL, MAX_API_RUNNING, 1, MAX_API_RUNNING_PER_SERVER, API_TARGET_LATENCY)
+
 class staticproperty:
     def __init__(self, func):
         self.fget = func
@@ -43,6 +49,7 @@ class apiclient(Container["apiclient"]):
     active_server: int = 0
     _requestid: str = ''
     _sessionid: str=  ''
+    codec: codec = default_codec
     def __init__(self, sdk: sdkclient):
         super().__init__()
         self._headers = sdk.header()
@@ -89,54 +96,53 @@ class apiclient(Container["apiclient"]):
         dec, key = apiclient._decrypt(data)
         return unpackb(dec[:-dec[-1]], strict_map_key=False), key
 
-    @staticmethod
-    def _no_null_key(obj):
-        if type(obj) == dict:
-            if None in obj and not [1 for k in obj if type(k) is not int and k is not None]:
-                return [apiclient._no_null_key(v1) for k1, v1 in sorted(((k, v) for k, v in obj.items() if k is not None), key=lambda x: x[0])]
-            return {k: apiclient._no_null_key(v) for k, v in obj.items() if k is not None}
-        elif type(obj) == list:
-            return [apiclient._no_null_key(v) for v in obj]
-        else:
-            return obj
+    _no_null_key = staticmethod(decoder.no_null_key)
 
-    @freqlimiter.RunningLimiter(MAX_API_RUNNING)
+    @limiter.limit(lambda self, request: self.servers[self.active_server], lambda e: isinstance(e, NetworkException))
     async def _request_internal(self, request: Request[TResponse]) -> TResponse:
         if not request: return None
-        logger.info(f'{self.user_name} requested {request.__class__.__name__} at /{request.url}')
+        info = registry.get(request.__class__)
+        cls, url, crypted = info.response_cls, info.url, info.crypted
+        logger.info(f'{self.user_name} requested {request.__class__.__name__} at /{url}')
         key = apiclient._createkey()
-        request.viewer_id = b64encode(apiclient._encrypt(str(self.viewer_id).encode('utf8'), key)).decode('ascii') if request.crypted else str(self.viewer_id)
+        request.viewer_id = b64encode(apiclient._encrypt(str(self.viewer_id).encode('utf8'), key)).decode('ascii') if crypted else str(self.viewer_id)
 
         urlroot = self.servers[self.active_server]
         
         try:
-            resp = await aiorequests.post(urlroot + request.url, data=apiclient._pack(request.dict(by_alias=True), key) if request.crypted else
-                request.json(by_alias=True).encode('utf8'), headers=self._headers, timeout=10)
+            with tracer.span('encode'):
+                data = await self.codec.pack(request.dict(by_alias=True), key) if crypted else request.json(by_alias=True).encode('utf8')
 
-            if resp.status_code != 200:
-                raise NetworkException
+            with tracer.span('network'):
+                resp = await aiorequests.post(urlroot + url, data=data, headers=self._headers, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
 
-            response0 = await resp.content
-            apiclient._local_time = time.time()
+                if resp.status_code != 200:
+                    raise NetworkException
 
-            response0 = apiclient._unpack(response0)[0] if request.crypted else loads(response0)
+                response0 = await resp.content
+            apiclient._local_time = time.time()
         except:
             raise NetworkException
 
-        cls = request.__class__.__orig_bases__[0].__args__[0]
-
-        response1 = apiclient._no_null_key(response0)
+        try:
+            with tracer.span('decode'):
+                response0, response = await self.codec.decode(response0, crypted, info.response)
+        except ValidationError:
+            raise
+        except:
+            raise NetworkException
 
         if DEBUG_LOG:
             with open('req.log', 'a') as fp:
-                fp.write(f'{self.user_name} requested {request.__class__.__name__} at /{request.url}\n')
+                fp.write(f'{self.user_name} requested {request.__class__.__name__} at /{url}\n')
                 fp.write(json.dumps(self._headers, indent=4, ensure_ascii=False) + '\n')
                 fp.write(json.dumps(json.loads(request.json(by_alias=True)), indent=4, ensure_ascii=False) + '\n')
                 fp.write(f'response from {urlroot}\n')
                 fp.write(json.dumps(dict(resp.headers), indent=4, ensure_ascii=False) + '\n')
                 fp.write(json.dumps(response0, indent=4, ensure_ascii=False) + '\n')
-
-        response: Response[TResponse] = Response[cls].parse_obj(response1)
+            os.makedirs(os.path.join(CACHE_DIR, 'req_dump'), exist_ok=True)
+            with open(os.path.join(CACHE_DIR, 'req_dump', f'{cls.__name__}.msgpack'), 'wb') as fp:
+                fp.write(packb(response0, use_bin_type=False))
 
         # with open('req.log', 'a') as fp:
            # fp.write(f'{self.name} requested {request.__class__.__name__} at /{request.url}\n')
@@ -159,7 +165,7 @@ class apiclient(Container["apiclient"]):
         if response.data_headers.viewer_id:
             self.viewer_id = int(response.data_headers.viewer_id)
 
-        if r"source_ini/get_maintenance_status?format=json" == request.url and "store_url" in response0['data_headers']:
+        if r"source_ini/get_maintenance_status?format=json" == url and "store_url" in response0['data_headers']:
             match = search(r'(?<=gzlj_)(\d+\.\d+\.\d+)', response0['data_headers']["store_url"])
             if not match:
                 raise ValueError("无法解析版本号，请手动修改constants.py的default_ver")
@@ -174,8 +180,8 @@ class apiclient(Container["apiclient"]):
 
 
         if response.data and response.data.server_error:
-            logger.error(f'pcrclient: /{request.url} api failed={response.data_headers.result_code} {response.data.server_error}')
-            logger.error(f'{self.user_name} requested {request.__class__.__name__} at /{request.url}\n')
+            logger.error(f'pcrclient: /{url} api failed={response.data_headers.result_code} {response.data.server_error}')
+            logger.error(f'{self.user_name} requested {request.__class__.__name__} at /{url}\n')
             logger.error(json.dumps(self._headers, indent=4, ensure_ascii=False) + '\n')
             logger.error(json.dumps(json.loads(request.json(by_alias=True)), indent=4, ensure_ascii=False) + '\n')
             logger.error(f'response from {urlroot}\n')
@@ -197,5 +203,13 @@ class apiclient(Container["apiclient"]):
         return response.data
 
     async def request(self, request: Request[TResponse]) -> TResponse:
-        async with self._lck:
-            return await self._request_internal(request)
+        token = current_request.set(request.__class__.__name__ if request else '')
+        try:
+            with tracer.span('client_wait'):
+                await self._lck.acquire()
+            try:
+                return await self._request_internal(request)
+            finally:
+                self._lck.release()
+        finally:
+            current_request.reset(token)
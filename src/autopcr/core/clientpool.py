@@ -4,12 +4,15 @@ from .sdkclient import sdkclient
 from .datamgr import datamgr
 from .sessionmgr import sessionmgr
 from ..model.error import PanicError
-from .misc import errorhandler, mutexhandler
+from .misc import errorhandler, mutexhandler, tracinghandler
 from .base import Component, Request, TResponse, RequestHandler
 from ..model.sdkrequests import ToolSdkLoginRequest
+from collections import OrderedDict
 from typing import Dict, Tuple
-from ..constants import SESSION_ERROR_MAX_RETRY, CLIENT_POOL_SIZE_MAX, CLIENT_POOL_MAX_AGE, CACHE_DIR, CLIENT_POOL_MAX_CLIENT_ALIVE, CLIENT_POOL_MAX_FARMER_CLIENT_ALIVE
-import time, os, asyncio, pickle
+from ..constants import TRACING, SESSION_ERROR_MAX_RETRY, CLIENT_POOL_SIZE_MAX, CLIENT_POOL_MAX_AGE, CACHE_DIR, CLIENT_POOL_MAX_CLIENT_ALIVE, CLIENT_POOL_MAX_FARMER_CLIENT_ALIVE, \
+    CLIENT_POOL_MEMORY_BUDGET, CLIENT_POOL_REAP_INTERVAL, CLIENT_POOL_EXPIRE_MARGIN
+import time, os, asyncio
+from .snapshot import snapshot
 from ..util.logger import instance as logger
 
 class ComponentWrapper(Component):
@@ -70,6 +73,9 @@ class PoolClientWrapper(pcrclient):
         self.pool = pool
         self.uid: str = None
         self.last_access = int(time.time())
+        self._saving: asyncio.Future = None
+        self._pool_size = 0
+        self._snapshot_size = 0
         self.register(errorhandler())
         self.register(self._data_wrapper)
         self.register(PreRequestHandler(pool))
@@ -77,6 +83,8 @@ class PoolClientWrapper(pcrclient):
         self.register(PreSessionHandler(pool))
         self.register(SessionErrorHandler(pool))
         self.register(mutexhandler())
+        if TRACING:
+            self.register(tracinghandler())
 
     @property
     def logged(self) -> eLoginStatus:
@@ -88,6 +96,23 @@ class PoolClientWrapper(pcrclient):
     def cache(self):
         return os.path.join(CACHE_DIR, 'pool', self.id)
 
+    def estimated_size(self) -> int:
+        '''
+        rough bytes held by this client, a fixed part for session and sdk, its keys,
+        the datamgr sections still loaded and the snapshot it loads back when reused
+        '''
+        size = 16 * 1024 + 256 * (len(self._base_keys) + len(self._keys))
+        for value in self.data.__dict__.values():
+            if isinstance(value, (dict, list, set)):
+                size += 256 * len(value)
+        return size + self.data.pending_size() + self._snapshot_size
+
+    def is_reapable(self, now: int) -> bool:
+        if self.last_access + CLIENT_POOL_MAX_AGE < now:
+            return True
+        session = self.session
+        return session._logged and session.session_expire_time - self.time < CLIENT_POOL_EXPIRE_MARGIN
+
     async def __aenter__(self):
         self._base_keys = {}
         self._keys = {}
@@ -104,25 +129,35 @@ class PoolClientWrapper(pcrclient):
     async def activate(self):
         await self.pool.sema_require(self)
         try:
-            if os.path.exists(self.cache):
-                with open(self.cache, 'rb') as f:
-                    tmp = pickle.loads(f.read())
-                    if tmp.version == self.data.version:
-                        self.data = tmp
-                        self._data_wrapper.component = self.data
+            if self._saving:
+                await self._saving
+            tmp = await asyncio.get_running_loop().run_in_executor(None, snapshot(self.cache).load, self.data.version)
+            if tmp:
+                self.data = tmp
+                self._data_wrapper.component = self.data
                 logger.debug("Client %s data loaded", self.data.uid)
         except:
             self.dispose()
 
     def dispose(self):
-        os.remove(self.cache)
+        snapshot(self.cache).remove()
+        self._snapshot_size = 0
+
+    def _save(self, data: datamgr):
+        try:
+            snapshot(self.cache).save(data)
+            self._snapshot_size = snapshot(self.cache).size()
+            logger.debug("Client %s data saved", data.uid)
+        except Exception:
+            logger.exception("Client %s data save failed", data.uid)
+            self.dispose()
 
     def deactivate(self):
         self.pool.sema_release(self)
         if self.data.ready:
-            with open(self.cache, 'wb') as f:
-                f.write(pickle.dumps(self.data))
-            logger.debug("Client %s data saved", self.data.uid)
+            self._saving = asyncio.get_running_loop().run_in_executor(None, self._save, self.data)
+            # the client may be pooled before the save is done
+            self._saving.add_done_callback(lambda _: self.pool._resize(self))
         self.data = datamgr()
         self._data_wrapper.component = self.data
 
@@ -147,9 +182,20 @@ class CountingSemaphore:
         return self.running, self.waiting, self.max_count
 
 class ClientPool:
+    '''
+    idle logged-in clients, least recently used first.
+    bounded by CLIENT_POOL_SIZE_MAX and an estimated memory budget, a reaper drops
+    clients that are too old or whose session is about to expire.
+    '''
     def __init__(self):
         self.active_uids: Dict[str, int] = dict()
-        self._pool: Dict[Tuple[str, str], PoolClientWrapper] = dict()
+        self._pool: 'OrderedDict[Tuple[str, str], PoolClientWrapper]' = OrderedDict()
+        self._pool_size = 0
+        self._reaper: asyncio.Task = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
         os.makedirs(os.path.join(CACHE_DIR, 'pool'), exist_ok=True)
 
         self._sema = CountingSemaphore(CLIENT_POOL_MAX_CLIENT_ALIVE)
@@ -161,6 +207,27 @@ class ClientPool:
             raise PanicError('用户的另一项请求正在进行中')
         self.active_uids[client.uid] = client_key
 
+    def _pop(self, pool_key: Tuple[str, str]) -> PoolClientWrapper:
+        client = self._pool.pop(pool_key)
+        self._pool_size -= client._pool_size
+        return client
+
+    def _evict(self):
+        while self._pool and (len(self._pool) > CLIENT_POOL_SIZE_MAX or self._pool_size > CLIENT_POOL_MEMORY_BUDGET):
+            k, v = next(iter(self._pool.items()))
+            self._pop(k)
+            self.evictions += 1
+            logger.debug("Evict client %s from pool", v.uid)
+
+    def _resize(self, client: PoolClientWrapper):
+        pool_key = (client.session.sdk.account, type(client.session.sdk).__name__)
+        if self._pool.get(pool_key) is not client:
+            return
+        self._pool_size -= client._pool_size
+        client._pool_size = client.estimated_size()
+        self._pool_size += client._pool_size
+        self._evict()
+
     def _put_in_pool(self, client: PoolClientWrapper):
         client_key = id(client)
         if self.active_uids.get(client.uid, -1) != client_key:
@@ -172,19 +239,33 @@ class ClientPool:
             return
 
         pool_key = (client.session.sdk.account, type(client.session.sdk).__name__)
-
-        if len(self._pool) >= CLIENT_POOL_SIZE_MAX:
-            now = int(time.time())
-            while self._pool:
-                k, v = next(iter(self._pool.items()))
-                if v.last_access + CLIENT_POOL_MAX_AGE < now:
-                    self._pool.pop(k)
-                else:
-                    break
+        if pool_key in self._pool:
+            self._pop(pool_key)
 
         logger.debug("Put client %s back to pool", client.uid)
-        if len(self._pool) < CLIENT_POOL_SIZE_MAX:
-            self._pool[pool_key] = client
+        client._pool_size = client.estimated_size()
+        self._pool[pool_key] = client
+        self._pool_size += client._pool_size
+        self._evict()
+
+        if self._reaper is None:
+            self._reaper = asyncio.get_running_loop().create_task(self._reap())
+
+    def reap(self):
+        now = int(time.time())
+        for k, v in list(self._pool.items()):
+            if v.is_reapable(now):
+                self._pop(k)
+                self.expirations += 1
+                logger.debug("Reap client %s from pool", v.uid)
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(CLIENT_POOL_REAP_INTERVAL)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.exception(e)
 
     async def sema_require(self, pcrclient: PoolClientWrapper):
         if pcrclient.session.sdk._account.farm:
@@ -201,14 +282,28 @@ class ClientPool:
     def sema_status(self):
         return self._sema.status(), self._farm_sema.status()
 
+    def pool_status(self) -> Dict[str, int]:
+        return {
+            'size': len(self._pool),
+            'max_size': CLIENT_POOL_SIZE_MAX,
+            'memory': self._pool_size,
+            'memory_budget': CLIENT_POOL_MEMORY_BUDGET,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
     async def get_client(self, sdk: sdkclient) -> PoolClientWrapper:
         pool_key = (sdk.account, type(sdk).__name__)
         if pool_key in self._pool:
-            client = self._pool.pop(pool_key)
+            self.hits += 1
+            client = self._pop(pool_key)
             self._on_sdk_login(client)
             client.need_refresh = True
             client.session.sdk = sdk
         else:
+            self.misses += 1
             client = PoolClientWrapper(self, sdk)
         return client
 
@@ -0,0 +1,63 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
+from json import loads
+from typing import Any, Dict, Tuple, Union
+import asyncio, time
+from ..constants import CODEC_OFFLOAD_THRESHOLD, CODEC_MAX_WORKERS
+from ..model import decoder
+from ..util.tracing import instance as tracer
+
+# stage functions return their result and the cost of each step, timed where they run
+def _encode(data: object, key: bytes) -> Tuple[bytes, Dict[str, float]]:
+    from .apiclient import apiclient
+    start = time.perf_counter()
+    ret = apiclient._pack(data, key)
+    return ret, {'pack': time.perf_counter() - start}
+
+def _decode(data: bytes, crypted: bool, model: type) -> Tuple[Tuple[Any, Any], Dict[str, float]]:
+    from .apiclient import apiclient
+    start = time.perf_counter()
+    raw = apiclient._unpack(data)[0] if crypted else loads(data)
+    mid = time.perf_counter()
+    response = decoder.decode(model, raw)
+    end = time.perf_counter()
+    return (raw, response), {'unpack': mid - start, 'parse': end - mid}
+
+class codec:
+    '''
+    encode/decode stage of apiclient.
+    payloads larger than threshold are handed to executor instead of blocking the event loop.
+    the executor must be a thread pool, responses are Response[cls] models built at runtime
+    and do not pickle. the cost of each step is reported as a tracer stage.
+    '''
+    def __init__(self, threshold: int = CODEC_OFFLOAD_THRESHOLD, executor: Union[Executor, None] = None):
+        self.threshold = threshold
+        self._executor = executor
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=CODEC_MAX_WORKERS, thread_name_prefix='codec')
+        return self._executor
+
+    async def _run(self, size: int, func, *args):
+        if size < self.threshold:
+            ret, costs = func(*args)
+        else:
+            start = time.perf_counter()
+            ret, costs = await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+            costs['offload_wait'] = max(0.0, time.perf_counter() - start - sum(costs.values()))
+        for stage, cost in costs.items():
+            tracer.observe(stage, cost)
+        return ret
+
+    async def pack(self, data: object, key: bytes) -> bytes:
+        # request bodies are small, they are always packed inline
+        return await self._run(0, _encode, data, key)
+
+    async def decode(self, data: bytes, crypted: bool, model: type) -> Tuple[Any, Any]:
+        '''
+        returns (raw response object, parsed model)
+        '''
+        return await self._run(len(data), _decode, data, crypted, model)
+
+instance = codec()
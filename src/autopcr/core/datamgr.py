@@ -2,19 +2,26 @@ from collections import Counter
 from .base import Component, RequestHandler
 from .apiclient import apiclient
 from ..model.modelbase import *
-from typing import Callable, Set, Dict, Tuple, Union
+from typing import Any, Callable, Iterable, Set, Dict, Tuple, Union
 import typing
 from ..model.common import *
 from ..model.custom import ItemType
-import json, base64, gzip
+import json, base64, gzip, pickle
 from ..db.assetmgr import instance as assetmgr
 from ..db.dbmgr import instance as dbmgr
 from ..db.database import db
 from ..db.models import ItemDatum, TrainingQuestDatum
 from ..util.linq import flow
 from asyncio import Lock
+import asyncio
+from ..util.logger import instance as logger
+from pydantic import PrivateAttr
+from ..util.tracing import instance as tracer
+from ..util.demandtracker import DemandTracker
+import itertools
 
 _data_lck = Lock()
+_data_update: Dict[int, asyncio.Task] = {} # running updates by version
 
 class datamgr(BaseModel, Component[apiclient]):
     ready: bool = False
@@ -70,16 +77,77 @@ class datamgr(BaseModel, Component[apiclient]):
     abyss_quest_info: Dict[int, AbyssDailyClearCountList] = {}
     alces_appear_story_flag: int = 0
     alces_receive_tutorial_item_flag: int = 0
+    _snapshot_sections: Dict[str, bytes] = PrivateAttr(default_factory=dict)
+    _demand_trackers: Dict[Any, DemandTracker] = PrivateAttr(default_factory=dict)
+    _unit_equip_demand: Dict[int, Tuple[Any, typing.Counter[ItemType]]] = PrivateAttr(default_factory=dict)
+    _inventory_tokens: Dict[str, Tuple[Any, Dict[ItemType, int], int, Set[ItemType]]] = PrivateAttr(default_factory=dict)
+
+    def __getattr__(self, name: str):
+        # sections of a pool snapshot are unpickled on first access, see snapshot.load
+        if not name.startswith('_'):
+            try:
+                sections = object.__getattribute__(self, '_snapshot_sections')
+            except AttributeError:
+                sections = {}
+            if name in sections:
+                return self._load_section(name)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def __setattr__(self, name: str, value: Any):
+        try:
+            object.__getattribute__(self, '_snapshot_sections').pop(name, None) # superseded
+        except AttributeError:
+            pass
+        super().__setattr__(name, value)
+
+    def _load_section(self, name: str) -> Any:
+        blob = self._snapshot_sections.pop(name)
+        try:
+            value = pickle.loads(blob)
+        except Exception:
+            # checked by crc when loaded, a section not unpickling is from an incompatible model
+            logger.exception(f"Snapshot section {name} unreadable, using the default")
+            value = self.__fields__[name].get_default()
+        self.__dict__[name] = value
+        return value
+
+    def _iter(self, *args, **kwargs):
+        # .dict(), .json(), == and copy() see every field
+        for name in list(self._snapshot_sections):
+            self._load_section(name)
+        return super()._iter(*args, **kwargs)
+
+    def pending_size(self) -> int:
+        '''
+        bytes of the snapshot sections not unpickled yet
+        '''
+        return sum(len(blob) for blob in self._snapshot_sections.values())
 
     @staticmethod
-    async def try_update_database(ver: int):
+    async def _update_database(ver: int):
         async with _data_lck:
             if not assetmgr.ver or assetmgr.ver < ver:
                 await assetmgr.init(ver)
             if not dbmgr.ver or dbmgr.ver < assetmgr.ver: 
-                await dbmgr.update_db(assetmgr)
+                await dbmgr.update_db(assetmgr, db.store_models())
                 db.update(dbmgr)
 
+    @staticmethod
+    async def try_update_database(ver: int):
+        if dbmgr.ver and dbmgr.ver >= ver:
+            return
+        task = _data_update.get(ver)
+        if task is None:
+            task = _data_update[ver] = asyncio.get_running_loop().create_task(datamgr._update_database(ver))
+            def done(task: asyncio.Task):
+                _data_update.pop(ver, None)
+                if not task.cancelled() and task.exception():
+                    logger.error(f"db version {ver} update failed: {task.exception()}")
+            task.add_done_callback(done)
+        if dbmgr.ver:
+            return # clients keep the current version until the new one is swapped in
+        await asyncio.shield(task)
+
     def update_stamina_recover(self):
         max_stamina = db.team_info[self.team_level].max_stamina
         now = apiclient.time
@@ -183,8 +251,8 @@ class datamgr(BaseModel, Component[apiclient]):
 
     def get_unique_equip_material_demand(self, equip_slot:int, unit_id: int, token: ItemType, target_rank: int = -1) -> int:
         start_rank = self.unit[unit_id].unique_equip_slot[0].rank if unit_id in self.unit and self.unit[unit_id].unique_equip_slot else 0
-        demand = db.get_unique_equip_material_demand(unit_id, equip_slot, start_rank, db.unique_equipment_max_rank[equip_slot] if target_rank == -1 else target_rank)
-        return demand.get(token, 0)
+        demand = db.get_unique_equip_material_demand_vec(unit_id, equip_slot, start_rank, db.unique_equipment_max_rank[equip_slot] if target_rank == -1 else target_rank)
+        return max(0, demand[token])
 
     def get_unit_eqiup_demand(self, unit_id: int, grow_parameter_list: Union[None, GrowthParameterList] = None) -> typing.Counter[ItemType]:
         unit = self.unit[unit_id]
@@ -294,53 +362,75 @@ class datamgr(BaseModel, Component[apiclient]):
         )
 
     def get_quest_weght(self, require_equip: typing.Counter[ItemType]) -> Dict[int, float]: 
-        return (
-            flow(db.normal_quest_rewards.items())
-            .to_dict(lambda x: x[0], lambda x:
-                flow(x[1].items())
-                .select(lambda y: datamgr._weight_mapper(require_equip.get(y[0], 0)) * y[1])
-                .sum() + 
-                (1000000 if x[1] and flow(x[1].items())
-                .select(lambda y: require_equip.get(y[0], 0))
-                .max() > 0 else 0)
-            )
-        )
+        return db.normal_quest_drop_matrix.weights(require_equip, datamgr._weight_mapper, 1000000)
+
+    @staticmethod
+    def _grow_state(grow_parameter_list: Union[None, GrowthParameterList]) -> Any:
+        if not grow_parameter_list:
+            return None
+        return (grow_parameter_list.promotion_level, tuple(getattr(grow_parameter_list, f"equipment_{i}") is not None for i in range(1, 7)))
+
+    def _unit_equip_state(self, unit_id: int, grow_state: Any) -> Any:
+        unit = self.unit[unit_id]
+        return (unit.promotion_level, tuple(equip.is_slot for equip in unit.equip_slot), grow_state)
+
+    def _tracked_equip_demand(self, unit_list: Iterable[int], grow_parameter_list: Union[None, GrowthParameterList]) -> typing.Counter[ItemType]:
+        grow_state = self._grow_state(grow_parameter_list)
+        states = {unit_id: self._unit_equip_state(unit_id, grow_state) for unit_id in unit_list}
+        def demand(unit_id: int) -> typing.Counter[ItemType]:
+            # kept across grow states, a unit is recomputed when its state differs
+            cached = self._unit_equip_demand.get(unit_id)
+            if cached is None or cached[0] != (dbmgr.ver, states[unit_id]):
+                cached = self._unit_equip_demand[unit_id] = ((dbmgr.ver, states[unit_id]), self.get_unit_eqiup_demand(unit_id, grow_parameter_list))
+            return cached[1]
+        # one tracker per grow state, a different selection only adds and removes the units that differ
+        tracker = self._demand_trackers.setdefault(('equip', grow_state), DemandTracker())
+        total = tracker.update(dbmgr.ver, states, demand)
+        return Counter({token: cnt for token, cnt in total.items() if cnt > 0})
 
     def get_equip_demand(self, start_rank: Union[None, int] = None, like_unit_only: bool = False, grow_parameter_list: Union[None, GrowthParameterList] = None) -> typing.Counter[ItemType]:
-        cnt: typing.Counter[ItemType] = Counter()
-        for unit_id in self.unit:
-            if start_rank and self.unit[unit_id].promotion_level < start_rank:
-                continue
-            if like_unit_only and not self.unit[unit_id].favorite_flag:
-                continue
-            need = self.get_unit_eqiup_demand(unit_id, grow_parameter_list)
-            if need:
-                cnt += need
-        return cnt 
+        unit_list = [unit_id for unit_id in self.unit 
+                     if not (start_rank and self.unit[unit_id].promotion_level < start_rank) and 
+                     not (like_unit_only and not self.unit[unit_id].favorite_flag)]
+        return self._tracked_equip_demand(unit_list, grow_parameter_list)
 
     def get_equip_demand2(self, unit_list: List[int], grow_parameter_list: Union[None, GrowthParameterList] = None) -> typing.Counter[ItemType]:
-        cnt: typing.Counter[ItemType] = Counter()
-        for unit_id in unit_list:
-            if unit_id not in self.unit:
-                continue
-            need = self.get_unit_eqiup_demand(unit_id, grow_parameter_list)
-            if need:
-                cnt += need
-        return cnt 
+        unit_list = [unit_id for unit_id in unit_list if unit_id in self.unit]
+        return self._tracked_equip_demand(unit_list, grow_parameter_list)
 
     def get_demand_gap(self, required: typing.Counter[ItemType], filter: Callable[[ItemType], bool] = lambda x: True) -> typing.Counter[ItemType]:
         all = set(self.inventory) | set(required)
         demand = Counter({token: required[token] - self.get_inventory(token) for token in all if filter(token)})
         return demand
 
+    def _inventory_filter(self, name: str, filter: Callable[[ItemType], bool]) -> Set[ItemType]:
+        '''
+        items of the inventory passing filter, only items added since the last call are checked
+        '''
+        version, inventory, size, tokens = self._inventory_tokens.get(name, (None, None, 0, set()))
+        if version != dbmgr.ver or inventory is not self.inventory:
+            size, tokens = 0, set()
+        # items are never removed from the inventory, new ones are at the end
+        tokens.update(token for token in itertools.islice(self.inventory, size, None) if filter(token))
+        self._inventory_tokens[name] = (dbmgr.ver, self.inventory, len(self.inventory), tokens)
+        return tokens
+
+    def _tracked_demand_gap(self, name: str, required: typing.Counter[ItemType], filter: Callable[[ItemType], bool]) -> typing.Counter[ItemType]:
+        '''
+        get_demand_gap with the filtered inventory items kept between calls
+        '''
+        all = self._inventory_filter(name, filter) | set(token for token in required if filter(token))
+        demand = Counter({token: required[token] - self.get_inventory(token) for token in all})
+        return demand
+
     def get_equip_demand2_gap(self, unit_list: List[int],  grow_parameter_list: Union[GrowthParameterList, None] = None) -> typing.Counter[ItemType]:
         demand = self.get_equip_demand2(unit_list, grow_parameter_list)
-        gap = self.get_demand_gap(demand, lambda x: db.is_equip(x, uncraftable_only=True))
+        gap = self._tracked_demand_gap('uncraftable_equip', demand, lambda x: db.is_equip(x, uncraftable_only=True))
         return gap
 
     def get_equip_demand_gap(self, start_rank: Union[None, int] = None, like_unit_only: bool = False, grow_parameter_list: Union[GrowthParameterList, None] = None) -> typing.Counter[ItemType]:
         demand = self.get_equip_demand(start_rank, like_unit_only, grow_parameter_list)
-        gap = self.get_demand_gap(demand, lambda x: db.is_equip(x, uncraftable_only=True))
+        gap = self._tracked_demand_gap('uncraftable_equip', demand, lambda x: db.is_equip(x, uncraftable_only=True))
         return gap
 
     def get_unit_memory_demand(self, unit_id: int, target_rarity: int = 999, target_unique_rank: int = -1, exceed_level: bool = True) -> int:
@@ -349,37 +439,50 @@ class datamgr(BaseModel, Component[apiclient]):
         need = self.get_rarity_memory_demand(unit_id, token, 2, target_rarity) + self.get_unique_equip_memory_demand(unit_id, token, target_unique_rank) + self.get_exceed_level_unit_demand(unit_id, token) * exceed_level
         return need
 
+    def _unit_memory_state(self, unit_id: int, rarity_slot_num: int) -> Any:
+        if unit_id not in self.unit:
+            return None
+        unit = self.unit[unit_id]
+        return (
+            unit.unit_rarity,
+            bool(unit.unlock_rarity_6_item and getattr(unit.unlock_rarity_6_item, f"slot_{rarity_slot_num}")),
+            unit.unique_equip_slot[0].rank if unit.unique_equip_slot else 0,
+            unit.exceed_stage,
+        )
+
     def get_memory_demand(self) -> typing.Counter[ItemType]:
-        result: typing.Counter[ItemType] = Counter()
+        units: Dict[ItemType, int] = {}
         for memory_id, unit_id in db.memory_to_unit.items():
             token = (eInventoryType.Item, memory_id)
             if token not in db.inventory_name or unit_id not in db.unit_data: # 未来角色
                 continue
+            units[token] = unit_id
 
-            need = self.get_unit_memory_demand(unit_id)
-            result[token] += need
-
-        return result
+        tracker = self._demand_trackers.setdefault('memory', DemandTracker())
+        total = tracker.update(dbmgr.ver, {token: self._unit_memory_state(unit_id, 2) for token, unit_id in units.items()}, 
+                               lambda token: Counter({token: self.get_unit_memory_demand(units[token])}))
+        return Counter(total)
 
     def get_pure_memory_demand(self) -> typing.Counter[ItemType]:
-        result: typing.Counter[ItemType] = Counter()
+        units: Dict[ItemType, int] = {}
         for token, unit_id in db.pure_memory_to_unit.items():
             if token not in db.inventory_name or unit_id not in db.unit_data: # 未来角色
                 continue
+            units[token] = unit_id
 
-            need = self.get_rarity_memory_demand(unit_id, token, 1)
-            result[token] += need
-
-        return result
+        tracker = self._demand_trackers.setdefault('pure_memory', DemandTracker())
+        total = tracker.update(dbmgr.ver, {token: self._unit_memory_state(unit_id, 1) for token, unit_id in units.items()}, 
+                               lambda token: Counter({token: self.get_rarity_memory_demand(units[token], token, 1)}))
+        return Counter(total)
 
     def get_memory_demand_gap(self) -> typing.Counter[ItemType]: # need -- >0
         demand = self.get_memory_demand()
-        gap = self.get_demand_gap(demand, lambda x: db.is_unit_memory(x))
+        gap = self._tracked_demand_gap('unit_memory', demand, lambda x: db.is_unit_memory(x))
         return gap
 
     def get_pure_memory_demand_gap(self) -> typing.Counter[ItemType]: # need -- >0
         demand = self.get_pure_memory_demand()
-        gap = self.get_demand_gap(demand, lambda x: db.is_unit_pure_memory(x))
+        gap = self._tracked_demand_gap('unit_pure_memory', demand, lambda x: db.is_unit_pure_memory(x))
         return gap
 
     def get_clan_ex_equip_demand(self, start_rank: Union[None, int] = None, like_unit_only: bool = False) -> typing.Counter[ItemType]:
@@ -589,7 +692,11 @@ class datamgr(BaseModel, Component[apiclient]):
         )) != 0
 
     def get_not_enough_item(self, demand: typing.Counter[ItemType]) -> typing.Counter[ItemType]:
-        bad = Counter({item: cnt - self.get_inventory(item) for item, cnt in demand.items() if cnt > self.get_inventory(item)})
+        bad: typing.Counter[ItemType] = Counter()
+        for item, cnt in demand.items():
+            stock = self.get_inventory(item)
+            if cnt > stock:
+                bad[item] = cnt - stock
         return bad
 
     def get_unit_power(self, unit_id: int) -> int:
@@ -679,9 +786,10 @@ class datamgr(BaseModel, Component[apiclient]):
     async def request(self, request: Request[TResponse], next: RequestHandler) -> TResponse:
         resp = await next.request(request)
         if resp:
-            if resp.update_bank_gold is not None:
-                self.user_gold_bank_info.bank_gold = resp.update_bank_gold
-            await resp.update(self, request)
+            with tracer.span('handler_update', request.__class__.__name__):
+                if resp.update_bank_gold is not None:
+                    self.user_gold_bank_info.bank_gold = resp.update_bank_gold
+                await resp.update(self, request)
         self.data_time = apiclient.time
         return resp
 
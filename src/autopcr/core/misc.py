@@ -4,6 +4,7 @@ from ..model.modelbase import *
 from ..model.error import *
 from asyncio import Lock
 from ..util.logger import instance as logger
+from ..util.tracing import instance as tracer, current_account
 
 class errorhandler(Component[apiclient]):
     async def request(self, request: Request[TResponse], next: RequestHandler) -> TResponse:
@@ -27,5 +28,18 @@ class mutexhandler(Component[apiclient]):
     def __init__(self):
         self._lck = Lock()
     async def request(self, request: Request[TResponse], next: RequestHandler) -> TResponse:
-        async with self._lck:
+        with tracer.span('account_wait', request.__class__.__name__ if request else ''):
+            await self._lck.acquire()
+        try:
             return await next.request(request)
+        finally:
+            self._lck.release()
+
+class tracinghandler(Component[apiclient]):
+    async def request(self, request: Request[TResponse], next: RequestHandler) -> TResponse:
+        token = current_account.set(self._container.id)
+        try:
+            with tracer.span('total', request.__class__.__name__ if request else 'Login'):
+                return await next.request(request)
+        finally:
+            current_account.reset(token)
@@ -3,10 +3,14 @@ from .apiclient import apiclient, ApiException
 from .sdkclient import sdkclient
 import json, os, random
 from ..model.models import *
-from ..constants import CACHE_DIR
+from ..constants import CACHE_DIR, LOGIN_BOOTSTRAP_TTL
 from ..util.logger import instance as logger
+from ..util.ttlcache import TTLCache
 import hashlib
 
+# SourceIniIndex and maintenance status are the same for every account of a server and app version
+_bootstrap = TTLCache(LOGIN_BOOTSTRAP_TTL)
+
 class sessionmgr(Component[apiclient]):
     def __init__(self, sdk: sdkclient):
         super().__init__()
@@ -83,14 +87,16 @@ class sessionmgr(Component[apiclient]):
             with open(self.cacheFile, 'r') as fp:
                 self._sdkaccount = json.load(fp)
         for _ in range(5):
+            current = self._container.servers[self._container.active_server]
+            key = (type(self.sdk).__name__, current, self._container._headers.get('APP-VER'))
             try:
-                current = self._container.servers[self._container.active_server]
-                self._container.servers = [f'https://{server}'.replace('\t', '') for server in (await next.request(SourceIniIndexRequest())).server]
+                index = await _bootstrap.get(key + ('index',), lambda: next.request(SourceIniIndexRequest()))
+                self._container.servers = [f'https://{server}'.replace('\t', '') for server in index.server]
                 try:
                     self._container.active_server = self._container.servers.index(current)
                 except ValueError:
                     self._container.active_server = 0
-                manifest = await next.request(SourceIniGetMaintenanceStatusRequest())
+                manifest = await _bootstrap.get(key + ('maintenance',), lambda: next.request(SourceIniGetMaintenanceStatusRequest()))
                 self._container._headers['MANIFEST-VER'] = manifest.required_manifest_ver
                 
                 await self._ensure_token(next)
@@ -125,6 +131,9 @@ class sessionmgr(Component[apiclient]):
                 self._logged = True
                 break
             except ApiException as e:
+                # maintenance, version or manifest changes show up as errors, refetch on retry
+                _bootstrap.invalidate(key + ('index',))
+                _bootstrap.invalidate(key + ('maintenance',))
                 if "维护" in str(e):
                     raise PanicError(str(e))
                 pass
@@ -0,0 +1,180 @@
+from typing import Any, Dict, List, Optional, Tuple
+from .datamgr import datamgr
+import glob, json, os, pickle, threading, zlib
+
+'''
+on-disk snapshot of a pool client's datamgr.
+
+every field of datamgr is a section, pickled on its own and appended to `<id>.<gen>.dat`.
+`<id>.idx` maps each section to (offset, size, crc) and is replaced atomically after each save,
+so a crash in the middle of a save leaves the previous snapshot intact.
+only sections whose content changed are appended, the data file is rewritten into a new
+generation once more than half of it is dead.
+loading reads and checks every section in the executor, so a corrupt snapshot is dropped
+before the client runs any task, and leaves them pickled: a section is unpickled on first
+access, see datamgr.__getattr__.
+'''
+
+SNAPSHOT_FORMAT = 1
+
+Entry = Tuple[int, int, int] # offset, size, crc32
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_lck = threading.Lock()
+
+def _lock(path: str) -> threading.Lock:
+    with _locks_lck:
+        if path not in _locks:
+            _locks[path] = threading.Lock()
+        return _locks[path]
+
+def _atomic_write(path: str, data: bytes):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class SnapshotError(Exception):
+    pass
+
+class snapshot:
+    def __init__(self, path: str):
+        self.path = path
+
+    @property
+    def index_path(self) -> str:
+        return self.path + '.idx'
+
+    def data_path(self, gen: int) -> str:
+        return f'{self.path}.{gen}.dat'
+
+    def read_index(self) -> Optional[dict]:
+        if not os.path.exists(self.index_path):
+            return None
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('format') != SNAPSHOT_FORMAT:
+            return None
+        return index
+
+    def read_section(self, f, name: str, entry: Entry) -> bytes:
+        offset, size, crc = entry
+        f.seek(offset)
+        blob = f.read(size)
+        if len(blob) != size or zlib.crc32(blob) != crc:
+            raise SnapshotError(f'{self.path}: section {name} is corrupted')
+        return blob
+
+    def load(self, version: int) -> Optional[datamgr]:
+        '''
+        returns the saved datamgr whose sections are unpickled on first access, None if no usable snapshot.
+        raises SnapshotError if a section is corrupted
+        '''
+        index = self.read_index()
+        if not index or index['version'] != version:
+            return None
+        data = datamgr()
+        sections: Dict[str, bytes] = {}
+        with open(self.data_path(index['gen']), 'rb') as f:
+            for name, entry in index['sections'].items():
+                if name in data.__fields__:
+                    sections[name] = self.read_section(f, name, entry)
+        for name in sections:
+            data.__dict__.pop(name)
+        data._snapshot_sections = sections
+        return data
+
+    def save(self, data: datamgr):
+        with _lock(self.path):
+            self._save(data)
+
+    def _save(self, data: datamgr):
+        index = self.read_index()
+        if not index or index['version'] != data.version:
+            if any(name not in data.__dict__ for name in data.__fields__):
+                return # sections of a removed snapshot are gone, a partial one is useless
+            index = {'format': SNAPSHOT_FORMAT, 'version': data.version, 'gen': 0, 'dead': 0, 'sections': {}}
+            self.remove()
+        gen: int = index['gen']
+        sections: Dict[str, Entry] = {k: tuple(v) for k, v in index['sections'].items()}
+        dead: int = index['dead']
+
+        changed: List[Tuple[str, bytes]] = []
+        for name in data.__fields__:
+            if name not in data.__dict__: # never accessed, unchanged on disk
+                continue
+            blob = pickle.dumps(data.__dict__[name], protocol=pickle.HIGHEST_PROTOCOL)
+            crc = zlib.crc32(blob)
+            old = sections.get(name)
+            if old and old[1] == len(blob) and old[2] == crc:
+                continue
+            if old:
+                dead += old[1]
+            changed.append((name, blob))
+        if not changed and os.path.exists(self.index_path):
+            return
+
+        sizes = {name: size for name, (_, size, _) in sections.items()}
+        sizes.update((name, len(blob)) for name, blob in changed)
+        if dead > sum(sizes.values()):
+            self._compact(data.version, gen, sections, changed)
+            return
+
+        path = self.data_path(gen)
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            for name, blob in changed:
+                f.write(blob)
+                sections[name] = (offset, len(blob), zlib.crc32(blob))
+                offset += len(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_index(data.version, gen, dead, sections)
+
+    def _compact(self, version: int, gen: int, sections: Dict[str, Entry], changed: List[Tuple[str, bytes]]):
+        blobs = dict(changed)
+        new_gen = gen + 1
+        new_sections: Dict[str, Entry] = {}
+        old = open(self.data_path(gen), 'rb') if os.path.exists(self.data_path(gen)) else None
+        try:
+            with open(self.data_path(new_gen), 'wb') as f:
+                for name in set(sections) | set(blobs):
+                    if name in blobs:
+                        blob = blobs[name]
+                    else:
+                        offset, size, _ = sections[name]
+                        old.seek(offset)
+                        blob = old.read(size)
+                    new_sections[name] = (f.tell(), len(blob), zlib.crc32(blob))
+                    f.write(blob)
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            if old:
+                old.close()
+        self._write_index(version, new_gen, 0, new_sections)
+        if os.path.exists(self.data_path(gen)):
+            os.remove(self.data_path(gen))
+
+    def _write_index(self, version: int, gen: int, dead: int, sections: Dict[str, Entry]):
+        index = {'format': SNAPSHOT_FORMAT, 'version': version, 'gen': gen, 'dead': dead, 'sections': sections}
+        _atomic_write(self.index_path, json.dumps(index).encode('utf-8'))
+
+    def size(self) -> int:
+        '''
+        bytes of the live sections, what loading the snapshot reads back
+        '''
+        try:
+            index = self.read_index()
+        except (OSError, ValueError):
+            return 0
+        if not index:
+            return 0
+        return sum(size for _, size, _ in index['sections'].values())
+
+    def remove(self):
+        for path in [self.path, self.index_path] + glob.glob(glob.escape(self.path) + '.*.dat'):
+            if os.path.exists(path):
+                os.remove(path)
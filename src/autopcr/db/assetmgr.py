@@ -1,11 +1,30 @@
 #type: ignore
-from typing import List
+from typing import List, Optional
 from ..util import aiorequests
 from ..constants import CACHE_DIR
-import os, pydantic
+import asyncio, hashlib, os, pydantic
 import UnityPy
 from ..util.logger import instance as logger
 
+class progress:
+    '''
+    progress of the running master db update, stage is None when idle
+    '''
+    def __init__(self):
+        self.stage: Optional[str] = None
+        self.done = 0
+        self.total = 0
+
+    def start(self, stage: Optional[str], total: int = 0, done: int = 0):
+        self.stage = stage
+        self.total = total
+        self.done = done
+
+    def status(self) -> dict:
+        return {'stage': self.stage, 'done': self.done, 'total': self.total}
+
+update_progress = progress()
+
 class content(pydantic.BaseModel):
     url: str = None
     md5: str = None
@@ -35,13 +54,14 @@ class content(pydantic.BaseModel):
     async def from_url(urlroot: str, url: str, category: str) -> List["content"]:
         lines = (await (await aiorequests.get(f'{urlroot}{url}')).text).split('\n')
         res = [content.from_line(line, category) for line in lines]
-        for child in res:
-            await child.download_children(urlroot)
+        update_progress.total += sum(not child.is_assets for child in res)
+        await asyncio.gather(*[child.download_children(urlroot) for child in res])
         return res
 
     async def download_children(self, urlroot: str):
         if not self.is_assets:
             self.children = await content.from_url(urlroot, self.url, self.category)
+            update_progress.done += 1
 
     def register_to(self, mgr: "assetmgr"):
         mgr.registries[self.url] = self
@@ -77,6 +97,7 @@ class assetmgr:
             
             logger.info(f'manifest version {ver} loaded from cache')
         except:
+            update_progress.start('清单')
             self.root = content(
                 url='manifest/manifest_assetmanifest',
                 type='every',
@@ -95,9 +116,45 @@ class assetmgr:
             return f'{self.pool}/{content.category}/{hash[:2]}/{hash}'
         return await content.download(genHash)
  
-    async def db(self) -> bytes:
+    async def download_to(self, url: str, path: str):
+        '''
+        streams the asset to path, resuming a previous partial download and checking its md5
+        '''
+        content = self.registries[url]
+        part = path + '.part'
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        rsp = await aiorequests.get(f'{self.pool}/{content.category}/{content.md5[:2]}/{content.md5}', headers=headers, stream=True)
+        try:
+            if rsp.status_code != 416: # 416: the partial download is complete already
+                rsp.raise_for_status()
+                if rsp.status_code != 206:
+                    offset = 0
+                update_progress.start('下载', content.size, offset)
+                def write():
+                    with open(part, 'ab' if offset else 'wb') as f:
+                        for chunk in rsp.raw_response.iter_content(64 * 1024):
+                            f.write(chunk)
+                            update_progress.done += len(chunk)
+                await aiorequests.run_sync_func(write)
+        finally:
+            # the host pool blocks when full, a streamed response holds its connection until closed
+            rsp.raw_response.close()
+        def md5() -> str:
+            ret = hashlib.md5()
+            with open(part, 'rb') as f:
+                while chunk := f.read(1024 * 1024):
+                    ret.update(chunk)
+            return ret.hexdigest()
+        if await aiorequests.run_sync_func(md5) != content.md5:
+            os.remove(part)
+            raise ValueError(f"{url}下载校验失败")
+        os.replace(part, path)
+
+    @staticmethod
+    def extract_db(bundle: str) -> bytes:
         UnityPy.config.FALLBACK_UNITY_VERSION = "2021.3.20f1"
-        ab = UnityPy.load(await self.download('a/masterdata_master.unity3d'))
+        ab = UnityPy.load(bundle)
         asset = ab.objects[0].read()
         return asset.script
 
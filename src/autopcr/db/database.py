@@ -1,5 +1,5 @@
 from typing import List, Dict, Set, Tuple, Union
-import typing
+import typing, types
 from ..model.enums import eCampaignCategory, eParamType
 from ..model.common import ExtraEquipInfo, ExtraEquipSubStatus, UnitData, eInventoryType, RoomUserItem, InventoryInfo
 from ..model.custom import ItemType, eDifficulty
@@ -11,6 +11,8 @@ from .models import *
 from ..util.linq import flow
 from queue import SimpleQueue
 from .constdata import extra_drops
+from .dropmatrix import dropmatrix
+from .itemvec import itemindex, itemvec, prefixsum
 from ..core.apiclient import apiclient
 from typing import TypeVar, Generic
 from ..util.pcr_data import CHARA_NICKNAME
@@ -44,6 +46,29 @@ class lazy_property(Generic[T]):
 
         return cached
 
+class secondary_index(lazy_property[Dict[typing.Any, T]]):
+    '''
+    rows of another lazy property by key, in source order, built once per db version.
+    name = secondary_index('source', lambda x: x.key) gives key -> rows,
+    unique=True gives key -> row, the last row wins like flow.to_dict
+    '''
+    def __init__(self, source: str, key: typing.Callable[[typing.Any], typing.Any], unique: bool = False):
+        def build(instance):
+            rows = getattr(instance, source)
+            if isinstance(rows, typing.Mapping):
+                rows = rows.values()
+            if unique:
+                return {key(row): row for row in rows}
+            ret = defaultdict(list)
+            for row in rows:
+                ret[key(row)].append(row)
+            return dict(ret)
+        super().__init__(build)
+
+    def __set_name__(self, owner, name: str):
+        self.attr_name = f"__cached_{name}"
+        self.version_attr = f"__cached_version_{name}"
+
 class database():
     heart: ItemType = (eInventoryType.Equip, 140000)
     xinsui: ItemType = (eInventoryType.Equip, 140001)
@@ -68,8 +93,29 @@ class database():
     ex_rainbow_enhance_pt: ItemType = (eInventoryType.Item, 26202)
 
     def update(self, dbmgr):
+        # values of the previous version hold rows of its retired store
+        for name in [name for name in vars(self) if name.startswith('__cached_')]:
+            delattr(self, name)
         self.dbmgr = dbmgr
 
+    @classmethod
+    def store_models(cls) -> List[type]:
+        '''
+        models referenced by the methods, compiled into the master data store
+        '''
+        names = set()
+        def walk(code: types.CodeType):
+            names.update(code.co_names)
+            for const in code.co_consts:
+                if isinstance(const, types.CodeType):
+                    walk(const)
+        for attr in vars(cls).values():
+            func = attr.func if isinstance(attr, lazy_property) else attr
+            if isinstance(func, types.FunctionType):
+                walk(func.__code__)
+        return [model for name in sorted(names)
+                if isinstance(model := globals().get(name), type) and issubclass(model, Base) and model is not Base]
+
     @lazy_property
     def redeem_unit(self) -> Dict[int, Dict[int, RedeemUnit]]:
         with self.dbmgr.session() as db:
@@ -82,42 +128,27 @@ class database():
     @lazy_property
     def caravan_buddy(self) -> Dict[int, CaravanBuddy]:
         with self.dbmgr.session() as db:
-            return (
-                CaravanBuddy.query(db)
-                .to_dict(lambda x: x.buddy_id, lambda x: x)
-            )
+            return CaravanBuddy.query_dict(db, 'buddy_id')
 
     @lazy_property
     def caravan_dish(self) -> Dict[int, CaravanDish]:
         with self.dbmgr.session() as db:
-            return (
-                CaravanDish.query(db)
-                .to_dict(lambda x: x.dish_id, lambda x: x)
-            )
+            return CaravanDish.query_dict(db, 'dish_id')
 
     @lazy_property
     def caravan_event_effect(self) -> Dict[int, CaravanEventEffect]:
         with self.dbmgr.session() as db:
-            return (
-                CaravanEventEffect.query(db)
-                .to_dict(lambda x: x.event_id, lambda x: x)
-            )
+            return CaravanEventEffect.query_dict(db, 'event_id')
 
     @lazy_property
     def caravan_map(self) -> Dict[int, CaravanMap]:
         with self.dbmgr.session() as db:
-            return (
-                CaravanMap.query(db)
-                .to_dict(lambda x: x.block_id, lambda x: x)
-            )
+            return CaravanMap.query_dict(db, 'block_id')
 
     @lazy_property
     def caravan_shortcut(self) -> Dict[int, CaravanShortcut]:
         with self.dbmgr.session() as db:
-            return (
-                CaravanShortcut.query(db)
-                .to_dict(lambda x: x.shortcut_id, lambda x: x)
-            )
+            return CaravanShortcut.query_dict(db, 'shortcut_id')
 
     @lazy_property
     def caravan_coin_shop_lineup(self) -> Dict[int, List[CaravanCoinShopLineup]]:
@@ -131,18 +162,12 @@ class database():
     @lazy_property
     def caravan_schedule(self) -> Dict[int, CaravanSchedule]:
         with self.dbmgr.session() as db:
-            return (
-                CaravanSchedule.query(db)
-                .to_dict(lambda x: x.season_id, lambda x: x)
-            )
+            return CaravanSchedule.query_dict(db, 'season_id')
 
     @lazy_property
     def caravan_gacha_block_lineup(self) -> Dict[int, CaravanGachaBlockLineup]:
         with self.dbmgr.session() as db:
-            return (
-                CaravanGachaBlockLineup.query(db)
-                .to_dict(lambda x: x.group_id, lambda x: x)
-            )
+            return CaravanGachaBlockLineup.query_dict(db, 'group_id')
 
     @lazy_property
     def ccc_scenario(self) -> Dict[int, List[CccScenario]]:
@@ -156,18 +181,12 @@ class database():
     @lazy_property
     def ccc_object(self) -> Dict[int, CccObject]:
         with self.dbmgr.session() as db:
-            return (
-                CccObject.query(db)
-                .to_dict(lambda x: x.ccc_object_id, lambda x: x)
-            )
+            return CccObject.query_dict(db, 'ccc_object_id')
 
     @lazy_property
     def dear_story_data(self) -> Dict[int, DearStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                DearStoryDatum.query(db)
-                .to_dict(lambda x: x.value, lambda x: x)
-            )
+            return DearStoryDatum.query_dict(db, 'value')
 
     @lazy_property
     def dear_story_detail(self) -> Dict[int, Dict[int, DearStoryDetail]]:
@@ -182,26 +201,17 @@ class database():
     @lazy_property
     def seasonpass_level_reward(self) -> Dict[int, SeasonpassLevelReward]:
         with self.dbmgr.session() as db:
-            return (
-                SeasonpassLevelReward.query(db)
-                .to_dict(lambda x: x.level_id, lambda x: x)
-            )
+            return SeasonpassLevelReward.query_dict(db, 'level_id')
 
     @lazy_property
     def seasonpass_foundation(self) -> Dict[int, SeasonpassFoundation]:
         with self.dbmgr.session() as db:
-            return (
-                SeasonpassFoundation.query(db)
-                .to_dict(lambda x: x.season_id, lambda x: x)
-            )
+            return SeasonpassFoundation.query_dict(db, 'season_id')
 
     @lazy_property
     def guild_data(self) -> Dict[int, Guild]:
         with self.dbmgr.session() as db:
-            return (
-                Guild.query(db)
-                .to_dict(lambda x: x.guild_id, lambda x: x)
-            )
+            return Guild.query_dict(db, 'guild_id')
 
     @lazy_property
     def normal_quest_data(self) -> Dict[int, QuestDatum]:
@@ -215,18 +225,12 @@ class database():
     @lazy_property
     def wave_groups(self) -> Dict[int, WaveGroupDatum]:
         with self.dbmgr.session() as db:
-            return (
-                WaveGroupDatum.query(db)
-                .to_dict(lambda x: x.wave_group_id, lambda x: x)
-            )
+            return WaveGroupDatum.query_dict(db, 'wave_group_id')
 
     @lazy_property
     def reward_groups(self) -> Dict[int, EnemyRewardDatum]:
         with self.dbmgr.session() as db:
-            return (
-                EnemyRewardDatum.query(db)
-                .to_dict(lambda x: x.drop_reward_id, lambda x: x)
-            )
+            return EnemyRewardDatum.query_dict(db, 'drop_reward_id')
 
     @lazy_property
     def normal_quest_rewards(self) -> Dict[int, typing.Counter[ItemType]]:
@@ -245,13 +249,14 @@ class database():
             )
         )
 
+    @lazy_property
+    def normal_quest_drop_matrix(self) -> dropmatrix:
+        return dropmatrix(self.normal_quest_rewards)
+
     @lazy_property
     def unique_equipment_data(self) -> Dict[int, UniqueEquipmentDatum]:
         with self.dbmgr.session() as db:
-            return (
-                UniqueEquipmentDatum.query(db)
-                .to_dict(lambda x: x.equipment_id, lambda x: x)
-            )
+            return UniqueEquipmentDatum.query_dict(db, 'equipment_id')
 
     @lazy_property
     def unique_equip_enhance_rate(self) -> Dict[int, List[UniqueEquipEnhanceRate]]:
@@ -294,13 +299,32 @@ class database():
                 )
             )
 
+    @lazy_property
+    def equip_craft_closure(self) -> Dict[ItemType, Tuple[typing.Counter[ItemType], int]]:
+        '''
+        craftable equip -> (raw materials, mana) of crafting one from scratch
+        '''
+        ret: Dict[ItemType, Tuple[typing.Counter[ItemType], int]] = {}
+        for equip in self.equip_craft:
+            result: typing.Counter[ItemType] = Counter()
+            mana = 0
+            queue = SimpleQueue()
+            queue.put((equip, 1))
+            while not queue.empty():
+                key, value = queue.get()
+                if key in self.equip_craft:
+                    for token in self.equip_craft[key]:
+                        queue.put((token[0], token[1] * value))
+                    mana += self.equip_craft_mana[key] * value
+                else:
+                    result[key] += value
+            ret[equip] = (result, mana)
+        return ret
+
     @lazy_property
     def unit_status_coefficient(self) -> Dict[int, UnitStatusCoefficient]:
         with self.dbmgr.session() as db:
-            return (
-                UnitStatusCoefficient.query(db)
-                .to_dict(lambda x: x.coefficient_id, lambda x: x)
-            )
+            return UnitStatusCoefficient.query_dict(db, 'coefficient_id')
 
     @lazy_property
     def promote_bonus(self) -> Dict[int, Dict[int, PromotionBonus]]:
@@ -352,6 +376,10 @@ class database():
                 )
             )
 
+    @lazy_property
+    def unit_promotion_equip_sum(self) -> Dict[int, prefixsum]:
+        return {unit_id: prefixsum(equips) for unit_id, equips in self.unit_promotion_equip_count.items()}
+
     @lazy_property
     def equip_max_rank(self) -> int:
         return max(
@@ -381,34 +409,22 @@ class database():
     @lazy_property
     def hatsune_boss(self) -> Dict[int, HatsuneBoss]:
         with self.dbmgr.session() as db:
-            return (
-                HatsuneBoss.query(db)
-                .to_dict(lambda x: x.boss_id, lambda x: x)
-            )
+            return HatsuneBoss.query_dict(db, 'boss_id')
 
     @lazy_property
     def hatsune_schedule(self) -> Dict[int, HatsuneSchedule]:
         with self.dbmgr.session() as db:
-            return (
-                HatsuneSchedule.query(db)
-                .to_dict(lambda x: x.event_id, lambda x: x)
-            )
+            return HatsuneSchedule.query_dict(db, 'event_id')
 
     @lazy_property
     def campaign_beginner_data(self) -> Dict[int, CampaignBeginnerDatum]:
         with self.dbmgr.session() as db:
-            return (
-                CampaignBeginnerDatum.query(db)
-                .to_dict(lambda x: x.beginner_id, lambda x: x)
-            )
+            return CampaignBeginnerDatum.query_dict(db, 'beginner_id')
 
     @lazy_property
     def campaign_schedule(self) -> Dict[int, CampaignSchedule]:
         with self.dbmgr.session() as db:
-            return (
-                CampaignSchedule.query(db)
-                .to_dict(lambda x: x.id, lambda x: x)
-            )
+            return CampaignSchedule.query_dict(db, 'id')
 
     @lazy_property
     def pure_memory_quest(self) -> Dict[ItemType, List[QuestDatum]]:
@@ -449,10 +465,7 @@ class database():
     @lazy_property
     def team_info(self) -> Dict[int, ExperienceTeam]:
         with self.dbmgr.session() as db:
-            return (
-                ExperienceTeam.query(db)
-                .to_dict(lambda x: x.team_level, lambda x: x)
-            )
+            return ExperienceTeam.query_dict(db, 'team_level')
 
     @lazy_property
     def team_max_level(self) -> int:
@@ -499,10 +512,7 @@ class database():
     @lazy_property
     def exceed_level_unit_required(self) -> Dict[int, ExceedLevelUnit]:
         with self.dbmgr.session() as db:
-            return (
-                ExceedLevelUnit.query(db)
-                .to_dict(lambda x: x.unit_id, lambda x: x)
-            )
+            return ExceedLevelUnit.query_dict(db, 'unit_id')
 
     @lazy_property
     def unit_rarity(self) -> Dict[int, Dict[int, UnitRarity]]:
@@ -546,6 +556,10 @@ class database():
                 )
             )
 
+    @lazy_property
+    def rarity_up_required_sum(self) -> Dict[int, prefixsum]:
+        return {unit_id: prefixsum(required) for unit_id, required in self.rarity_up_required.items()}
+
     @lazy_property
     def unique_equip_required(self) -> Dict[int, Dict[int, typing.Counter[ItemType]]]:
         with self.dbmgr.session() as db:
@@ -598,6 +612,10 @@ class database():
                 )
             )
 
+    @lazy_property
+    def unique_equip_required_sum(self) -> Dict[int, prefixsum]:
+        return {equip_id: prefixsum(required) for equip_id, required in self.unique_equip_required.items()}
+
     @lazy_property
     def dungeon_area(self) -> Dict[int, DungeonArea]:
         with self.dbmgr.session() as db:
@@ -619,10 +637,7 @@ class database():
     @lazy_property
     def secret_dungeon_schedule(self) -> Dict[int, SecretDungeonSchedule]:
         with self.dbmgr.session() as db:
-            return (
-                SecretDungeonSchedule.query(db)
-                .to_dict(lambda x: x.dungeon_area_id, lambda x: x)
-            )
+            return SecretDungeonSchedule.query_dict(db, 'dungeon_area_id')
 
     @lazy_property
     def training_quest_exp(self) -> Dict[int, TrainingQuestDatum]:
@@ -645,18 +660,12 @@ class database():
     @lazy_property
     def chara_fortune_schedule(self) -> Dict[int, CharaFortuneSchedule]:
         with self.dbmgr.session() as db:
-            return (
-                CharaFortuneSchedule.query(db)
-                .to_dict(lambda x: x.fortune_id, lambda x: x)
-            )
+            return CharaFortuneSchedule.query_dict(db, 'fortune_id')
 
     @lazy_property
     def clan_battle_period(self) -> Dict[int, ClanBattlePeriod]:
         with self.dbmgr.session() as db:
-            return (
-                ClanBattlePeriod.query(db)
-                .to_dict(lambda x: x.clan_battle_id, lambda x: x)
-            )
+            return ClanBattlePeriod.query_dict(db, 'clan_battle_id')
 
     @lazy_property
     def quest_info(self) -> Dict[int, QuestDatum]:
@@ -682,18 +691,14 @@ class database():
     @lazy_property
     def abyss_boss_data(self) -> Dict[int, AbyssBossDatum]:
         with self.dbmgr.session() as db:
-            return (
-                AbyssBossDatum.query(db)
-                .to_dict(lambda x: x.boss_id, lambda x: x)
-            )
+            return AbyssBossDatum.query_dict(db, 'boss_id')
+
+    abyss_boss_by_abyss: Dict[int, List[AbyssBossDatum]] = secondary_index('abyss_boss_data', lambda x: x.abyss_id)
 
     @lazy_property
     def chara_story_status(self) -> Dict[int, CharaStoryStatus]:
         with self.dbmgr.session() as db:
-            return (
-                CharaStoryStatus.query(db)
-                .to_dict(lambda x: x.story_id, lambda x: x)
-            )
+            return CharaStoryStatus.query_dict(db, 'story_id')
 
     @lazy_property
     def chara2story(self) -> Dict[int, List[CharaStoryStatus]]:
@@ -744,34 +749,22 @@ class database():
     @lazy_property
     def tower_area(self) -> Dict[int, TowerAreaDatum]:
         with self.dbmgr.session() as db:
-            return (
-                TowerAreaDatum.query(db)
-                .to_dict(lambda x: x.max_floor_num, lambda x: x)
-            )
+            return TowerAreaDatum.query_dict(db, 'max_floor_num')
 
     @lazy_property
     def tower_quest(self) -> Dict[int, TowerQuestDatum]:
         with self.dbmgr.session() as db:
-            return (
-                TowerQuestDatum.query(db)
-                .to_dict(lambda x: x.tower_quest_id, lambda x: x)
-            )
+            return TowerQuestDatum.query_dict(db, 'tower_quest_id')
 
     @lazy_property
     def tdf_schedule(self) -> Dict[int, TdfSchedule]:
         with self.dbmgr.session() as db:
-            return (
-                TdfSchedule.query(db)
-                .to_dict(lambda x: x.schedule_id, lambda x: x)
-            )
+            return TdfSchedule.query_dict(db, 'schedule_id')
 
     @lazy_property
     def event_story_data(self) -> Dict[int, EventStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                EventStoryDatum.query(db)
-                .to_dict(lambda x: x.story_group_id, lambda x: x)
-            )
+            return EventStoryDatum.query_dict(db, 'story_group_id')
 
     @lazy_property
     def event_name(self) -> Dict[int, str]:
@@ -793,13 +786,12 @@ class database():
                 .to_list()
             )
 
+    event_story_detail_by_story: Dict[int, EventStoryDetail] = secondary_index('event_story_detail', lambda x: x.story_id, unique=True)
+
     @lazy_property
     def story_detail(self) -> Dict[int, StoryDetail]:
         with self.dbmgr.session() as db:
-            return (
-                StoryDetail.query(db)
-                .to_dict(lambda x: x.story_id, lambda x: x)
-            )
+            return StoryDetail.query_dict(db, 'story_id')
 
     @lazy_property
     def unit_story(self) -> List[StoryDetail]:
@@ -811,13 +803,12 @@ class database():
                 .to_list()
             )
 
+    unit_story_by_group: Dict[int, List[StoryDetail]] = secondary_index('unit_story', lambda x: x.story_group_id)
+
     @lazy_property
     def equip_data(self) -> Dict[int, EquipmentDatum]:
         with self.dbmgr.session() as db:
-            return (
-                EquipmentDatum.query(db)
-                .to_dict(lambda x: x.equipment_id, lambda x: x)
-            )
+            return EquipmentDatum.query_dict(db, 'equipment_id')
 
     @lazy_property
     def equip_promotion_to_raw_ore(self) -> Dict[int, ItemType]:
@@ -839,26 +830,17 @@ class database():
     @lazy_property
     def skill_action(self) -> Dict[int, SkillAction]:
         with self.dbmgr.session() as db:
-            return (
-                SkillAction.query(db)
-                .to_dict(lambda x: x.action_id, lambda x: x)
-            )
+            return SkillAction.query_dict(db, 'action_id')
 
     @lazy_property
     def skill_data(self) -> Dict[int, SkillDatum]:
         with self.dbmgr.session() as db:
-            return (
-                SkillDatum.query(db)
-                .to_dict(lambda x: x.skill_id, lambda x: x)
-            )
+            return SkillDatum.query_dict(db, 'skill_id')
 
     @lazy_property
     def unit_skill_data(self) -> Dict[int, UnitSkillDatum]:
         with self.dbmgr.session() as db:
-            return (
-                UnitSkillDatum.query(db)
-                .to_dict(lambda x: x.unit_id, lambda x: x)
-            )
+            return UnitSkillDatum.query_dict(db, 'unit_id')
 
     @lazy_property
     def experience_unit(self) -> Dict[int, int]:
@@ -881,10 +863,7 @@ class database():
     @lazy_property
     def equipment_enhance_rate(self) -> Dict[int, EquipmentEnhanceRate]:
         with self.dbmgr.session() as db:
-            return (
-                EquipmentEnhanceRate.query(db)
-                .to_dict(lambda x: x.equipment_id, lambda x: x)
-            )
+            return EquipmentEnhanceRate.query_dict(db, 'equipment_id')
 
     @lazy_property
     def inventory_name(self) -> Dict[ItemType, str]:
@@ -940,10 +919,7 @@ class database():
     @lazy_property
     def room_item(self) -> Dict[int, RoomItem]:
         with self.dbmgr.session() as db:
-            return (
-                RoomItem.query(db)
-                .to_dict(lambda x: x.id, lambda x: x)
-            )
+            return RoomItem.query_dict(db, 'id')
 
     @lazy_property
     def room_item_detail(self) -> Dict[int, Dict[int, RoomItemDetail]]:
@@ -958,10 +934,7 @@ class database():
     @lazy_property
     def daily_mission_data(self) -> Dict[int, DailyMissionDatum]:
         with self.dbmgr.session() as db:
-            return (
-                DailyMissionDatum.query(db)
-                .to_dict(lambda x: x.daily_mission_id, lambda x: x)
-            )
+            return DailyMissionDatum.query_dict(db, 'daily_mission_id')
 
     @lazy_property
     def season_pack(self) -> Dict[int, SeasonPack]:
@@ -975,26 +948,17 @@ class database():
     @lazy_property
     def stationary_mission_data(self) -> Dict[int, StationaryMissionDatum]:
         with self.dbmgr.session() as db:
-            return (
-                StationaryMissionDatum.query(db)
-                .to_dict(lambda x: x.stationary_mission_id, lambda x: x)
-            )
+            return StationaryMissionDatum.query_dict(db, 'stationary_mission_id')
 
     @lazy_property
     def emblem_data(self) -> Dict[int, EmblemDatum]:
         with self.dbmgr.session() as db:
-            return (
-                EmblemDatum.query(db)
-                .to_dict(lambda x: x.emblem_id, lambda x: x)
-            )
+            return EmblemDatum.query_dict(db, 'emblem_id')
 
     @lazy_property
     def emblem_mission_data(self) -> Dict[int, EmblemMissionDatum]:
         with self.dbmgr.session() as db:
-            return (
-                EmblemMissionDatum.query(db)
-                .to_dict(lambda x: x.mission_id, lambda x: x)
-            )
+            return EmblemMissionDatum.query_dict(db, 'mission_id')
 
     @lazy_property
     def memory_to_unit(self) -> Dict[int, int]:
@@ -1013,34 +977,22 @@ class database():
     @lazy_property
     def growth_parameter(self) -> Dict[int, GrowthParameter]:
         with self.dbmgr.session() as db:
-            return (
-                GrowthParameter.query(db)
-                .to_dict(lambda x: x.growth_id, lambda x: x)
-            )
+            return GrowthParameter.query_dict(db, 'growth_id')
 
     @lazy_property
     def growth_parameter_unique(self) -> Dict[int, GrowthParameterUnique]:
         with self.dbmgr.session() as db:
-            return (
-                GrowthParameterUnique.query(db)
-                .to_dict(lambda x: x.growth_id, lambda x: x)
-            )
+            return GrowthParameterUnique.query_dict(db, 'growth_id')
 
     @lazy_property
     def unit_data(self) -> Dict[int, UnitDatum]:
         with self.dbmgr.session() as db:
-            return (
-                UnitDatum.query(db)
-                .to_dict(lambda x: x.unit_id, lambda x: x)
-            )
+            return UnitDatum.query_dict(db, 'unit_id')
 
     @lazy_property
     def unlock_unit_condition(self) -> Dict[int, UnlockUnitCondition]:
         with self.dbmgr.session() as db:
-            return (
-                UnlockUnitCondition.query(db)
-                .to_dict(lambda x: x.unit_id, lambda x: x)
-            )
+            return UnlockUnitCondition.query_dict(db, 'unit_id')
 
     @lazy_property
     def unit_kana_ids(self) -> Dict[str, List[int]]:
@@ -1078,42 +1030,27 @@ class database():
     @lazy_property
     def login_bonus_data(self) -> Dict[int, LoginBonusDatum]:
         with self.dbmgr.session() as db:
-            return (
-                LoginBonusDatum.query(db)
-                .to_dict(lambda x: x.login_bonus_id, lambda x: x)
-            )
+            return LoginBonusDatum.query_dict(db, 'login_bonus_id')
 
     @lazy_property
     def colosseum_schedule_data(self) -> Dict[int, ColosseumScheduleDatum]:
         with self.dbmgr.session() as db:
-            return (
-                ColosseumScheduleDatum.query(db)
-                .to_dict(lambda x: x.schedule_id, lambda x: x)
-            )
+            return ColosseumScheduleDatum.query_dict(db, 'schedule_id')
 
     @lazy_property
     def dome_schedule_data(self) -> Dict[int, DomeScheduleDatum]:
         with self.dbmgr.session() as db:
-            return (
-                DomeScheduleDatum.query(db)
-                .to_dict(lambda x: x.schedule_id, lambda x: x)
-            )
+            return DomeScheduleDatum.query_dict(db, 'schedule_id')
 
     @lazy_property
     def abyss_schedule(self) -> Dict[int, AbyssSchedule]:
         with self.dbmgr.session() as db:
-            return (
-                AbyssSchedule.query(db)
-                .to_dict(lambda x: x.abyss_id, lambda x: x)
-            )
+            return AbyssSchedule.query_dict(db, 'abyss_id')
 
     @lazy_property
     def tower_schedule(self) -> Dict[int, TowerSchedule]:
         with self.dbmgr.session() as db:
-            return (
-                TowerSchedule.query(db)
-                .to_dict(lambda x: x.tower_schedule_id, lambda x: x)
-            )
+            return TowerSchedule.query_dict(db, 'tower_schedule_id')
         
     @lazy_property
     def dungeon_name(self) -> Dict[int, str]:
@@ -1135,10 +1072,7 @@ class database():
     @lazy_property
     def campaign_free_gacha(self) -> Dict[int, CampaignFreegacha]:
         with self.dbmgr.session() as db:
-            return (
-                CampaignFreegacha.query(db)
-                .to_dict(lambda x: x.campaign_id, lambda x: x)
-            )
+            return CampaignFreegacha.query_dict(db, 'campaign_id')
         
     @lazy_property
     def campaign_free_gacha_data(self) -> Dict[int, List[CampaignFreegachaDatum]]:
@@ -1152,10 +1086,7 @@ class database():
     @lazy_property
     def gacha_data(self) -> Dict[int, GachaDatum]:
         with self.dbmgr.session() as db:
-            return (
-                GachaDatum.query(db)
-                .to_dict(lambda x: x.gacha_id, lambda x: x)
-            )
+            return GachaDatum.query_dict(db, 'gacha_id')
 
     @lazy_property
     def gacha_pickup(self) -> Dict[int, Dict[int, GachaPickup]]:
@@ -1171,10 +1102,7 @@ class database():
     @lazy_property
     def prizegacha_data(self) -> Dict[int, PrizegachaDatum]:
         with self.dbmgr.session() as db:
-            return (
-                PrizegachaDatum.query(db)
-                .to_dict(lambda x: x.prizegacha_id, lambda x: x)
-            )
+            return PrizegachaDatum.query_dict(db, 'prizegacha_id')
 
     @lazy_property
     def prizegacha_sp_data(self) -> Dict[int, Dict[int, PrizegachaSpDatum]]:
@@ -1188,18 +1116,12 @@ class database():
     @lazy_property
     def prizegacha_sp_detail(self) -> Dict[int, PrizegachaSpDetail]:
         with self.dbmgr.session() as db:
-            return (
-                PrizegachaSpDetail.query(db)
-                .to_dict(lambda x: x.disp_rarity, lambda x: x)
-            )
+            return PrizegachaSpDetail.query_dict(db, 'disp_rarity')
 
     @lazy_property
     def campaign_gacha(self) -> Dict[int, CampaignFreegacha]:
         with self.dbmgr.session() as db:
-            return (
-                CampaignFreegacha.query(db)
-                .to_dict(lambda x: x.campaign_id, lambda x: x)
-            )
+            return CampaignFreegacha.query_dict(db, 'campaign_id')
 
     @lazy_property
     def love_char(self) -> Dict[int, Tuple[int, int]]:
@@ -1260,226 +1182,142 @@ class database():
     @lazy_property
     def hatsune_item(self) -> Dict[int, HatsuneItem]:
         with self.dbmgr.session() as db:
-            return (
-                HatsuneItem.query(db)
-                .to_dict(lambda x: x.event_id, lambda x: x)
-            )
+            return HatsuneItem.query_dict(db, 'event_id')
 
     @lazy_property
     def abd_story_data(self) -> Dict[int, AbdStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                AbdStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return AbdStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def lss_story_data(self) -> Dict[int, LssStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                LssStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return LssStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def tpr_story_data(self) -> Dict[int, TprStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                TprStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return TprStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def tpr_panel_data(self) -> Dict[int, TprPanelDatum]:
         with self.dbmgr.session() as db:
-            return (
-                TprPanelDatum.query(db)
-                .to_dict(lambda x: x.panel_id, lambda x: x)
-            )
+            return TprPanelDatum.query_dict(db, 'panel_id')
 
     @lazy_property
     def apg_story_data(self) -> Dict[int, ApgStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                ApgStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return ApgStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def fpc_story_data(self) -> Dict[int, FpcStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                FpcStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return FpcStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def ais_story_data(self) -> Dict[int, AisStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                AisStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return AisStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def nyd_story_data(self) -> Dict[int, NydStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                NydStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return NydStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def xac_story_data(self) -> Dict[int, XacStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                XacStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return XacStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def asb_story_data(self) -> Dict[int, AsbStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                AsbStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return AsbStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def wtm_story_data(self) -> Dict[int, WtmStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                WtmStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return WtmStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def wts_story_data(self) -> Dict[int, WtsStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                WtsStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return WtsStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def bmy_story_data(self) -> Dict[int, BmyStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                BmyStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return BmyStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def won_story_data(self) -> Dict[int, WonStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                WonStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return WonStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def mme_story_data(self) -> Dict[int, MmeStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                MmeStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return MmeStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def dsb_story_data(self) -> Dict[int, DsbStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                DsbStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return DsbStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def xeh_story_data(self) -> Dict[int, XehStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                XehStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return XehStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def dvs_story_data(self) -> Dict[int, DvsStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                DvsStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return DvsStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def lsv_story_data(self) -> Dict[int, LsvStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                LsvStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return LsvStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def ysn_story_data(self) -> Dict[int, YsnStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                YsnStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return YsnStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def nop_story_data(self) -> Dict[int, NopDramaDatum]:
         with self.dbmgr.session() as db:
-            return (
-                NopDramaDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return NopDramaDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def mhp_story_data(self) -> Dict[int, MhpStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                MhpStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return MhpStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def svd_story_data(self) -> Dict[int, SvdStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                SvdStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return SvdStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def ssp_story_data(self) -> Dict[int, SspStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                SspStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return SspStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def ske_story_data(self) -> Dict[int, SkeStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                SkeStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return SkeStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def lto_story_data(self) -> Dict[int, LtoStoryDatum]:
         with self.dbmgr.session() as db:
-            return (
-                LtoStoryDatum.query(db)
-                .to_dict(lambda x: x.sub_story_id, lambda x: x)
-            )
+            return LtoStoryDatum.query_dict(db, 'sub_story_id')
 
     @lazy_property
     def ex_equipment_data(self) -> Dict[int, ExEquipmentDatum]:
         with self.dbmgr.session() as db:
-            return (
-                ExEquipmentDatum.query(db)
-                .to_dict(lambda x: x.ex_equipment_id, lambda x: x)
-            )
+            return ExEquipmentDatum.query_dict(db, 'ex_equipment_id')
 
     @lazy_property
     def ex_equipment_sub_status(self) -> Dict[int, Dict[int, ExEquipmentSubStatus]]:
@@ -1495,10 +1333,7 @@ class database():
     @lazy_property
     def ex_equipment_sub_status_group(self) -> Dict[int, ExEquipmentSubStatusGroup]:
         with self.dbmgr.session() as db:
-            return (
-                ExEquipmentSubStatusGroup.query(db)
-                .to_dict(lambda x: x.ex_equipment_id, lambda x: x)
-            )
+            return ExEquipmentSubStatusGroup.query_dict(db, 'ex_equipment_id')
 
     @lazy_property
     def ex_equipment_rankup_data(self) -> Dict[int, Dict[int, ExEquipmentRankupDatum]]:
@@ -1514,10 +1349,7 @@ class database():
     @lazy_property
     def unit_ex_equipment_slot(self) -> Dict[int, UnitExEquipmentSlot]:
         with self.dbmgr.session() as db:
-            return (
-                UnitExEquipmentSlot.query(db)
-                .to_dict(lambda x: x.unit_id, lambda x: x)
-            )
+            return UnitExEquipmentSlot.query_dict(db, 'unit_id')
 
     @lazy_property
     def ex_equipment_type_to_clan_battle_ex(self) -> Dict[int, int]:
@@ -1548,18 +1380,12 @@ class database():
     @lazy_property
     def ex_event_data(self) -> Dict[int, TravelExEventDatum]:
         with self.dbmgr.session() as db:
-            return (
-                TravelExEventDatum.query(db)
-                .to_dict(lambda x: x.still_id, lambda x: x)
-            )
+            return TravelExEventDatum.query_dict(db, 'still_id')
 
     @lazy_property
     def travel_area_data(self) -> Dict[int, TravelAreaDatum]:
         with self.dbmgr.session() as db:
-            return (
-                TravelAreaDatum.query(db)
-                .to_dict(lambda x: x.travel_area_id, lambda x: x)
-            )
+            return TravelAreaDatum.query_dict(db, 'travel_area_id')
 
     @lazy_property
     def travel_top_event_drama(self) -> Dict[int, List[TravelTopEventDrama]]:
@@ -1584,10 +1410,7 @@ class database():
     @lazy_property
     def travel_quest_data(self) -> Dict[int, TravelQuestDatum]:
         with self.dbmgr.session() as db:
-            return (
-                TravelQuestDatum.query(db)
-                .to_dict(lambda x: x.travel_quest_id, lambda x: x)
-            )
+            return TravelQuestDatum.query_dict(db, 'travel_quest_id')
 
     @lazy_property
     def quest_name(self) -> Dict[int, str]:
@@ -1647,6 +1470,8 @@ class database():
                 )
             )
 
+    talent_quest_area_by_talent: Dict[int, List[TalentQuestAreaDatum]] = secondary_index('talent_quest_area_data', lambda x: x.talent_id)
+
     @lazy_property
     def talent_quests_data(self) -> Dict[int, Dict[int, TalentQuestDatum]]:
         with self.dbmgr.session() as db:
@@ -1673,58 +1498,37 @@ class database():
     @lazy_property
     def talents(self) -> Dict[int, Talent]:
         with self.dbmgr.session() as db:
-            return (
-                Talent.query(db)
-                .to_dict(lambda x: x.talent_id, lambda x: x)
-            )
+            return Talent.query_dict(db, 'talent_id')
 
     @lazy_property
     def talent_level_material(self) -> Dict[int, TalentLevelMaterial]:
         with self.dbmgr.session() as db:
-            return (
-                TalentLevelMaterial.query(db)
-                .to_dict(lambda x: x.talent_id, lambda x: x)
-            )
+            return TalentLevelMaterial.query_dict(db, 'talent_id')
 
     @lazy_property
     def talent_skill_node(self) -> Dict[int, TalentSkillNode]:
         with self.dbmgr.session() as db:
-            return (
-                TalentSkillNode.query(db)
-                .to_dict(lambda x: x.node_id, lambda x: x)
-            )
+            return TalentSkillNode.query_dict(db, 'node_id')
 
     @lazy_property
     def team_skill_enhance_level(self) -> Dict[int, TeamSkillEnhanceLevel]:
         with self.dbmgr.session() as db:
-            return (
-                TeamSkillEnhanceLevel.query(db)
-                .to_dict(lambda x: x.enhance_level_id, lambda x: x)
-            )
+            return TeamSkillEnhanceLevel.query_dict(db, 'enhance_level_id')
 
     @lazy_property
     def team_skill_node(self) -> Dict[int, TeamSkillNode]:
         with self.dbmgr.session() as db:
-            return (
-                TeamSkillNode.query(db)
-                .to_dict(lambda x: x.node_id, lambda x: x)
-            )
+            return TeamSkillNode.query_dict(db, 'node_id')
 
     @lazy_property
     def experience_talent_level(self) -> Dict[int, ExperienceTalentLevel]:
         with self.dbmgr.session() as db:
-            return (
-                ExperienceTalentLevel.query(db)
-                .to_dict(lambda x: x.talent_level, lambda x: x)
-            )
+            return ExperienceTalentLevel.query_dict(db, 'talent_level')
 
     @lazy_property
     def mirage_setting(self) -> Dict[int, MirageSetting]:
         with self.dbmgr.session() as db:
-            return (
-                MirageSetting.query(db)
-                .to_dict(lambda x: x.id, lambda x: x)
-            )
+            return MirageSetting.query_dict(db, 'id')
 
     @lazy_property
     def mirage_nemesis_quest(self) -> Dict[int, Dict[int, MirageNemesisQuest]]:
@@ -1740,26 +1544,17 @@ class database():
     @lazy_property
     def mirage_floor_setting(self) -> Dict[int, MirageFloorSetting]:
         with self.dbmgr.session() as db:
-            return (
-                MirageFloorSetting.query(db)
-                .to_dict(lambda x: x.floor_num, lambda x: x)
-            )
+            return MirageFloorSetting.query_dict(db, 'floor_num')
 
     @lazy_property
     def mirage_nemesis_area(self) -> Dict[int, MirageNemesisArea]:
         with self.dbmgr.session() as db:
-            return (
-                MirageNemesisArea.query(db)
-                .to_dict(lambda x: x.nemesis_id, lambda x: x)
-            )
+            return MirageNemesisArea.query_dict(db, 'nemesis_id')
 
     @lazy_property
     def alces_story(self) -> Dict[int, AlcesStory]:
         with self.dbmgr.session() as db:
-            return (
-                AlcesStory.query(db)
-                .to_dict(lambda x: x.story_id, lambda x: x)
-            )
+            return AlcesStory.query_dict(db, 'story_id')
 
     @lazy_property
     def alces_cost(self) -> Dict[ItemType, AlcesCost]:
@@ -2062,9 +1857,7 @@ class database():
                 .to_list()
 
     def get_abyss_bosses(self, abyss_id: int) -> List[AbyssBossDatum]:
-        return flow(self.abyss_boss_data.values()) \
-                .where(lambda x: x.abyss_id == abyss_id) \
-                .to_list()
+        return list(self.abyss_boss_by_abyss.get(abyss_id, []))
 
     def get_active_seasonpass(self) -> List[SeasonpassFoundation]:
         now = apiclient.datetime
@@ -2216,49 +2009,37 @@ class database():
         return self.get_start_time(apiclient.datetime)
 
     def get_rarity_memory_demand(self, unit_id: int, start_rarity: int, target_rarity: int, token: ItemType) -> int:
-        return (
-            flow(self.rarity_up_required[unit_id].items())
-            .where(lambda x: x[0] > start_rarity and x[0] <= target_rarity)
-            .select(lambda x: x[1][token])
-            .sum()
-        )
+        return self.rarity_up_required_sum[unit_id].sum(start_rarity + 1, target_rarity + 1)[token]
 
     def get_unique_equip_material_demand(self, unit_id: int, slot_id:int, start_rank:int, target_rank: int) -> typing.Counter[ItemType]: 
         if unit_id not in db.unit_unique_equip[slot_id]:
             return Counter() 
+        return self.get_unique_equip_material_demand_vec(unit_id, slot_id, start_rank, target_rank).to_counter()
+
+    def get_unique_equip_material_demand_vec(self, unit_id: int, slot_id:int, start_rank:int, target_rank: int) -> itemvec: 
+        if unit_id not in db.unit_unique_equip[slot_id]:
+            return itemindex().vector()
         equip_id = db.unit_unique_equip[slot_id][unit_id].equip_id
-        return (
-            flow(db.unique_equip_required[equip_id].items())
-            .where(lambda x: x[0] >= start_rank and x[0] < target_rank)
-            .select(lambda x: x[1])
-            .sum(seed = Counter())
-        )
+        return self.unique_equip_required_sum[equip_id].sum(start_rank, target_rank)
 
     def get_rank_promote_equip_demand(self, unit_id: int, start_rank: int, start_rank_equip_slot: List[bool], target_rank, target_rank_equip_slot: List[bool]) -> typing.Counter[ItemType]: # 都是整装
-        ret = (
-            (flow(self.unit_promotion_equip_count[unit_id].items())
-            .where(lambda x: x[0] >= start_rank and x[0] < target_rank)
-            .select(lambda x: x[1])
-            .sum(seed=Counter())) +
-            Counter((eInventoryType(eInventoryType.Equip), int(getattr(self.unit_promotion[unit_id][target_rank], f"equip_slot_{i}"))) for i in range(1, 7) if target_rank_equip_slot[i - 1]) -
-            Counter((eInventoryType(eInventoryType.Equip), int(getattr(self.unit_promotion[unit_id][start_rank], f"equip_slot_{i}"))) for i in range(1, 7) if start_rank_equip_slot[i - 1])
-            )
-        return ret
+        promotion_sum = self.unit_promotion_equip_sum[unit_id]
+        ret = promotion_sum.sum(start_rank, target_rank)
+        ret.update((eInventoryType(eInventoryType.Equip), int(getattr(self.unit_promotion[unit_id][target_rank], f"equip_slot_{i}"))) for i in range(1, 7) if target_rank_equip_slot[i - 1])
+        ret.update(((eInventoryType(eInventoryType.Equip), int(getattr(self.unit_promotion[unit_id][start_rank], f"equip_slot_{i}"))) for i in range(1, 7) if start_rank_equip_slot[i - 1]), -1)
+        return ret.to_counter()
 
     def craft_equip(self, source: typing.Counter[ItemType]) -> Tuple[typing.Counter[ItemType], int]: # 返回剩余的材料和消耗的mana
         result: typing.Counter[ItemType] = Counter()
         mana = 0
 
-        queue = SimpleQueue()
+        closure = self.equip_craft_closure
         for key, value in source.items():
-            queue.put((key, value)) # ItemType, count
-        
-        while not queue.empty():
-            key, value = queue.get()
-            if key in self.equip_craft:
-                for token in self.equip_craft[key]:
-                    queue.put((token[0], token[1] * value))
-                mana += self.equip_craft_mana[key] * value
+            if key in closure:
+                materials, cost = closure[key]
+                for token, num in materials.items():
+                    result[token] += num * value
+                mana += cost * value
             else:
                 result[key] += value
 
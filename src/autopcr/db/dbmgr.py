@@ -1,101 +1,290 @@
-import os, json
-from typing import List
-from ..constants import CACHE_DIR, DATA_DIR
-from .assetmgr import assetmgr
+import asyncio, os, json, multiprocessing, re, sqlite3, time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from ..constants import CACHE_DIR, DATA_DIR, DB_STORE, DB_BUILD_PROCESS, DB_ENGINE_PROFILE, DB_MMAP_SIZE, DB_CACHE_SIZE
+from .assetmgr import assetmgr, update_progress
+from . import store
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.orm import Session
 from ..util.logger import instance as logger
 
+def _create_engine(dbpath: str) -> Tuple[Engine, Optional[sqlite3.Connection]]:
+    '''
+    engine of a master db, which is never written once opened, and the connection it shares if any.
+    default: plain file engine, a connection per session
+    readonly: one shared read-only immutable connection with mmap and a large page cache
+    memory: like readonly, over an in-memory copy of the whole db
+    '''
+    if DB_ENGINE_PROFILE == 'default':
+        return create_engine(f'sqlite:///{dbpath}'), None
+    uri = f'file:{dbpath}?mode=ro&immutable=1'
+    if DB_ENGINE_PROFILE == 'memory':
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        with sqlite3.connect(uri, uri=True) as src:
+            src.backup(conn)
+    else:
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE // 1024}")
+    conn.execute("PRAGMA query_only=ON")
+    # sessions share the connection, it is never closed by them but when the engine is retired
+    return create_engine('sqlite://', creator=lambda: conn, poolclass=StaticPool), conn
+
+# module level so that the spawned worker can pickle it
+def _build_db(bundle: str, dbpath: str, models: List[type], ver: int):
+    '''
+    extracts, unhashes and compiles the db off the event loop,
+    it appears at dbpath only when complete
+    '''
+    tmp = dbpath + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(assetmgr.extract_db(bundle))
+    dbmgr.unhash(tmp)
+    if DB_STORE:
+        store.compile(tmp, os.path.join(os.path.dirname(dbpath), f'{ver}.store'), models, ver)
+    os.replace(tmp, dbpath)
+
+def _open_store(dbpath: str, models: List[type], ver: int) -> store.store:
+    path = os.path.join(os.path.dirname(dbpath), f'{ver}.store')
+    ret = store.store.open(path)
+    if ret is not None and ret.version == ver:
+        engine = create_engine(f'sqlite:///{dbpath}')
+        with Session(engine) as session:
+            existing = set(row[0] for row in session.execute(text("SELECT name FROM sqlite_master WHERE type='table'")))
+        engine.dispose()
+        if all(ret.has(model.__tablename__) for model in models if model.__tablename__ in existing):
+            return ret
+    start = time.time()
+    store.compile(dbpath, path, models, ver)
+    ret = store.store.open(path)
+    logger.info(f'db store {ver} compiled in {time.time() - start:.2f}s, {ret.size() / 1024 / 1024:.1f}MB')
+    return ret
+
+def _load_store(dbpath: str, models: List[type], ver: int) -> Optional[store.store]:
+    if not DB_STORE:
+        return None
+    try:
+        return _open_store(dbpath, models, ver)
+    except Exception as e:
+        logger.exception(f'Failed to open db store of {ver}, using sqlite: {e}')
+        return None
+
+def _prepare_db(dbpath: str, models: List[type], ver: int):
+    # dbs from elsewhere (dbstart) may still be hashed, or lack a store
+    dbmgr.unhash(dbpath)
+    if DB_STORE:
+        _open_store(dbpath, models, ver)
+
 class dbmgr:
     def __init__(self):
         self.ver = None
         self._dbpath = None
         self._engine = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._store: Optional[store.store] = None
+
+    @staticmethod
+    def _executor() -> Executor:
+        if DB_BUILD_PROCESS:
+            return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix='dbbuild')
 
-    async def update_db(self, mgr: assetmgr):
+    async def update_db(self, mgr: assetmgr, models: Iterable[type] = ()):
+        '''
+        builds the db of mgr.ver off the event loop, the current version keeps serving until it is swapped in
+        '''
         ver = mgr.ver
-        self._dbpath = os.path.join(CACHE_DIR, 'db', f'{ver}.db')
-        if not os.path.exists(self._dbpath):
-            data = await mgr.db()
-            with open(self._dbpath, 'wb') as f:
-                f.write(data)
-            logger.info(f'db version {ver} updated')
-        self._engine = create_engine(f'sqlite:///{self._dbpath}')
-        self.ver = ver
-        self.unhash()
+        dbpath = os.path.join(CACHE_DIR, 'db', f'{ver}.db')
+        loop = asyncio.get_running_loop()
+        try:
+            if not os.path.exists(dbpath):
+                start = time.time()
+                bundle = os.path.join(CACHE_DIR, 'db', f'{ver}.unity3d')
+                if not os.path.exists(bundle):
+                    await mgr.download_to('a/masterdata_master.unity3d', bundle)
+                update_progress.start('解包')
+                executor = self._executor()
+                try:
+                    await loop.run_in_executor(executor, _build_db, bundle, dbpath, list(models), ver)
+                finally:
+                    executor.shutdown(wait=False)
+                os.remove(bundle)
+                logger.info(f'db version {ver} updated in {time.time() - start:.2f}s')
+            else:
+                await loop.run_in_executor(None, _prepare_db, dbpath, list(models), ver)
+            engine, conn = await loop.run_in_executor(None, _create_engine, dbpath)
+            try:
+                mmapped = await loop.run_in_executor(None, _load_store, dbpath, list(models), ver)
+            except BaseException:
+                self._retire(engine, conn, None)
+                raise
+        finally:
+            update_progress.start(None)
+        self.open(dbpath, ver, engine, conn, mmapped)
 
-    def session(self) -> Session:
-        return Session(self._engine)
+    def open(self, dbpath: str, ver: int, engine: Optional[Engine] = None, conn: Optional[sqlite3.Connection] = None, mmapped: Optional[store.store] = None):
+        '''
+        swaps in the engine and store of ver, the previous ones are released
+        '''
+        if engine is None:
+            engine, conn = _create_engine(dbpath)
+        old = (self._engine, self._conn, self._store)
+        self._dbpath = dbpath
+        self._engine, self._conn, self._store = engine, conn, mmapped
+        self.ver = ver
+        self._retire(*old)
 
     @staticmethod
-    def get_create_table(session: Session, table_name: str):
-        result = session.execute(text(f"SELECT sql FROM sqlite_master WHERE type='table' AND name='{table_name}'")).fetchone()
-        return result[0] if result else None
+    def _retire(engine: Optional[Engine], conn: Optional[sqlite3.Connection], mmapped: Optional[store.store]):
+        if engine is not None:
+            engine.dispose()
+        if conn is not None:
+            conn.close()
+        if mmapped is not None:
+            mmapped.close()
 
-    @staticmethod
-    def get_table_columns(session: Session, table_name: str):
-        result = session.execute(text(f"PRAGMA table_info({table_name})")).fetchall()
-        return [row[1] for row in result]
+    def session(self) -> Session:
+        return Session(self._engine, info={'store': self._store})
 
-    @staticmethod
-    def exec_transaction(session: Session, commands: List[str]) -> bool:
-        try:
-            for cmd in commands:
-                session.execute(text(cmd))
-            session.commit()
-            return True
-        except Exception as e:
-            logger.error(f"Transaction failed: {e}")
-            session.rollback()
-            return False
+    def open_store(self, models: Iterable[type]):
+        '''
+        mmaps the compiled store of the current version, compiling it first if update_db did not
+        '''
+        old, self._store = self._store, _load_store(self._dbpath, list(models), self.ver)
+        if old is not None and old is not self._store:
+            old.close()
 
-    def unhash(self):
+    @staticmethod
+    def unhash(dbpath: str):
         rainbow_json = os.path.join(DATA_DIR, 'rainbow.json')
         if not os.path.exists(rainbow_json):
             logger.error("Rainbow table not found, unhashing skipped.")
-        else:
-            json_object = json.load(open(rainbow_json, 'r'))
-            logger.info("Start Unhashing DB.")
+            return
+        costs = {}
+        start = time.perf_counter()
+        rainbow = _rainbow.load(rainbow_json)
+        costs['rainbow'] = time.perf_counter() - start
+
+        conn = sqlite3.connect(dbpath, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            start = time.perf_counter()
+            entries = conn.execute("SELECT type, name, tbl_name, sql FROM sqlite_master").fetchall()
+            tables = set(name for type, name, _, _ in entries if type == 'table')
+            for hashed, (intact, _) in rainbow.tables.items():
+                if hashed not in tables and intact not in tables:
+                    logger.warning(f"CreateTableStatement for '{intact}' not found.")
+            renames = []
+            for type, name, table, sql in entries:
+                if table not in rainbow.tables:
+                    continue
+                if rainbow.tables[table][0] in tables:
+                    logger.error(f"Both '{rainbow.tables[table][0]}' and {table} exist, skipped.")
+                    continue
+                renames.append((type, name, rainbow.rewrite(table, name), rainbow.tables[table][0], sql and rainbow.rewrite(table, sql)))
+            costs['rewrite'] = time.perf_counter() - start
+            if not renames:
+                return
+            logger.info(f"Start Unhashing DB, {sum(type == 'table' for type, *_ in renames)} tables.")
 
-            with self.session() as session:
-                for hashed_table_name, cols_dict in json_object.items():
-                    intact_table_name = cols_dict.get("--table_name")
-                    create_table_statement = self.get_create_table(session, hashed_table_name)
-                    create_dec_table_statement = self.get_create_table(session, intact_table_name)
+            start = time.perf_counter()
+            dbmgr._validate(renames)
+            costs['validate'] = time.perf_counter() - start
 
-                    if create_table_statement is None:
-                        if not create_dec_table_statement:
-                            logger.warning(f"CreateTableStatement for '{intact_table_name}' not found.")
-                        continue
+            start = time.perf_counter()
+            if not dbmgr._rename_schema(conn, renames):
+                dbmgr._copy_tables(conn, renames)
+            costs['apply'] = time.perf_counter() - start
+        finally:
+            conn.close()
+        logger.info(f"Unhashing complete. {', '.join(f'{phase} {cost:.2f}s' for phase, cost in costs.items())}")
 
-                    hashed_cols = []
-                    intact_cols = []
+    @staticmethod
+    def _validate(renames: List[tuple]):
+        # the rewritten schema must stand on its own before it replaces the hashed one
+        with sqlite3.connect(':memory:') as mem:
+            for type in ['table', 'index', 'view', 'trigger']:
+                for entry_type, _, _, _, sql in renames:
+                    if entry_type == type and sql:
+                        mem.execute(sql)
 
-                    for hashed_col_name, intact_col_name in cols_dict.items():
-                        if hashed_col_name != "--table_name":
-                            hashed_cols.append(hashed_col_name)
-                            intact_cols.append(intact_col_name)
+    @staticmethod
+    def _rename_schema(conn: sqlite3.Connection, renames: List[tuple]) -> bool:
+        '''
+        renames in place by rewriting sqlite_master, no row is copied
+        '''
+        version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        try:
+            conn.execute("PRAGMA writable_schema=ON")
+            conn.execute("BEGIN")
+            conn.executemany("UPDATE sqlite_master SET name=?, tbl_name=?, sql=? WHERE type=? AND name=?",
+                             [(name, table, sql, type, old_name) for type, old_name, name, table, sql in renames])
+            conn.execute(f"PRAGMA schema_version={version + 1}")
+            conn.execute("COMMIT")
+        except sqlite3.DatabaseError as e:
+            # defensive builds refuse writes to sqlite_master, nothing is written then
+            logger.warning(f"Schema rewrite unavailable, copying tables: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return False
+        finally:
+            conn.execute("PRAGMA writable_schema=OFF")
+        conn.execute("SELECT count(*) FROM sqlite_master").fetchone() # reloads the schema
+        return True
 
-                        create_table_statement = create_table_statement.replace(
-                            hashed_table_name if hashed_col_name == "--table_name" else hashed_col_name,
-                            intact_table_name if hashed_col_name == "--table_name" else intact_col_name
-                        )
+    @staticmethod
+    def _copy_tables(conn: sqlite3.Connection, renames: List[tuple]):
+        conn.execute("BEGIN")
+        for type, old_name, name, table, sql in renames:
+            if type != 'table':
+                continue
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{old_name}")')]
+            conn.execute(sql)
+            intact = [row[1] for row in conn.execute(f'PRAGMA table_info("{name}")')]
+            conn.execute(f"INSERT INTO \"{name}\" (`{'`, `'.join(intact)}`) SELECT `{'`, `'.join(columns)}` FROM \"{old_name}\"")
+            conn.execute(f'DROP TABLE "{old_name}"')
+        for type, _, _, _, sql in renames:
+            if type != 'table' and sql:
+                conn.execute(sql)
+        conn.execute("COMMIT")
 
-                    for hashed_col_name in self.get_table_columns(session, hashed_table_name):
-                        if hashed_col_name not in hashed_cols:
-                            hashed_cols.append(hashed_col_name)
-                            intact_cols.append(hashed_col_name)
 
-                    insert_statement = f"INSERT INTO {intact_table_name} (`{'`, `'.join(intact_cols)}`) SELECT `{'`, `'.join(hashed_cols)}` FROM {hashed_table_name}"
-                    drop_table_statement = f"DROP TABLE {hashed_table_name}"
+class _rainbow:
+    '''
+    rainbow.json compiled once per file version, rewrites are memoized across db versions
+    '''
+    _HASHED = re.compile(r'(?:v1_)?[0-9a-f]{64}')
+    _cache: Optional[Tuple[Tuple[str, float, int], '_rainbow']] = None
 
-                    transaction_cmd = [create_table_statement, insert_statement, drop_table_statement]
+    def __init__(self, raw: Dict[str, Dict[str, str]]):
+        # hashed table -> (table, hashed column -> column)
+        self.tables: Dict[str, Tuple[str, Dict[str, str]]] = {
+            hashed: (cols['--table_name'], {k: v for k, v in cols.items() if k != '--table_name'})
+            for hashed, cols in raw.items()
+        }
+        self._rewrites: Dict[Tuple[str, str], str] = {}
 
-                    if not self.exec_transaction(session, transaction_cmd):
-                        logger.error(f"Failed when executing a transaction for '{intact_table_name}' ({hashed_table_name}). Transaction: {transaction_cmd}")
-                        continue
+    @staticmethod
+    def load(path: str) -> '_rainbow':
+        stat = os.stat(path)
+        key = (path, stat.st_mtime, stat.st_size)
+        if _rainbow._cache is None or _rainbow._cache[0] != key:
+            with open(path, 'r') as f:
+                _rainbow._cache = (key, _rainbow(json.load(f)))
+        return _rainbow._cache[1]
 
-            logger.info("Unhashing complete.")
+    def rewrite(self, table: str, text: str) -> str:
+        '''
+        replaces the hashed names of table in text in one pass
+        '''
+        key = (table, text)
+        if key not in self._rewrites:
+            intact, columns = self.tables[table]
+            self._rewrites[key] = self._HASHED.sub(lambda m: intact if m.group() == table else columns.get(m.group(), m.group()), text)
+        return self._rewrites[key]
 
 
 instance = dbmgr()
@@ -0,0 +1,77 @@
+from typing import Callable, Dict, Iterable, List, Tuple
+import typing
+from ..model.custom import ItemType
+
+'''
+quest x item drop matrix of normal quests, built once per db version.
+stored by item column, so weighting a demand only walks the quests dropping
+the demanded items, and the items of each quest are kept as a bitmask for
+the coverage of lacking items.
+'''
+
+class dropmatrix:
+    def __init__(self, rewards: Dict[int, typing.Counter[ItemType]]):
+        self.quests: List[int] = list(rewards)
+        self.rows: Dict[int, int] = {quest: row for row, quest in enumerate(self.quests)}
+        self.columns: Dict[ItemType, int] = {}
+        # column -> (row, expected drops per run)
+        self.drops: List[List[Tuple[int, float]]] = []
+        self.masks: List[int] = []
+        self.totals: List[float] = []
+        for row, quest in enumerate(self.quests):
+            mask = 0
+            for item, num in rewards[quest].items():
+                if item not in self.columns:
+                    self.columns[item] = len(self.drops)
+                    self.drops.append([])
+                column = self.columns[item]
+                self.drops[column].append((row, num))
+                mask |= 1 << column
+            self.masks.append(mask)
+            self.totals.append(sum(rewards[quest].values()))
+
+    def mask(self, items: Iterable[ItemType]) -> int:
+        ret = 0
+        for item in items:
+            if item in self.columns:
+                ret |= 1 << self.columns[item]
+        return ret
+
+    def weights(self, demand: typing.Counter[ItemType], mapper: Callable[[int], float], bonus: float) -> Dict[int, float]:
+        '''
+        quest -> sum of mapper(demand) * drops over its items,
+        plus bonus if it drops an item still demanded
+        '''
+        base = mapper(0)
+        ret = [base * total for total in self.totals]
+        lack = 0
+        for item, cnt in demand.items():
+            column = self.columns.get(item)
+            if column is None:
+                continue
+            delta = mapper(cnt) - base
+            if delta:
+                for row, num in self.drops[column]:
+                    ret[row] += delta * num
+            if cnt > 0:
+                lack |= 1 << column
+        if lack:
+            for row, mask in enumerate(self.masks):
+                if mask & lack:
+                    ret[row] += bonus
+        return dict(zip(self.quests, ret))
+
+    def cover(self, quests: Iterable[int], items: Iterable[ItemType]) -> List[int]:
+        '''
+        quests in order, each dropping an item not dropped by the ones before, until items are covered
+        '''
+        ret = []
+        uncover = self.mask(items)
+        for quest in quests:
+            if not uncover:
+                break
+            mask = self.masks[self.rows[quest]]
+            if mask & uncover:
+                ret.append(quest)
+                uncover &= ~mask
+        return ret
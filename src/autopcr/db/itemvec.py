@@ -0,0 +1,135 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import compress, repeat
+from typing import Dict, Iterable, List, Optional, Union
+import operator
+import typing
+from ..model.custom import ItemType
+
+'''
+dense item vectors.
+an itemindex numbers the items of a space (ItemType -> int id), an itemvec is an
+array of counts over that space. adding, subtracting and clipping go through
+map over the arrays instead of building a Counter per step, Counter adapters
+are kept for the callers.
+'''
+
+class itemindex:
+    def __init__(self, tokens: Iterable[ItemType] = ()):
+        self.tokens: List[ItemType] = []
+        self.ids: Dict[ItemType, int] = {}
+        for token in tokens:
+            self.id(token)
+
+    def id(self, token: ItemType) -> int:
+        '''id of token, numbered on first use'''
+        ret = self.ids.get(token)
+        if ret is None:
+            ret = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return ret
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __contains__(self, token) -> bool:
+        return token in self.ids
+
+    def vector(self, items: Union[None, typing.Mapping[ItemType, int], Iterable[ItemType]] = None) -> 'itemvec':
+        '''vector of a counter, or of an iterable of items counting each once'''
+        if items is None:
+            return itemvec(self)
+        if isinstance(items, typing.Mapping):
+            counts = [(self.id(token), cnt) for token, cnt in items.items()]
+        else:
+            counts = [(self.id(token), 1) for token in items]
+        ret = itemvec(self) # after numbering new items
+        data = ret.data
+        for id, cnt in counts:
+            data[id] += cnt
+        return ret
+
+class itemvec:
+    __slots__ = ('index', 'data')
+
+    def __init__(self, index: itemindex, data: Optional[array] = None):
+        self.index = index
+        self.data = data if data is not None else array('q', bytes(8 * len(index)))
+
+    def _fit(self) -> array:
+        # the index may have grown since the vector was made
+        if len(self.data) < len(self.index):
+            self.data.extend(repeat(0, len(self.index) - len(self.data)))
+        return self.data
+
+    def copy(self) -> 'itemvec':
+        return itemvec(self.index, array('q', self.data))
+
+    def __getitem__(self, token: ItemType) -> int:
+        id = self.index.ids.get(token)
+        return self.data[id] if id is not None and id < len(self.data) else 0
+
+    def __setitem__(self, token: ItemType, value: int):
+        id = self.index.id(token)
+        self._fit()[id] = value
+
+    def update(self, items: Iterable[ItemType], sign: int = 1) -> 'itemvec':
+        '''counts each of items once in place, the few items of a slot list are not worth a vector'''
+        ids = [self.index.id(token) for token in items]
+        data = self._fit()
+        for id in ids:
+            data[id] += sign
+        return self
+
+    def add(self, other: 'itemvec', scale: int = 1) -> 'itemvec':
+        '''self += other * scale in place'''
+        data, other_data = self._fit(), other._fit()
+        if scale == 1:
+            data[:] = array('q', map(operator.add, data, other_data))
+        else:
+            data[:] = array('q', map(operator.add, data, map(operator.mul, other_data, repeat(scale))))
+        return self
+
+    def sub(self, other: 'itemvec') -> 'itemvec':
+        '''self -= other in place'''
+        return self.add(other, -1)
+
+    def __add__(self, other: 'itemvec') -> 'itemvec':
+        return itemvec(self.index, array('q', map(operator.add, self._fit(), other._fit())))
+
+    def __sub__(self, other: 'itemvec') -> 'itemvec':
+        return itemvec(self.index, array('q', map(operator.sub, self._fit(), other._fit())))
+
+    def clip(self, lo: int = 0) -> 'itemvec':
+        '''max(x, lo) of each item'''
+        return itemvec(self.index, array('q', map(max, self._fit(), repeat(lo))))
+
+    def dot(self, other: 'itemvec') -> int:
+        return sum(map(operator.mul, self._fit(), other._fit()))
+
+    def to_counter(self, positive_only: bool = True) -> typing.Counter[ItemType]:
+        '''counter of the positive (or nonzero) items, like the result of Counter arithmetic'''
+        data = self._fit()
+        select = map(operator.lt, repeat(0), data) if positive_only else data
+        return Counter(dict(compress(zip(self.index.tokens, data), select)))
+
+class prefixsum:
+    '''
+    running sums of the counters of sorted int keys (ranks, rarities),
+    sum(lo, hi) is the total of the keys in [lo, hi) without adding them up again
+    '''
+    def __init__(self, items: typing.Mapping[int, typing.Mapping[ItemType, int]]):
+        self.keys: List[int] = sorted(items)
+        self.index = itemindex(token for key in self.keys for token in items[key])
+        total = self.index.vector()
+        self.prefix: List[itemvec] = [total.copy()]
+        for key in self.keys:
+            total.add(self.index.vector(items[key]))
+            self.prefix.append(total.copy())
+
+    def sum(self, lo: int, hi: int) -> itemvec:
+        i, j = bisect_left(self.keys, lo), bisect_left(self.keys, hi)
+        if j <= i:
+            return self.index.vector()
+        return self.prefix[j] - self.prefix[i]
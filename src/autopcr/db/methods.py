@@ -1,4 +1,5 @@
 from typing import Iterator, Tuple, List
+from sqlalchemy import inspect as sa_inspect
 from ..model.common import eInventoryType
 from ..model.custom import ItemType, UnitAttribute
 from . import models
@@ -89,7 +90,8 @@ class CharaStoryStatus(models.CharaStoryStatus):
 @method
 class PrizegachaDatum(models.PrizegachaDatum):
     def get_prize_memory_id(self) -> Iterator[ItemType]:
-        prize_memory_id_keys: List[str] = [i for i in self.__dict__.keys() if i.startswith("prize_memory_id_")]
+        # from the mapper, store rows and records have no __dict__
+        prize_memory_id_keys: List[str] = [attr.key for attr in sa_inspect(models.PrizegachaDatum).column_attrs if attr.key.startswith("prize_memory_id_")]
         for prize_memory_id_key in prize_memory_id_keys: # fes池 20列 还会更多列
             prize_memory_id = getattr(self, prize_memory_id_key)
             if prize_memory_id != 0:
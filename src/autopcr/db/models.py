@@ -2,19 +2,38 @@
 # type: ignore
 # Data( => Datum(
 
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from sqlalchemy import Integer, REAL, Text, UniqueConstraint
 from sqlalchemy.orm import Session, DeclarativeBase, Mapped, mapped_column
 from typing import Generic, TypeVar
 from ..util.linq import flow
+from . import records
 
 T = TypeVar('T')
 
 class Base(DeclarativeBase, Generic[T]):
+    @classmethod
+    def _store_table(cls, session: Session):
+        store = session.info.get('store')
+        return store.table(cls) if store is not None else None
+
     @classmethod
     def query(cls, session: Session) -> flow[T]:
-        return flow(session.query(cls).all())
+        table = cls._store_table(session)
+        if table is not None:
+            return flow(table.rows(cls))
+        return flow(records.load(session, cls))
+
+    @classmethod
+    def query_dict(cls, session: Session, key: str) -> Dict[Any, T]:
+        '''
+        key -> row, the last row wins like flow.to_dict
+        '''
+        table = cls._store_table(session)
+        if table is not None:
+            return table.mapping(key)
+        return cls.query(session).to_dict(lambda x: getattr(x, key), lambda x: x)
 
 
 class AbdStoryDatum(Base):
@@ -0,0 +1,47 @@
+from typing import Any, Dict, List
+import inspect
+from sqlalchemy import inspect as sa_inspect, select
+from sqlalchemy.orm import Session
+
+'''
+plain records of master tables, loaded with core selects instead of the orm.
+a record is a __slots__ object with the mapped attribute names and the helpers db.methods
+attaches to the model, there is no instance state or identity map behind it.
+records (like store rows) have no __dict__, helpers read columns by name or from the mapper.
+'''
+
+def row_namespace(model) -> Dict[str, Any]:
+    '''
+    class namespace shared by records and store rows of model
+    '''
+    namespace: Dict[str, Any] = {
+        '__tablename__': model.__tablename__,
+        '__module__': model.__module__,
+        '__doc__': model.__doc__,
+    }
+    for name, attr in vars(model).items():
+        # helpers attached by db.methods
+        if not name.startswith('_') and (inspect.isfunction(attr) or isinstance(attr, (property, staticmethod, classmethod))):
+            namespace[name] = attr
+    return namespace
+
+_classes: Dict[type, type] = {}
+
+def record_class(model) -> type:
+    if model not in _classes:
+        attrs = [attr.key for attr in sa_inspect(model).column_attrs]
+        namespace = row_namespace(model)
+        namespace['__slots__'] = tuple(attrs)
+        # positional __init__, a record is built with one call per row
+        source = f"def __init__(_self, {', '.join(attrs)}):\n" + ''.join(f"    _self.{attr} = {attr}\n" for attr in attrs)
+        scope: Dict[str, Any] = {}
+        exec(source, scope)
+        namespace['__init__'] = scope['__init__']
+        namespace['__repr__'] = lambda self: f"<{model.__name__} {', '.join(f'{attr}={getattr(self, attr)!r}' for attr in attrs)}>"
+        _classes[model] = type(model.__name__, (), namespace)
+    return _classes[model]
+
+def load(session: Session, model) -> List[Any]:
+    cls = record_class(model)
+    columns = [attr.columns[0] for attr in sa_inspect(model).column_attrs]
+    return [cls(*row) for row in session.execute(select(*columns))]
@@ -0,0 +1,298 @@
+from array import array
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import json, mmap, os, pickle, sqlite3, sys
+from sqlalchemy import inspect as sa_inspect
+from .records import row_namespace
+
+'''
+compiled master data store.
+per db version the tables queried by `database` are compiled once into <ver>.store:
+a json header followed by column arrays (ints as the narrowest fixed width array,
+floats as doubles, text as offsets into a utf-8 blob) and open addressing hash
+indexes of single column primary keys.
+the file is mmapped, rows are views reading their columns on access, so loading a
+table hydrates no orm objects and the pages are shared through the os page cache.
+'''
+
+MAGIC = b'PCRSTORE'
+FORMAT = 1
+
+_GOLDEN = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+_INT_CODES = [('b', 1 << 7), ('h', 1 << 15), ('i', 1 << 31), ('q', 1 << 63)]
+
+def _columns(model) -> List[tuple]:
+    # (attribute name, column name)
+    return [(attr.key, attr.columns[0].name) for attr in sa_inspect(model).column_attrs]
+
+def _primary_key(model) -> Optional[str]:
+    mapper = sa_inspect(model)
+    if len(mapper.primary_key) != 1:
+        return None
+    return mapper.get_property_by_column(mapper.primary_key[0]).key
+
+def _hash(key: int, shift: int) -> int:
+    return ((key * _GOLDEN) & _MASK64) >> shift
+
+class _writer:
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.size = 0
+
+    def add(self, data: bytes) -> List[int]:
+        ret = [self.size, len(data)]
+        pad = -len(data) % 8
+        self.chunks.append(data + bytes(pad))
+        self.size += len(data) + pad
+        return ret
+
+def _int_code(values: List[int]) -> Optional[str]:
+    lo, hi = min(values, default=0), max(values, default=0)
+    for code, bound in _INT_CODES:
+        if -bound <= lo and hi < bound:
+            return code
+    return None
+
+def _compile_column(writer: _writer, values: List[Any]) -> dict:
+    ret = {}
+    present = [v for v in values if v is not None]
+    if len(present) != len(values):
+        ret['nulls'] = writer.add(bytes(v is None for v in values))
+    types = set(type(v) for v in present)
+    if types <= {int}:
+        code = _int_code(present)
+        if code is not None:
+            ret['kind'] = code
+            ret['data'] = writer.add(array(code, (0 if v is None else v for v in values)).tobytes())
+            return ret
+    elif types == {float}:
+        ret['kind'] = 'd'
+        ret['data'] = writer.add(array('d', (0.0 if v is None else v for v in values)).tobytes())
+        return ret
+    elif types == {str}:
+        encoded = [b'' if v is None else v.encode('utf-8') for v in values]
+        offsets = array('q', [0])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        ret['kind'] = 's'
+        ret['offsets'] = writer.add(offsets.tobytes())
+        ret['data'] = writer.add(b''.join(encoded))
+        return ret
+    # mixed or out of range values are kept as they are
+    ret.pop('nulls', None)
+    ret['kind'] = 'p'
+    ret['data'] = writer.add(pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL))
+    return ret
+
+def _compile_index(writer: _writer, values: List[Any]) -> Optional[dict]:
+    if not all(type(v) is int for v in values) or len(set(values)) != len(values):
+        return None
+    bits = max(1, (len(values) * 2 - 1).bit_length())
+    mask = (1 << bits) - 1
+    shift = 64 - bits
+    slots = array('q', bytes(8 << bits))
+    for row, key in enumerate(values):
+        h = _hash(key, shift)
+        while slots[h]:
+            h = (h + 1) & mask
+        slots[h] = row + 1
+    return {'bits': bits, 'data': writer.add(slots.tobytes())}
+
+def compile(dbpath: str, path: str, models: Iterable[type], version: int):
+    '''
+    compiles the tables of models existing in the db at dbpath into the store at path
+    '''
+    writer = _writer()
+    tables = {}
+    with sqlite3.connect(f'file:{dbpath}?mode=ro', uri=True) as conn:
+        existing = set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'"))
+        for model in models:
+            name = model.__tablename__
+            if name not in existing:
+                continue
+            columns = _columns(model)
+            rows = conn.execute(f"SELECT {', '.join(f'`{column}`' for _, column in columns)} FROM `{name}`").fetchall()
+            desc = {'rows': len(rows), 'columns': {}, 'indexes': {}}
+            for i, (attr, _) in enumerate(columns):
+                values = [row[i] for row in rows]
+                desc['columns'][attr] = _compile_column(writer, values)
+                if attr == _primary_key(model):
+                    index = _compile_index(writer, values)
+                    if index:
+                        desc['indexes'][attr] = index
+            tables[name] = desc
+    header = json.dumps({'format': FORMAT, 'version': version, 'byteorder': sys.byteorder, 'tables': tables}).encode('utf-8')
+    header += b' ' * (-(len(MAGIC) + 8 + len(header)) % 8)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for chunk in writer.chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class _column:
+    def __init__(self, view: memoryview, desc: dict):
+        self.kind: str = desc['kind']
+        self._desc = desc
+        self._view = view
+        self._values: Optional[List[Any]] = None
+
+    def _section(self, name: str) -> memoryview:
+        offset, size = self._desc[name]
+        return self._view[offset:offset + size]
+
+    def getter(self) -> Callable[[int], Any]:
+        '''row -> value'''
+        if self.kind == 'p':
+            if self._values is None:
+                self._values = pickle.loads(self._section('data'))
+            return self._values.__getitem__
+        nulls = self._section('nulls') if 'nulls' in self._desc else None
+        if self.kind == 's':
+            offsets = self._section('offsets').cast('q')
+            blob = self._section('data')
+            get = lambda i: str(blob[offsets[i]:offsets[i + 1]], 'utf-8')
+        else:
+            get = self._section('data').cast(self.kind).__getitem__
+        if nulls is None:
+            return get
+        return lambda i: None if nulls[i] else get(i)
+
+class keyed(Mapping):
+    '''
+    key -> row of a store table, the last row wins like flow.to_dict
+    '''
+    def __init__(self, table: 'table', key: str):
+        self._table = table
+        self._get = table.columns[key].getter()
+        index = table.indexes.get(key)
+        if index:
+            offset, size = index['data']
+            self._slots = table.view[offset:offset + size].cast('q')
+            self._shift = 64 - index['bits']
+            self._mask = (1 << index['bits']) - 1
+            self._rows = None
+        else:
+            self._slots = None
+            self._rows: Optional[Dict[Any, int]] = {self._get(i): i for i in range(table.size)}
+
+    def _find(self, key) -> int:
+        if self._rows is not None:
+            return self._rows.get(key, -1)
+        if not isinstance(key, int):
+            if not isinstance(key, float) or not key.is_integer():
+                return -1
+            key = int(key)
+        h = _hash(key, self._shift)
+        while True:
+            row = self._slots[h]
+            if not row:
+                return -1
+            if self._get(row - 1) == key:
+                return row - 1
+            h = (h + 1) & self._mask
+
+    def __getitem__(self, key):
+        row = self._find(key)
+        if row < 0:
+            raise KeyError(key)
+        return self._table.rows()[row]
+
+    def __contains__(self, key) -> bool:
+        try:
+            return self._find(key) >= 0
+        except TypeError: # unhashable
+            return False
+
+    def __iter__(self) -> Iterator:
+        if self._rows is not None:
+            return iter(self._rows)
+        return (self._get(i) for i in range(self._table.size))
+
+    def __len__(self) -> int:
+        return len(self._rows) if self._rows is not None else self._table.size
+
+    def __repr__(self) -> str:
+        return f'keyed({self._table.name}, {len(self)} rows)'
+
+class table:
+    def __init__(self, name: str, view: memoryview, desc: dict):
+        self.name = name
+        self.view = view
+        self.size: int = desc['rows']
+        self.columns = {attr: _column(view, column) for attr, column in desc['columns'].items()}
+        self.indexes: Dict[str, dict] = desc['indexes']
+        self._rows: Optional[List[Any]] = None
+        self._keyed: Dict[str, keyed] = {}
+        self.model = None
+
+    def _row_class(self, model) -> type:
+        namespace = row_namespace(model)
+        namespace['__slots__'] = ('_i',)
+        for attr, column in self.columns.items():
+            get = column.getter()
+            namespace[attr] = property(lambda self, get=get: get(self._i))
+        namespace['__init__'] = lambda self, i: object.__setattr__(self, '_i', i)
+        namespace['__repr__'] = lambda self: f"<{model.__name__} row {self._i}>"
+        return type(model.__name__, (), namespace)
+
+    def rows(self, model = None) -> List[Any]:
+        if self._rows is None:
+            cls = self._row_class(model or self.model)
+            self._rows = [cls(i) for i in range(self.size)]
+        return self._rows
+
+    def mapping(self, key: str) -> keyed:
+        if key not in self._keyed:
+            self._keyed[key] = keyed(self, key)
+        return self._keyed[key]
+
+class store:
+    def __init__(self, path: str, mm: mmap.mmap, header: dict, offset: int):
+        self.path = path
+        self.version: int = header['version']
+        self._mmap = mm
+        view = memoryview(mm)[offset:]
+        self._tables = {name: table(name, view, desc) for name, desc in header['tables'].items()}
+
+    @staticmethod
+    def open(path: str) -> Optional['store']:
+        '''None if missing or not readable by this build'''
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            size = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(size))
+            if header.get('format') != FORMAT or header.get('byteorder') != sys.byteorder:
+                return None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return store(path, mm, header, len(MAGIC) + 8 + size)
+
+    def has(self, tablename: str) -> bool:
+        return tablename in self._tables
+
+    def table(self, model) -> Optional[table]:
+        ret = self._tables.get(model.__tablename__)
+        if ret is not None and ret.model is None:
+            ret.model = model
+        return ret
+
+    def size(self) -> int:
+        return len(self._mmap)
+
+    def close(self):
+        '''
+        unmaps the file, or lets it go with the last row of it still referenced
+        '''
+        self._tables.clear()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
@@ -1,8 +1,9 @@
+import json
 import os
 import secrets
 from copy import deepcopy
 from datetime import timedelta
-from typing import Callable, Coroutine, Any
+from typing import Callable, Coroutine, Any, Dict
 
 import asyncio
 import quart
@@ -12,11 +13,12 @@ from quart_compress import Compress
 from quart_rate_limiter import RateLimiter, rate_limit, RateLimitExceeded
 
 from .validator import validate_dict, ValidateInfo, validate_ok_dict, enable_manual_validator
-from ..constants import CACHE_DIR, ALLOW_REGISTER, SUPERUSER
-from ..module.accountmgr import Account, AccountManager, instance as usermgr, AccountException, UserData, \
+from ..constants import CACHE_DIR, ALLOW_REGISTER, SUPERUSER, TRACING
+from ..module.accountmgr import BATCHINFO, Account, AccountManager, instance as usermgr, AccountException, UserData, \
     PermissionLimitedException, UserDisabledException, UserException
 from ..util.draw import instance as drawer
 from ..util.logger import instance as logger
+from ..util.storage import instance as storage
 
 APP_VERSION_MAJOR = 1
 APP_VERSION_MINOR = 7
@@ -51,6 +53,7 @@ class HttpServer:
         self.host = host
         self.port = port
         self.validate_server = {}
+        self.batch_cancel: Dict[str, asyncio.Event] = {}
         self.configure_routes()
         self.qq_mod = qq_mod
 
@@ -65,10 +68,12 @@ class HttpServer:
         return response
 
     @staticmethod
-    def wrapaccount(readonly = False):
+    def wrapaccount(readonly = False, job = False):
         def wrapper(func: Callable[..., Coroutine[Any, Any, Any]]):
             async def inner(accountmgr: AccountManager, acc: str, *args, **kwargs):
-                if acc:
+                if acc and job: # runs modules, queued in the scheduler before taking the account lock
+                    return await accountmgr.run_job(acc, lambda mgr: func(mgr, *args, **kwargs), readonly)
+                elif acc:
                     async with accountmgr.load(acc, readonly) as mgr:
                         return await func(mgr, *args, **kwargs)
                 else: 
@@ -197,6 +202,9 @@ class HttpServer:
         @HttpServer.login_required()
         async def get_running_status():
             from ..core.clientpool import instance as clientpool
+            from ..core.apiclient import limiter
+            from ..module.scheduler import instance as scheduler
+            from ..db.assetmgr import update_progress
             sema, farm_sema = clientpool.sema_status()
             ret = []
             for i, (running, waiting, max_count) in enumerate([sema, farm_sema]):
@@ -206,8 +214,41 @@ class HttpServer:
                     'waiting': waiting,
                     'max_running': max_count,
                 })
+            for server, (running, waiting, max_count) in limiter.status().items():
+                ret.append({
+                    'name': f"服务器{server}",
+                    'running': running,
+                    'waiting': waiting,
+                    'max_running': max_count,
+                })
+            ret.extend(scheduler.status())
+            pool = clientpool.pool_status()
+            ret.append({
+                'name': "客户端池",
+                'running': pool['size'],
+                'waiting': 0,
+                'max_running': pool['max_size'],
+                **pool,
+            })
+            progress = update_progress.status()
+            if progress['stage']:
+                ret.append({
+                    'name': f"数据库更新({progress['stage']})",
+                    'running': progress['done'],
+                    'waiting': 0,
+                    'max_running': progress['total'],
+                })
             return {'statuses': ret}, 200
 
+        @self.api.route('/metrics', methods = ["GET"])
+        @HttpServer.login_required()
+        @HttpServer.admin_required()
+        async def get_metrics():
+            if not TRACING:
+                return "未开启性能追踪", 404
+            from ..util.tracing import instance as tracer
+            return tracer.export(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
         @self.api.route('/account', methods = ['GET'])
         @HttpServer.login_required()
         @HttpServer.wrapaccountmgr(readonly = True)
@@ -328,7 +369,7 @@ class HttpServer:
         @self.api.route('/account/<string:acc>/do_daily', methods = ['POST'])
         @HttpServer.login_required()
         @HttpServer.wrapaccountmgr(readonly=True)
-        @HttpServer.wrapaccount()
+        @HttpServer.wrapaccount(job=True)
         async def do_daily(mgr: Account):
             await mgr.do_daily(mgr._parent.secret.clan)
             return mgr.generate_result_info(), 200
@@ -361,7 +402,7 @@ class HttpServer:
         @self.api.route('/account/<string:acc>/do_single', methods = ['POST'])
         @HttpServer.login_required()
         @HttpServer.wrapaccountmgr(readonly=True)
-        @HttpServer.wrapaccount()
+        @HttpServer.wrapaccount(job=True)
         async def do_single(mgr: Account):
             data = await request.get_json()
             order = data.get("order", "")
@@ -370,6 +411,57 @@ class HttpServer:
             resp = [r.response('/daily/api/account/{}' + f'/single_result/{order}/{r.key}') for r in resp]
             return resp, 200
 
+        @self.api.route('/account/<string:acc>/do_single/stream', methods = ['GET'])
+        @HttpServer.login_required()
+        async def do_single_stream(acc: str):
+            if "text/event-stream" not in request.accept_mimetypes:
+                return "", 400
+            if acc != BATCHINFO:
+                return "仅支持批量运行", 400
+            order = request.args.get("order", "")
+            qid: str = current_user.auth_id
+            cancel = asyncio.Event()
+            if qid in self.batch_cancel:
+                self.batch_cancel[qid].set()
+            self.batch_cancel[qid] = cancel
+
+            async def send_events():
+                try:
+                    async with usermgr.load(qid, readonly = True) as accountmgr:
+                        async with accountmgr.load(acc) as mgr:
+                            async for alias, result in mgr.iter_from_key(deepcopy(mgr.config), order, accountmgr.secret.clan, cancel):
+                                ret = json.dumps({'alias': alias, 'status': result.status.value, 'log': result.log}, ensure_ascii=False)
+                                yield f'data: {ret}\n\n'
+                            resp = mgr.get_single_result_list(order)
+                            resp = [r.response('/daily/api/account/{}' + f'/single_result/{order}/{r.key}').to_dict(encode_json=True) for r in resp]
+                            yield f'event: done\ndata: {json.dumps(resp, ensure_ascii=False)}\n\n'
+                except Exception as e:
+                    logger.exception(e)
+                    yield f'event: error\ndata: {json.dumps(str(e), ensure_ascii=False)}\n\n'
+                finally:
+                    if self.batch_cancel.get(qid) is cancel:
+                        self.batch_cancel.pop(qid)
+
+            response = await quart.make_response(
+                send_events(),
+                {
+                    'Content-Type': 'text/event-stream',
+                    'Cache-Control': 'no-cache',
+                    'Transfer-Encoding': 'chunked',
+                },
+            )
+            response.timeout = None
+            return response
+
+        @self.api.route('/account/<string:acc>/do_single/cancel', methods = ['POST'])
+        @HttpServer.login_required()
+        async def cancel_single(acc: str):
+            cancel = self.batch_cancel.get(current_user.auth_id)
+            if not cancel:
+                return "没有正在运行的批量任务", 404
+            cancel.set()
+            return "已取消", 200
+
         @self.api.route('/account/<string:acc>/single_result/<string:order>', methods = ['GET'])
         @HttpServer.login_required()
         @HttpServer.wrapaccountmgr(readonly = True)
@@ -562,4 +654,5 @@ data: {ret}\n\n'''
 
     def run_forever(self, loop):
         self.quart.register_blueprint(self.app)
+        self.quart.after_serving(storage.aflush)
         self.quart.run(host=self.host, port=self.port, loop=loop)
@@ -0,0 +1,171 @@
+#type: ignore
+from enum import Enum
+from typing import Any, Callable, Dict, Type
+import threading
+from pydantic import BaseModel, ValidationError
+from pydantic.main import object_setattr
+from pydantic.fields import ModelField, SHAPE_SINGLETON, SHAPE_LIST
+
+'''
+single pass decoder from raw msgpack object to response model.
+equals to `cls.parse_obj(_no_null_key(obj))`, but nested models are built with `construct`
+and only scalar leaves go through pydantic validators, so the tree is walked once.
+decoders are compiled lazily, after handlers.py has patched the fields. decoding also runs
+on the codec threads, so decoders are compiled under a lock and published once complete.
+'''
+
+Decoder = Callable[[Any], Any]
+
+_decoders: Dict[type, Decoder] = {}
+_compiling: Dict[type, Decoder] = {} # decoders being filled, seen only by the compiling thread
+_lock = threading.RLock()
+
+def no_null_key(obj):
+    if type(obj) == dict:
+        if None in obj and not [1 for k in obj if type(k) is not int and k is not None]:
+            return [no_null_key(v1) for k1, v1 in sorted(((k, v) for k, v in obj.items() if k is not None), key=lambda x: x[0])]
+        return {k: no_null_key(v) for k, v in obj.items() if k is not None}
+    elif type(obj) == list:
+        return [no_null_key(v) for v in obj]
+    else:
+        return obj
+
+def _as_list(obj):
+    # msgpack encodes some arrays as {None: .., 0: .., 1: ..}
+    if type(obj) == dict and None in obj and not [1 for k in obj if type(k) is not int and k is not None]:
+        return [v for k, v in sorted(((k, v) for k, v in obj.items() if k is not None), key=lambda x: x[0])]
+    return obj
+
+def _is_model(tp) -> bool:
+    return isinstance(tp, type) and issubclass(tp, BaseModel)
+
+def _generic(field: ModelField, cls: type) -> Decoder:
+    def decode(v):
+        if v is None:
+            return None
+        value, errors = field.validate(no_null_key(v), {}, loc=field.alias, cls=cls)
+        if errors:
+            raise ValidationError([errors], cls)
+        return value
+    return decode
+
+def _scalar(field: ModelField, cls: type) -> Decoder:
+    generic = _generic(field, cls)
+    tp = field.type_
+    if tp is bool:
+        def decode(v):
+            if v == 0 or v == 1:
+                return bool(v)
+            return generic(v)
+        return decode
+    if isinstance(tp, type) and issubclass(tp, Enum):
+        def decode(v):
+            try:
+                return tp(v)
+            except ValueError:
+                return generic(v)
+        return decode
+    return generic
+
+def _field(field: ModelField, cls: type) -> Decoder:
+    if field.shape == SHAPE_SINGLETON:
+        if _is_model(field.type_):
+            sub = get_decoder(field.type_)
+            return lambda v: None if v is None else sub(v)
+        return _scalar(field, cls)
+    if field.shape == SHAPE_LIST:
+        if _is_model(field.type_):
+            sub = get_decoder(field.type_)
+            generic = _generic(field, cls)
+            def decode(v):
+                v = _as_list(v)
+                if type(v) is not list or any(x is None for x in v):
+                    return generic(v) # None elements raise like parse_obj
+                return [sub(x) for x in v]
+            return decode
+        if field.type_ in (int, str, float, bool):
+            tp = field.type_
+            generic = _generic(field, cls)
+            def decode(v):
+                v = _as_list(v)
+                if type(v) is list and all(type(x) is tp for x in v):
+                    return v
+                return generic(v)
+            return decode
+    return _generic(field, cls)
+
+def _exact_type(field: ModelField) -> type:
+    # values of this type are taken as is, without calling the field decoder
+    if field.shape == SHAPE_SINGLETON and field.type_ in (int, str, float, bool):
+        return field.type_
+    return _Never
+
+class _Never: ...
+
+_IMMUTABLE = (type(None), int, str, float, bool, tuple, frozenset, Enum)
+
+def _builder(cls: Type[BaseModel]) -> Callable[[dict], BaseModel]:
+    # same as cls.construct, without re-collecting the defaults on every call
+    if cls.__private_attributes__:
+        return lambda values: cls.construct(set(values), **values)
+    defaults = {}
+    factories = {}
+    for name, field in cls.__fields__.items():
+        if field.required:
+            continue
+        if field.default_factory is None and isinstance(field.default, _IMMUTABLE):
+            defaults[name] = field.default
+        else:
+            factories[name] = field.get_default
+    def build(values: dict) -> BaseModel:
+        fields_set = set(values)
+        fields_values = dict(defaults)
+        for name, factory in factories.items():
+            if name not in fields_set:
+                fields_values[name] = factory()
+        fields_values.update(values)
+        m = cls.__new__(cls)
+        object_setattr(m, '__dict__', fields_values)
+        object_setattr(m, '__fields_set__', fields_set)
+        return m
+    return build
+
+def _compile(cls: Type[BaseModel]) -> Decoder:
+    steps = []
+    build = _builder(cls)
+    def decode(obj):
+        if type(obj) is not dict:
+            return cls.parse_obj(no_null_key(obj))
+        values = {}
+        for alias, name, tp, conv in steps:
+            if alias in obj:
+                v = obj[alias]
+                values[name] = v if type(v) is tp or v is None else conv(v)
+        return build(values)
+    # register before compiling fields, models may refer to themselves
+    _compiling[cls] = decode
+    steps.extend((field.alias, name, _exact_type(field), _field(field, cls)) for name, field in cls.__fields__.items())
+    return decode
+
+def get_decoder(cls: Type[BaseModel]) -> Decoder:
+    ret = _decoders.get(cls)
+    if ret is not None:
+        return ret
+    with _lock:
+        if cls in _decoders:
+            return _decoders[cls]
+        if cls in _compiling: # recursion of the compiling thread
+            return _compiling[cls]
+        outer = not _compiling
+        try:
+            ret = _compile(cls)
+            if outer:
+                # decoders compiled along may refer to each other, all are complete only now
+                _decoders.update(_compiling)
+            return ret
+        finally:
+            if outer:
+                _compiling.clear()
+
+def decode(cls: Type[BaseModel], obj: Any) -> BaseModel:
+    return get_decoder(cls)(obj)
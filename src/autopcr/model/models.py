@@ -9,3 +9,6 @@ from .responses import *
 from .error import *
 
 from . import handlers
+
+from . import registry
+registry.build()
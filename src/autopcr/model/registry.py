@@ -0,0 +1,35 @@
+#type: ignore
+from typing import Dict, NamedTuple, Type
+from .modelbase import Request, Response
+
+class RequestInfo(NamedTuple):
+    response: type # concrete Response[cls]
+    response_cls: type
+    url: str
+    crypted: bool
+
+_registry: Dict[type, RequestInfo] = {}
+
+def _resolve(cls: Type[Request]) -> RequestInfo:
+    response_cls = next(
+        base.__args__[0] for klass in cls.__mro__
+        for base in getattr(klass, '__orig_bases__', ())
+        if getattr(base, '__origin__', None) is Request
+    )
+    sample = cls.construct()
+    return RequestInfo(Response[response_cls], response_cls, sample.url, sample.crypted)
+
+def _subclasses(cls: type):
+    for sub in cls.__subclasses__():
+        yield sub
+        yield from _subclasses(sub)
+
+def build():
+    for cls in _subclasses(Request):
+        if cls not in _registry:
+            _registry[cls] = _resolve(cls)
+
+def get(cls: Type[Request]) -> RequestInfo:
+    if cls not in _registry: # request class defined after build
+        _registry[cls] = _resolve(cls)
+    return _registry[cls]
@@ -7,10 +7,10 @@ from werkzeug.exceptions import Forbidden
 from copy import copy
 
 from ..core.sdkclient import account, platform
-from .modulemgr import ModuleManager, TaskResult, ModuleResult, eResultStatus, TaskResultInfo, ModuleResultInfo, ResultInfo
+from .modulemgr import ModuleManager, TaskResult, ModuleResult, ResultTable, eResultStatus, TaskResultInfo, ModuleResultInfo, ResultInfo
 import os, re, shutil
-from typing import Any, Dict, Iterator, List, Tuple, Union
-from ..constants import CLAN_BATTLE_FORBID_PATH, CONFIG_PATH, OLD_CONFIG_PATH, RESULT_DIR, BSDK, CHANNEL_OPTION, SUPERUSER
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Tuple, TypeVar, Union
+from ..constants import BATCH_CONCURRENCY, CLAN_BATTLE_FORBID_PATH, CONFIG_PATH, OLD_CONFIG_PATH, RESULT_DIR, BSDK, CHANNEL_OPTION, SUPERUSER
 from asyncio import Lock
 import json
 from copy import deepcopy
@@ -21,6 +21,8 @@ import traceback
 from ..core.clientpool import instance as clientpool, PoolClientWrapper
 from ..sdk.sdkclients import create
 from ..util.logger import instance as logger
+from ..util.storage import instance as storage
+from .scheduler import instance as scheduler, ePriority
 
 class AccountException(Exception):
     pass
@@ -53,6 +55,8 @@ class UserData:
 
 BATCHINFO = "BATCH_RUNNER"
 
+T = TypeVar('T')
+
 class Account(ModuleManager):
     _account_locks: Dict[str, Lock] = dict()
 
@@ -63,16 +67,15 @@ class Account(ModuleManager):
         self.readonly = readonly
         self._id = hashlib.md5(account.encode('utf-8')).hexdigest()
 
-        if not os.path.exists(self._filename):
+        registry = parent._parent.registry
+        if registry.account(qid, account) is None:
             if account == BATCHINFO:
-                with open(self._filename, 'w') as f:
-                    f.write(AccountData().to_json())
+                registry.save_account(qid, account, AccountData())
             else:
                 raise AccountException("账号不存在")
 
-        with open(self._filename, 'r') as f:
-            self.data: AccountData = AccountData.from_json(f.read())
-            self.old_data: AccountData = deepcopy(self.data)
+        self.old_data: AccountData = registry.account(qid, account)
+        self.data: AccountData = deepcopy(self.old_data)
 
         self.qq = qid
         self.alias = account
@@ -98,8 +101,7 @@ class Account(ModuleManager):
             logger.debug(f"Release lock {self._filename}")
 
     async def save_data(self):
-        with open(self._filename, 'w') as f:
-            f.write(self.data.to_json())
+        self._parent._parent.registry.save_account(self.qq, self.alias, deepcopy(self.data))
 
     async def push_result(self, result_list: List[Any], result: ResultInfo) -> List[Any]:
         while len(result_list) >= 4:
@@ -232,6 +234,45 @@ class Account(ModuleManager):
         username = self.data.username.lower()
         return self._parent._parent.is_clan_battle_forbidden(username)
 
+class BatchResultMerger:
+    '''
+    merges per-account results of a batch as they arrive, in batch order
+    '''
+    def __init__(self, order: List[str]):
+        self.order = order
+        self.results: Dict[str, ModuleResult] = {}
+        self.rows: Dict[str, List[Dict[str, Any]]] = {}
+
+    def __bool__(self):
+        return bool(self.results)
+
+    def add(self, alias: str, result: ModuleResult):
+        self.results[alias] = result
+        self.rows[alias] = [{**d, '昵称': alias, '状态': f"#{result.status.value}"} for d in result.table.data]
+
+    def result(self) -> ModuleResult:
+        ret_list = [(alias, self.results[alias]) for alias in self.order if alias in self.results]
+        ret = copy(ret_list[0][1])
+        ret.log = '\n'.join(f"==={name}===\n{x.log}" for name, x in ret_list if x.log)
+        if len(ret_list) < len(self.order):
+            ret.log = f"批量任务已取消，完成{len(ret_list)}/{len(self.order)}\n" + ret.log
+        ret.status = eResultStatus.ERROR if any(x.status == eResultStatus.ERROR for _, x in ret_list) else eResultStatus.WARNING if any(x.status == eResultStatus.WARNING for _, x in ret_list) or len(ret_list) < len(self.order) else eResultStatus.SUCCESS
+        ret.table = ResultTable()
+        if any(x.table.header for _, x in ret_list):
+            ret.table.header = ["昵称", '状态'] + next(x.table.header for _, x in ret_list if x.table.header)
+            ret.table.data = [row for name, _ in ret_list for row in self.rows[name]]
+        else:
+            ret.table.header = ["昵称", "状态", "结果"]
+            ret.table.data = [
+                {
+                 '昵称': name,
+                 '状态': f"#{x.status.value}",
+                 '结果': x.log
+                }
+                for name, x in ret_list
+            ]
+        return ret
+
 class AccountBatch(Account):
     def __init__(self, parent: 'AccountManager', qid: str, accounts: str = BATCHINFO, readonly: bool = False, force_use_all: bool = False):
         super().__init__(parent, qid, accounts, readonly)
@@ -250,49 +291,70 @@ class AccountBatch(Account):
             'area': super().generate_tab(clan = self._parent.secret.clan, batch = True)
         }
 
-    async def do_from_key(self, config: dict, key: str, isAdminCall: bool = False) -> List[ModuleResultInfo]:
+    async def _run_from_key(self, config: dict, key: str, isAdminCall: bool, cancel: asyncio.Event) -> AsyncIterator[Tuple[str, Union[ModuleResultInfo, BaseException]]]:
         async def do_from_key_pre(alias: str):
             async with self._parent.load(alias) as acc:
                 res = await acc.do_from_key(config, key, isAdminCall)
                 return res
+        farmer = self._parent.farmer
 
         loop = asyncio.get_event_loop()
-        alias = []
-        task = []
-        for acc in self.enable_account:
-            alias.append(acc)
-            task.append(loop.create_task(do_from_key_pre(acc)))
-
-        resps = await asyncio.gather(*task, return_exceptions=True)
-
-        if resps:
-            ret_list = [x.get_result() for x in resps]
-            ret = copy(ret_list[0])
-            ret.log = '\n'.join(f"==={name}===\n{x.log}" for name, x in zip(alias, ret_list) if x.log)
-            ret.status = eResultStatus.ERROR if any(x.status == eResultStatus.ERROR for x in ret_list) else eResultStatus.WARNING if any(x.status == eResultStatus.WARNING for x in ret_list) else eResultStatus.SUCCESS
-            if any(r.table.header for r in ret_list):
-                ret.table.header = next(r.table.header for r in ret_list)
-                ret.table.header = ["昵称", '状态'] + ret.table.header
-                ret.table.data = [
-                    {**d, '昵称': name, '状态': f"#{x.status.value}"}
-                    for name, x in zip(alias, ret_list)
-                    if x.table
-                    for d in x.table.data
-                ]
-            else:
-                ret.table.header = ["昵称", "状态", "结果"]
-                ret.table.data = [
-                    {
-                     '昵称': name, 
-                     '状态': f"#{x.status.value}",
-                     '结果': x.log
-                    }
-                    for name, x in zip(alias, ret_list)
-                ]
-            all = await self.save_single_result(key, ret)
-            resps = [all] + resps
-        self.data.single_result[key] = resps
-        return resps
+        todo = iter(self.enable_account)
+        running: Dict[asyncio.Task, str] = {}
+        def fill():
+            for acc in todo:
+                running[loop.create_task(scheduler.run(self.qq, ePriority.BATCH, farmer, lambda acc=acc: do_from_key_pre(acc)))] = acc
+                if len(running) >= BATCH_CONCURRENCY:
+                    break
+
+        cancelled = loop.create_task(cancel.wait())
+        fill()
+        try:
+            while running and not cancel.is_set():
+                done, _ = await asyncio.wait([*running, cancelled], return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is cancelled:
+                        continue
+                    yield running.pop(task), task.exception() or task.result()
+                fill()
+        finally:
+            cancelled.cancel()
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    async def iter_from_key(self, config: dict, key: str, isAdminCall: bool = False, cancel: asyncio.Event = None) -> AsyncIterator[Tuple[str, ModuleResult]]:
+        '''
+        runs key on the enabled accounts, at most BATCH_CONCURRENCY at a time, and yields
+        (alias, result) as each account finishes. setting cancel or closing the iterator stops
+        the remaining accounts. the merged result is saved in either case.
+        '''
+        merger = BatchResultMerger(self.enable_account)
+        infos: Dict[str, ModuleResultInfo] = {}
+        runs = self._run_from_key(config, key, isAdminCall, cancel or asyncio.Event())
+        try:
+            async for alias, res in runs:
+                if isinstance(res, BaseException):
+                    logger.error(f"batch {key} of {alias} failed: {res}")
+                    result = ModuleResult(status = eResultStatus.ERROR, log = str(res))
+                else:
+                    infos[alias] = res
+                    result = res.get_result()
+                merger.add(alias, result)
+                yield alias, result
+        finally:
+            await runs.aclose()
+            resps = [infos[alias] for alias in self.enable_account if alias in infos]
+            if merger:
+                all = await self.save_single_result(key, merger.result())
+                resps = [all] + resps
+            self.data.single_result[key] = resps
+
+    async def do_from_key(self, config: dict, key: str, isAdminCall: bool = False) -> List[ModuleResultInfo]:
+        async for _ in self.iter_from_key(config, key, isAdminCall):
+            pass
+        return self.data.single_result[key]
 
     async def do_daily(self):
         raise NotImplementedError
@@ -310,9 +372,10 @@ class AccountManager:
         self.readonly = readonly
         self._lck = AccountManager._user_locks.setdefault(self.root, Lock())
         
-        with open(self.root + '/secret', 'r') as f:
-            self.secret: UserData = UserData.from_json(f.read())
-            self.old_secret = deepcopy(self.secret)
+        self.old_secret: UserData = parent.registry.secret(qid)
+        if self.old_secret is None:
+            raise UserException('用户不存在')
+        self.secret: UserData = deepcopy(self.old_secret)
 
         self.secret.clan |= self.qid.startswith('g')
 
@@ -331,18 +394,28 @@ class AccountManager:
     def farmer(self) -> bool:
         return not self.secret.clan and self.account_count() > 10
 
+    async def run_job(self, account: str, func: Callable[[Account], Awaitable[T]], readonly: bool = False) -> T:
+        '''
+        func(account) as an interactive job. the scheduler slot is taken before the account lock,
+        like cron and batch jobs do, so no path holds a lock while waiting for a slot
+        '''
+        async def job():
+            async with self.load(account, readonly) as mgr:
+                return await func(mgr)
+        if account == BATCHINFO: # the accounts of a batch are queued as batch jobs
+            return await job()
+        return await scheduler.run(self.qid, ePriority.INTERACTIVE, self.farmer, job)
+
     def create_account(self, account: str) -> Account:
         if not AccountManager.pathsyntax.fullmatch(account):
             raise AccountException(f'非法账户名{account}')
         if account in self.accounts():
             raise AccountException('账号已存在')
-        with open(self.path(account), 'w') as f:
-            f.write(AccountData().to_json())
+        self._parent.registry.save_account(self.qid, account, AccountData())
         return self.load(account)
 
     def save_secret(self):
-        with open(self.root + '/secret', 'w') as f:
-            f.write(self.secret.to_json())
+        self._parent.registry.save_secret(self.qid, deepcopy(self.secret))
 
     def set_default_account(self, account: str):
         if account not in self.accounts():
@@ -374,7 +447,7 @@ class AccountManager:
     def delete(self, account: str): 
         if not AccountManager.pathsyntax.fullmatch(account):
             raise AccountException(f'非法账户名{account}')
-        os.remove(self.path(account))
+        self._parent.registry.remove_account(self.qid, account)
 
     def delete_all_accounts(self):
         for account in self.accounts():
@@ -388,13 +461,10 @@ class AccountManager:
         return self.secret.default_account
 
     def accounts(self) -> Iterator[str]:
-        account_files = sorted(os.listdir(self.root))
-        for fn in account_files:
-            if fn.endswith('.json') and not fn.startswith(BATCHINFO):
-                yield fn[:-5]
+        yield from self._parent.registry.accounts(self.qid)
 
     def account_count(self) -> int:
-        return sum(1 for _ in self.accounts())
+        return self._parent.registry.account_count(self.qid)
 
     async def create_accounts_from_tsv(self, tsv: str) -> Tuple[bool, str]:
         acc = []
@@ -423,8 +493,7 @@ class AccountManager:
             return False, '\n'.join(msg)
 
         for alias, username, password, channel in acc:
-            with open(self.path(alias), 'w') as f:
-                f.write(AccountData(username = username, password = password, channel = channel).to_json())
+            self._parent.registry.save_account(self.qid, alias, AccountData(username = username, password = password, channel = channel))
         return True, f'成功导入{len(acc)}个账号'
 
     async def generate_info(self):
@@ -452,6 +521,110 @@ class AccountManager:
         return SUPERUSER == self.qid
 
 
+class AccountRegistry:
+    '''
+    parsed secrets and account data of every user, read from the config directory once
+    and kept in sync by the write paths below, which persist through storage.
+    returned data is shared, copy before modifying.
+    listeners are called with (qid, account, data) on every change, data is None on removal.
+    '''
+    def __init__(self, root: str):
+        self.root = root
+        self._secrets: Dict[str, Union[UserData, None]] = None
+        self._accounts: Dict[str, Dict[str, AccountData]] = None
+        self._sorted: Dict[str, List[str]] = {}
+        self.listeners: List[Callable[[str, str, Union[AccountData, None]], None]] = []
+
+    def _notify(self, qid: str, account: str, data: Union[AccountData, None]):
+        for listener in self.listeners:
+            listener(qid, account, data)
+
+    def _user_path(self, qid: str) -> str:
+        return os.path.join(self.root, qid)
+
+    def _account_path(self, qid: str, account: str) -> str:
+        return os.path.join(self.root, qid, account + '.json')
+
+    def _ensure_loaded(self):
+        if self._secrets is None:
+            self._secrets = {}
+            self._accounts = {}
+            for qid in os.listdir(self.root):
+                if os.path.isdir(self._user_path(qid)):
+                    self.reload_user(qid)
+
+    def reload_user(self, qid: str):
+        self._ensure_loaded()
+        self._sorted.pop(qid, None)
+        for account in self._accounts.get(qid, {}):
+            self._notify(qid, account, None)
+        secret = storage.read(os.path.join(self._user_path(qid), 'secret'))
+        self._secrets[qid] = UserData.from_json(secret) if secret is not None else None
+        accounts = self._accounts[qid] = {}
+        for fn in os.listdir(self._user_path(qid)):
+            if not fn.endswith('.json'):
+                continue
+            try:
+                accounts[fn[:-5]] = AccountData.from_json(storage.read(os.path.join(self._user_path(qid), fn)))
+            except Exception as e:
+                logger.exception(f"Failed to load account {qid} {fn}: {e}")
+        for account, data in accounts.items():
+            self._notify(qid, account, data)
+
+    def qids(self) -> List[str]:
+        self._ensure_loaded()
+        return list(self._secrets)
+
+    def secret(self, qid: str) -> Union[UserData, None]:
+        self._ensure_loaded()
+        return self._secrets.get(qid, None)
+
+    def save_secret(self, qid: str, secret: UserData):
+        self._ensure_loaded()
+        self._secrets[qid] = secret
+        self._accounts.setdefault(qid, {})
+        storage.write(os.path.join(self._user_path(qid), 'secret'), secret.to_json())
+
+    def remove_user(self, qid: str):
+        self._ensure_loaded()
+        self._secrets.pop(qid, None)
+        for account in self._accounts.pop(qid, {}):
+            self._notify(qid, account, None)
+        self._sorted.pop(qid, None)
+        storage.discard(self._user_path(qid) + os.sep)
+
+    def accounts(self, qid: str) -> List[str]:
+        self._ensure_loaded()
+        if qid not in self._sorted:
+            self._sorted[qid] = sorted(account for account in self._accounts.get(qid, {}) if not account.startswith(BATCHINFO))
+        return self._sorted[qid]
+
+    def account_count(self, qid: str) -> int:
+        return len(self.accounts(qid))
+
+    def account(self, qid: str, account: str) -> Union[AccountData, None]:
+        self._ensure_loaded()
+        return self._accounts.get(qid, {}).get(account, None)
+
+    def save_account(self, qid: str, account: str, data: AccountData):
+        self._ensure_loaded()
+        accounts = self._accounts.setdefault(qid, {})
+        if account not in accounts:
+            self._sorted.pop(qid, None)
+        accounts[account] = data
+        storage.write(self._account_path(qid, account), data.to_json())
+        self._notify(qid, account, data)
+
+    def remove_account(self, qid: str, account: str):
+        self._ensure_loaded()
+        if self._accounts.get(qid, {}).pop(account, None) is not None:
+            self._sorted.pop(qid, None)
+            self._notify(qid, account, None)
+        path = self._account_path(qid, account)
+        storage.discard(path)
+        if os.path.exists(path):
+            os.remove(path)
+
 class UserManager:
     pathsyntax = re.compile(r'g?\d{5,12}')
 
@@ -461,6 +634,7 @@ class UserManager:
 
         # 初始不存在root目录，创建一下
         os.makedirs(self.root, exist_ok=True)
+        self.registry = AccountRegistry(self.root)
         self.load_clan_battle_forbidden()
 
     def load_clan_battle_forbidden(self):
@@ -507,8 +681,7 @@ class UserManager:
         if qid in self.qids():
             raise UserException('QQ号已存在')
         os.makedirs(self.qid_path(qid))
-        with open(self.qid_path(qid) + '/secret', 'w') as f:
-            f.write(UserData(password=password).to_json())
+        self.registry.save_secret(qid, UserData(password=password))
         self.shift_old_accounts(qid)
         logger.info(f"Create user {qid}")
         return AccountManager(self, qid)
@@ -523,6 +696,7 @@ class UserManager:
                     ok = True
             if ok:
                 os.rename(config, os.path.join(self.qid_path(qid), data['alian'] + '.json'))
+                self.registry.reload_user(qid)
 
     def load(self, qid: str, readonly: bool = False) -> AccountManager:
         if not UserManager.pathsyntax.fullmatch(qid):
@@ -535,11 +709,10 @@ class UserManager:
         if account:
             self.load(qid).delete(account)
         else:
+            self.registry.remove_user(qid)
             shutil.rmtree(self.qid_path(qid))
 
     def qids(self) -> Iterator[str]:
-        for fn in os.listdir(self.root):
-            if os.path.isdir(os.path.join(self.root, fn)):
-                yield fn
+        yield from self.registry.qids()
 
 instance = UserManager(os.path.join(CONFIG_PATH))
@@ -1,15 +1,20 @@
 import asyncio
 import aiofiles
+from collections import defaultdict
 from dataclasses import dataclass
 import datetime
 from enum import Enum
+from typing import Dict, List, Set, Tuple, Union
+import zlib
 
 from dataclasses_json import dataclass_json
 
 from ..module.modulebase import eResultStatus
-from ..module.accountmgr import instance as usermgr, AccountManager
+from ..module.modulemgr import ModuleManager
+from ..module.accountmgr import instance as usermgr, AccountManager, AccountData, BATCHINFO
 from ..db.database import db
-from ..constants import CACHE_DIR
+from ..constants import CACHE_DIR, CRON_JITTER_WINDOW, CRON_JOB_DEADLINE, CRON_PREWARM_MINUTES
+from .scheduler import instance as scheduler, ePriority
 import os
 from ..util.logger import instance as logger
 
@@ -32,6 +37,65 @@ class CronLog:
     def __str__(self):
         return f"{db.format_time(self.time)} {self.operation.value} cron job: {self.qid} {self.account} {self.status.value}"
 
+class CronIndex:
+    '''
+    minute of day -> (qid, account, cron key) of enabled cron modules,
+    kept in sync with account configs through the account registry
+    '''
+    def __init__(self):
+        self._due: Dict[int, Set[Tuple[str, str, str]]] = defaultdict(set)
+        self._entries: Dict[Tuple[str, str], List[Tuple[int, str]]] = {}
+        self._built = False
+
+    @staticmethod
+    def _schedule(data: AccountData) -> List[Tuple[int, str]]:
+        mgr = ModuleManager(data.config)
+        ret = []
+        for cron in mgr.modules_list.cron_modules:
+            if cron.get_config(cron.key):
+                hour, minute = cron.get_cron_time().split(':')[:2]
+                ret.append((int(hour) * 60 + int(minute), cron.key))
+        return ret
+
+    def update(self, qid: str, account: str, data: Union[AccountData, None]):
+        for minute, key in self._entries.pop((qid, account), []):
+            self._due[minute].discard((qid, account, key))
+        if data is None or account.startswith(BATCHINFO):
+            return
+        try:
+            entries = self._schedule(data)
+        except Exception as e:
+            logger.exception(f"invalid cron config of {qid} {account}: {e}")
+            return
+        self._entries[(qid, account)] = entries
+        for minute, key in entries:
+            self._due[minute].add((qid, account, key))
+
+    def build(self):
+        if self._built:
+            return
+        registry = usermgr.registry
+        for qid in registry.qids():
+            for account in registry.accounts(qid):
+                self.update(qid, account, registry.account(qid, account))
+        registry.listeners.append(self.update)
+        self._built = True
+
+    def due(self, hour: int, minute: int) -> Dict[str, List[str]]:
+        self.build()
+        ret: Dict[str, List[str]] = defaultdict(list)
+        for qid, account in sorted(set((qid, account) for qid, account, _ in self._due.get(hour * 60 + minute, ()))):
+            ret[qid].append(account)
+        return ret
+
+cron_index = CronIndex()
+
+def _jitter(qid: str, account: str) -> float:
+    # stable per account, so an account keeps its slot across days
+    if CRON_JITTER_WINDOW <= 0:
+        return 0
+    return zlib.crc32(f"{qid}/{account}".encode('utf-8')) % (CRON_JITTER_WINDOW * 1000) / 1000
+
 async def _cron(task):
     last = datetime.datetime.now() - datetime.timedelta(minutes=1)
     while True:
@@ -42,7 +106,16 @@ async def _cron(task):
             asyncio.get_event_loop().create_task(task(last))
 
 async def real_run_cron(accountmgr: AccountManager, accounts_to_run, cur):
+    deadline = cur.timestamp() + CRON_JOB_DEADLINE
     async def run_one_account(account):
+        await asyncio.sleep(_jitter(accountmgr.qid, account))
+        try:
+            await scheduler.run(accountmgr.qid, ePriority.CRON, accountmgr.farmer, lambda: run_account(account), deadline)
+        except Exception as e:
+            logger.exception(f"error in cron job {accountmgr.qid} {account}: {e}")
+            await write_cron_log(eCronOperation.START, cur,  accountmgr.qid, account, eResultStatus.ERROR, str(e))
+
+    async def run_account(account):
         nonlocal cur
         async with accountmgr.load(account) as mgr:
             try:
@@ -61,14 +134,39 @@ async def real_run_cron(accountmgr: AccountManager, accounts_to_run, cur):
     await accountmgr.__aexit__(None, None, None)
     
 
+async def _prewarm_crons(cur: datetime.datetime):
+    target = cur + datetime.timedelta(minutes=CRON_PREWARM_MINUTES)
+    # staggered over the lead time, leaving the last minute for stragglers
+    spread = max(1, (CRON_PREWARM_MINUTES - 1) * 60)
+
+    async def prewarm_one_qid(qid: str, accounts: List[str]):
+        async with usermgr.load(qid, readonly=True) as accountmgr:
+            farmer = accountmgr.farmer
+            async def warm(account: str):
+                async with accountmgr.load(account) as mgr:
+                    if await mgr.is_cron_run(target.hour, target.minute):
+                        await mgr.prewarm()
+            async def prewarm_one_account(account: str):
+                await asyncio.sleep(zlib.crc32(f"{qid}/{account}".encode('utf-8')) % spread)
+                try:
+                    await scheduler.run(qid, ePriority.PREWARM, farmer, lambda: warm(account), target.timestamp())
+                except Exception as e:
+                    logger.warning(f"prewarm of {qid} {account} failed: {e}")
+            await asyncio.gather(*[prewarm_one_account(account) for account in accounts])
+
+    due = cron_index.due(target.hour, target.minute)
+    if due:
+        logger.info(f"prewarming {sum(len(accounts) for accounts in due.values())} accounts for {target.hour} {target.minute}")
+    await asyncio.gather(*[prewarm_one_qid(qid, accounts) for qid, accounts in due.items()])
+
 async def _run_crons(cur: datetime.datetime):
     logger.info(f"doing cron check in {cur.hour} {cur.minute}")
-    async def run_one_qid(qid):
+    async def run_one_qid(qid, accounts):
         accountmgr = usermgr.load(qid, readonly=True)
         await accountmgr.__aenter__()
         try:
             accounts_to_run = []
-            for account in accountmgr.accounts():
+            for account in accounts:
                 async with accountmgr.load(account, readonly=True) as mgr:
                     if await mgr.is_cron_run(cur.hour, cur.minute):
                         accounts_to_run.append(account)
@@ -80,7 +178,8 @@ async def _run_crons(cur: datetime.datetime):
             if accountmgr:
                 await accountmgr.__aexit__(None, None, None)
     
-    await asyncio.gather(*[run_one_qid(qid) for qid in usermgr.qids()])
+    due = cron_index.due(cur.hour, cur.minute)
+    await asyncio.gather(*[run_one_qid(qid, accounts) for qid, accounts in due.items()])
         
 
 async def write_cron_log(operation: eCronOperation, cur: datetime.datetime, qid: str, account: str, status: eResultStatus, log: str = ""):
@@ -91,5 +190,7 @@ async def write_cron_log(operation: eCronOperation, cur: datetime.datetime, qid:
 
 def queue_crons():
     async def task(cur):
+        if CRON_PREWARM_MINUTES > 0:
+            asyncio.get_event_loop().create_task(_prewarm_crons(cur))
         await _run_crons(cur)
     asyncio.get_event_loop().create_task(_cron(task))
@@ -11,6 +11,7 @@ from enum import Enum
 from datetime import datetime
 from ..db.database import db
 from ..util.logger import instance as logger
+from ..util.storage import instance as storage
 
 def default(val):
     return lambda cls:_wrap_init(cls, lambda self: setattr(self, 'default', val))
@@ -153,18 +154,16 @@ class Module:
         self._cache = {}
 
     def init_cache(self):
-        from os.path import exists
-        if not exists(self.cache_path):
+        content = storage.read(self.cache_path)
+        if content is None:
             from os import makedirs
             from os.path import dirname
             makedirs(dirname(self.cache_path), exist_ok = True)
-            with open(self.cache_path, "w") as f:
-                f.write("{}")
+            content = "{}"
 
-        with open(self.cache_path, "r") as f:
-            import json
-            self._cache = json.load(f)
-            self.cache_ready = True
+        import json
+        self._cache = json.loads(content)
+        self.cache_ready = True
 
     def iter_cache(self) -> Iterator[Tuple[Any, Any]]:
         if not self.cache_ready:
@@ -184,9 +183,8 @@ class Module:
             self.init_cache()
 
         self._cache[key] = value
-        with open(self.cache_path, "w") as f:
-            import json
-            json.dump(self._cache, f)
+        import json
+        storage.write(self.cache_path, lambda cache = dict(self._cache): json.dumps(cache))
 
     @abstractmethod
     async def do_task(self, client: pcrclient): ...
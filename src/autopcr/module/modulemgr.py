@@ -7,10 +7,12 @@ from abc import abstractmethod, abstractproperty
 from ..model.error import *
 from ..model.enums import *
 from ..db.database import db
-from .modulebase import Module, ModuleResult, eResultStatus
+from .modulebase import Module, ModuleResult, ResultTable, eResultStatus
 from ..core.clientpool import PoolClientWrapper
+from ..core.pcrclient import eLoginStatus
 import traceback
 import os
+from ..util.storage import instance as storage
 
 @dataclass_json
 @dataclass
@@ -36,9 +38,9 @@ class ResultInfo:
     status: eResultStatus = eResultStatus.SKIP
 
     def save_result(self, result):
-        with open(self.path, 'w') as f:
-            f.write(result.to_json())
+        storage.write(self.path, result.to_json())
     def delete_result(self):
+        storage.discard(self.path)
         if os.path.exists(self.path):
             os.remove(self.path)
     def get_result(self):
@@ -52,16 +54,14 @@ class ResultInfo:
 class TaskResultInfo(ResultInfo):
     _type: str = "daily_result"
     def get_result(self) -> TaskResult:
-        with open(self.path, 'r') as f:
-            return TaskResult.from_json(f.read())
+        return TaskResult.from_json(storage.read(self.path))
 
 @dataclass_json
 @dataclass
 class ModuleResultInfo(ResultInfo):
     _type: str = "single_result"
     def get_result(self) -> ModuleResult:
-        with open(self.path, 'r') as f:
-            return ModuleResult.from_json(f.read())
+        return ModuleResult.from_json(storage.read(self.path))
 
 class ModuleManager:
     _modules: List[type] = []
@@ -108,6 +108,18 @@ class ModuleManager:
                 await cron.update_client(self.client)
                 return
     
+    async def prewarm(self):
+        '''
+        logs in ahead of a scheduled run, so the pooled client only needs a refresh then
+        '''
+        client = self.client
+        await client.activate()
+        try:
+            if client.logged == eLoginStatus.NOT_LOGGED or not client.data.ready:
+                await client.login()
+        finally:
+            client.deactivate()
+
     def get_config(self, name, default):
         return self.config.get(name, default)
 
@@ -26,14 +26,7 @@ class lazy_normal_sweep(Module):
         if (not lack or strategy == "刷最缺") and quest_list:
             ret.append(quest_list[0])
         elif strategy == "均匀刷":
-            uncover = lack
-            ret = []
-            for quest in quest_list:
-                if any(item in uncover for item in db.normal_quest_rewards[quest]):
-                    ret.append(quest)
-                    uncover -= set(db.normal_quest_rewards[quest])
-                    if not uncover:
-                        break
+            ret = db.normal_quest_drop_matrix.cover(quest_list, lack)
         else:
             raise ValueError(f"未知策略{strategy}")
 
@@ -69,7 +62,7 @@ class lazy_normal_sweep(Module):
                         break
 
                     quest_weight = client.data.get_quest_weght(gap)
-                    quest_id = sorted(quest_list, key = lambda x: quest_weight[x], reverse = True)
+                    quest_id = sorted(quest_list, key = quest_weight.__getitem__, reverse = True)
                     target_quest = await self.get_quests(quest_id, strategy, gap)
                     if not target_quest: break
 
@@ -46,8 +46,9 @@ class search_unit(Module):
             level = [str(i) for i in level]
             info.append('/'.join(level))
 
-            read_storys = len([str(story.story_id) for story in db.unit_story if story.story_group_id == unit // 100 and story.story_id in read_story])
-            not_read_storys = len([str(story.story_id) for story in db.unit_story if story.story_group_id == unit // 100 and story.story_id not in read_story])
+            unit_storys = db.unit_story_by_group.get(unit // 100, [])
+            read_storys = len([story for story in unit_storys if story.story_id in read_story])
+            not_read_storys = len(unit_storys) - read_storys
             info.append("未实装" if not unitinfo.unique_equip_slot else "无" if not unitinfo.unique_equip_slot[0].is_slot else unitinfo.unique_equip_slot[0].enhancement_level)
             if len(unitinfo.unique_equip_slot) > 1:
                 info.append("无" if not unitinfo.unique_equip_slot[1].is_slot else f"{unitinfo.unique_equip_slot[1].enhancement_level}星") 
@@ -74,7 +75,7 @@ class search_unit(Module):
                 kizuna_name = db.get_unit_name(other)
                 unit_id = other // 100
                 love_level = client.data.unit_love_data[unit_id].love_level if unit_id in client.data.unit_love_data else 0
-                unit_story = [story.story_id for story in db.unit_story if story.story_group_id == unit_id]
+                unit_story = [story.story_id for story in db.unit_story_by_group.get(unit_id, [])]
                 total_storys = len(unit_story)
                 read_storys = len([story for story in unit_story if story in read_story])
                 love.append(f"{kizuna_name}好感{love_level}({read_storys}/{total_storys})")
@@ -71,7 +71,7 @@ class unit_story_reading(Module):
         read_story = set(client.data.read_story_ids)
         read_story.add(0) # no pre story
         now = apiclient.datetime
-        for story in db.unit_story:
+        for story in (story for group in sorted(client.data.unit_love_data) for story in db.unit_story_by_group.get(group, [])):
             if story.story_group_id == 1255:  # 忽略魔姬剧情
                 continue
             if (
@@ -151,8 +151,9 @@ class hatsune_story_reading(Module):
         read_story.add(0) # no pre story
         unlock_story = set(client.data.unlock_story_ids)
         open_hatsune_id = set(hatsune.event_id for hatsune in db.get_open_hatsune())
-        for story in db.event_story_detail:
-            if story.story_id not in read_story and story.story_id in unlock_story:
+        unread_story = sorted(story_id for story_id in unlock_story - read_story if story_id in db.event_story_detail_by_story)
+        for story in (db.event_story_detail_by_story[story_id] for story_id in unread_story):
+            if story.story_id not in read_story:
                 if (story.visible_type == eStoryVisibleType.EVENT_SPECIAL_STORY or 
                     story.visible_type == eStoryVisibleType.HIDDEN_BY_READ_CONDITION or 
                     story.visible_type == eStoryVisibleType.PRE_RELEASE_STORY or 
@@ -72,8 +72,7 @@ class find_clan_talent_quest(Module):
                 talent_name = db.talents[talent_id].talent_name
 
                 #获取对应area_id
-                area_id = next((a_id for a_id in db.talent_quest_area_data 
-                              if db.talent_quest_area_data[a_id].talent_id == talent_id), None)
+                area_id = next((area.area_id for area in db.talent_quest_area_by_talent.get(talent_id, [])), None)
                 if not area_id:
                     continue
 
@@ -15,6 +15,7 @@ from ...db.database import db
 from ...model.enums import *
 import random
 import itertools
+import heapq
 from collections import Counter
 
 @name('撤下会战助战')
@@ -613,10 +614,9 @@ class get_normal_quest_recommand(Module):
         grow_parameter_list = client.data.get_synchro_parameter()
         require_equip = client.data.get_equip_demand2_gap(consider_units, grow_parameter_list = grow_parameter_list)
         quest_weight = client.data.get_quest_weght(require_equip)
-        quest_id = sorted(quest_list, key = lambda x: quest_weight[x], reverse = True)
+        quest_id = heapq.nlargest(5, quest_list, key = quest_weight.__getitem__)
         tot = []
-        for i in range(5):
-            id = quest_id[i]
+        for id in quest_id:
             name = db.get_quest_name(id)
             tokens: List[ItemType] = [i for i in db.normal_quest_rewards[id]]
             msg = f"{name}:\n" + '\n'.join([
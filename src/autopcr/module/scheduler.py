@@ -0,0 +1,158 @@
+from collections import deque
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+import asyncio, time
+from ..constants import CLIENT_POOL_MAX_CLIENT_ALIVE, CLIENT_POOL_MAX_FARMER_CLIENT_ALIVE
+
+'''
+admission of account jobs (do_daily/do_from_key).
+jobs are started by priority first, then by start-time fair queuing across qids, so a qid
+with many accounts gets the same share as a qid with one. normal and farmer accounts have
+separate queues sized like the client pool buckets.
+'''
+
+T = TypeVar('T')
+
+class ePriority(IntEnum):
+    INTERACTIVE = 0
+    CRON = 1
+    BATCH = 2
+    PREWARM = 3
+
+PRIORITY_NAME = {
+    ePriority.INTERACTIVE: '交互',
+    ePriority.CRON: '定时',
+    ePriority.BATCH: '批量',
+    ePriority.PREWARM: '预热',
+}
+
+class DeadlineExceeded(Exception):
+    pass
+
+# set inside a running job, nested jobs run directly instead of queuing behind themselves
+_in_job: ContextVar[bool] = ContextVar('_in_job', default=False)
+
+class _Job:
+    def __init__(self, qid: str, priority: ePriority, weight: float):
+        self.qid = qid
+        self.priority = priority
+        self.weight = weight
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.time()
+
+class JobQueue:
+    def __init__(self, name: str, max_running: int):
+        self.name = name
+        self.max_running = max_running
+        self._queues: Dict[ePriority, Dict[str, Deque[_Job]]] = {p: {} for p in ePriority}
+        self._vtime: Dict[str, float] = {}
+        self._clock = 0.0
+        self.running: Dict[ePriority, int] = {p: 0 for p in ePriority}
+        self.waiting: Dict[ePriority, int] = {p: 0 for p in ePriority}
+        self.wait_time: Dict[ePriority, Deque[float]] = {p: deque(maxlen=100) for p in ePriority}
+
+    @property
+    def total_running(self) -> int:
+        return sum(self.running.values())
+
+    def _pop(self) -> Optional[_Job]:
+        for priority in ePriority:
+            queues = self._queues[priority]
+            if not queues:
+                continue
+            qid = min(queues, key=lambda qid: max(self._vtime.get(qid, 0), self._clock))
+            queue = queues[qid]
+            job = queue.popleft()
+            if not queue:
+                del queues[qid]
+            self._clock = max(self._vtime.get(qid, 0), self._clock)
+            self._vtime[qid] = self._clock + 1 / job.weight
+            return job
+        return None
+
+    def _dispatch(self):
+        while self.total_running < self.max_running:
+            job = self._pop()
+            if not job:
+                break
+            self.waiting[job.priority] -= 1
+            self.running[job.priority] += 1
+            self.wait_time[job.priority].append(time.time() - job.enqueued)
+            job.future.set_result(None)
+
+    def _remove(self, job: _Job):
+        queue = self._queues[job.priority].get(job.qid)
+        if queue and job in queue:
+            queue.remove(job)
+            if not queue:
+                del self._queues[job.priority][job.qid]
+            self.waiting[job.priority] -= 1
+
+    def _expire(self, job: _Job):
+        if not job.future.done():
+            self._remove(job)
+            job.future.set_exception(DeadlineExceeded('任务排队超时'))
+
+    async def acquire(self, qid: str, priority: ePriority, deadline: Optional[float] = None, weight: float = 1.0):
+        job = _Job(qid, priority, weight)
+        self._queues[priority].setdefault(qid, deque()).append(job)
+        self.waiting[priority] += 1
+        self._dispatch()
+        timer = None
+        if deadline is not None and not job.future.done():
+            timer = asyncio.get_running_loop().call_later(max(0, deadline - time.time()), self._expire, job)
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job.future.done() and not job.future.cancelled() and job.future.exception() is None:
+                self.release(priority)
+            else:
+                self._remove(job)
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+
+    def release(self, priority: ePriority):
+        self.running[priority] -= 1
+        self._dispatch()
+
+    def status(self) -> List[dict]:
+        ret = []
+        for priority in ePriority:
+            wait_time = self.wait_time[priority]
+            ret.append({
+                'name': f"{self.name}{PRIORITY_NAME[priority]}队列",
+                'running': self.running[priority],
+                'waiting': self.waiting[priority],
+                'max_running': self.max_running,
+                'wait_time': round(sum(wait_time) / len(wait_time), 3) if wait_time else 0,
+            })
+        return ret
+
+class JobScheduler:
+    def __init__(self):
+        self.normal = JobQueue('普通', CLIENT_POOL_MAX_CLIENT_ALIVE)
+        self.farm = JobQueue('农场', CLIENT_POOL_MAX_FARMER_CLIENT_ALIVE)
+
+    async def run(self, qid: str, priority: ePriority, farm: bool, func: Callable[[], Awaitable[T]],
+                  deadline: Optional[float] = None, weight: float = 1.0) -> T:
+        '''
+        deadline is a unix timestamp, jobs not started by then raise DeadlineExceeded
+        '''
+        if _in_job.get():
+            return await func()
+        queue = self.farm if farm else self.normal
+        await queue.acquire(qid, priority, deadline, weight)
+        token = _in_job.set(True)
+        try:
+            return await func()
+        finally:
+            _in_job.reset(token)
+            queue.release(priority)
+
+    def status(self) -> List[dict]:
+        return self.normal.status() + self.farm.status()
+
+instance = JobScheduler()
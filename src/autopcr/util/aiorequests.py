@@ -1,16 +1,58 @@
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from typing import Optional, Any
+from typing import Dict, Optional, Any, Tuple
+from urllib.parse import urlsplit
 
 import requests
 from requests import *
+from requests.adapters import HTTPAdapter
 
+from ..constants import HTTP_POOL_MAXSIZE, HTTP_MAX_WORKERS, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+
+_executor = ThreadPoolExecutor(max_workers=HTTP_MAX_WORKERS, thread_name_prefix='aiorequests')
 
 async def run_sync_func(func, *args, **kwargs) -> Any:
     return await asyncio.get_event_loop().run_in_executor(
-        None, partial(func, *args, **kwargs))
-
-_global_session = Session()
+        _executor, partial(func, *args, **kwargs))
+
+class _HostPool:
+    '''
+    keep-alive pool of one host, in-flight requests are bounded by the pool size
+    so that every request owns a connection (no pipelining on a busy socket)
+    '''
+    def __init__(self, maxsize: int):
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=maxsize, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._sema = asyncio.Semaphore(maxsize)
+        self.max_count = maxsize
+        self.running = 0
+        self.waiting = 0
+
+    async def request(self, method, url, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        self.waiting += 1
+        async with self._sema:
+            self.waiting -= 1
+            self.running += 1
+            try:
+                return await run_sync_func(self.session.request, method=method, url=url, **kwargs)
+            finally:
+                self.running -= 1
+
+_host_pools: Dict[str, _HostPool] = {}
+
+def _get_pool(url: str) -> _HostPool:
+    parts = urlsplit(url)
+    host = f'{parts.scheme}://{parts.netloc}'
+    if host not in _host_pools:
+        _host_pools[host] = _HostPool(HTTP_POOL_MAXSIZE)
+    return _host_pools[host]
+
+def pool_status() -> Dict[str, Tuple[int, int, int]]:
+    return {host: (pool.running, pool.waiting, pool.max_count) for host, pool in _host_pools.items()}
 
 class AsyncResponse:
     def __init__(self, response: requests.Response):
@@ -62,39 +104,35 @@ class AsyncResponse:
 
 
 async def request(method, url, **kwargs) -> AsyncResponse:
-    return AsyncResponse(await run_sync_func(_global_session.request,
-                                             method=method, url=url, **kwargs))
+    return AsyncResponse(await _get_pool(url).request(method, url, **kwargs))
 
 
 async def get(url, params=None, **kwargs) -> AsyncResponse:
-    return AsyncResponse(
-        await run_sync_func(_global_session.get, url=url, params=params, **kwargs))
+    kwargs.setdefault('allow_redirects', True)
+    return await request('get', url, params=params, **kwargs)
 
 
 async def options(url, **kwargs) -> AsyncResponse:
-    return AsyncResponse(
-        await run_sync_func(_global_session.options, url=url, **kwargs))
+    kwargs.setdefault('allow_redirects', True)
+    return await request('options', url, **kwargs)
 
 
 async def head(url, **kwargs) -> AsyncResponse:
-    return AsyncResponse(await run_sync_func(_global_session.head, url=url, **kwargs))
+    kwargs.setdefault('allow_redirects', False)
+    return await request('head', url, **kwargs)
 
 
 async def post(url, data=None, json=None, **kwargs) -> AsyncResponse:
-    return AsyncResponse(await run_sync_func(_global_session.post, url=url,
-                                             data=data, json=json, **kwargs))
+    return await request('post', url, data=data, json=json, **kwargs)
 
 
 async def put(url, data=None, **kwargs) -> AsyncResponse:
-    return AsyncResponse(
-        await run_sync_func(_global_session.put, url=url, data=data, **kwargs))
+    return await request('put', url, data=data, **kwargs)
 
 
 async def patch(url, data=None, **kwargs) -> AsyncResponse:
-    return AsyncResponse(
-        await run_sync_func(_global_session.patch, url=url, data=data, **kwargs))
+    return await request('patch', url, data=data, **kwargs)
 
 
 async def delete(url, **kwargs) -> AsyncResponse:
-    return AsyncResponse(
-        await run_sync_func(_global_session.delete, url=url, **kwargs))
+    return await request('delete', url, **kwargs)
@@ -0,0 +1,40 @@
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, Tuple
+import typing
+
+class DemandTracker:
+    '''
+    sum of per key demands, a key is recomputed only when its state changes.
+    everything is dropped when the version (of the db) changes.
+    '''
+    def __init__(self):
+        self.version: Any = None
+        self.parts: Dict[Hashable, Tuple[Hashable, typing.Counter]] = {}
+        self.total: typing.Counter = Counter()
+
+    def _add(self, demand: typing.Counter, sign: int):
+        total = self.total
+        for key, value in demand.items():
+            total[key] += sign * value
+
+    def update(self, version: Any, states: Dict[Hashable, Hashable], demand: Callable[[Hashable], typing.Counter]) -> typing.Counter:
+        '''
+        total demand of the keys in states, demand(key) is called for new or changed keys.
+        the total is kept by the tracker, copy it before changing it
+        '''
+        if version != self.version:
+            self.version = version
+            self.parts.clear()
+            self.total = Counter()
+        for key in [key for key in self.parts if key not in states]:
+            self._add(self.parts.pop(key)[1], -1)
+        for key, state in states.items():
+            part = self.parts.get(key)
+            if part is not None and part[0] == state:
+                continue
+            value = demand(key)
+            if part is not None:
+                self._add(part[1], -1)
+            self._add(value, 1)
+            self.parts[key] = (state, value)
+        return self.total
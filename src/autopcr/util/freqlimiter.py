@@ -1,4 +1,7 @@
-import asyncio
+import asyncio, time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+from .tracing import instance as tracer
 
 def FreqLimiter(limit: int, interval: float):
     sema = asyncio.Semaphore(limit)
@@ -20,4 +23,112 @@ def RunningLimiter(limit: int):
             finally:
                 sema.release()
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
+
+class _Window:
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.running = 0
+        self.waiting: Deque[asyncio.Future] = deque()
+        self.latency = 0.0 # ewma
+        self.min_latency = 0.0
+        self.last_decrease = 0.0
+        self.success = 0
+        self.failure = 0
+
+class AdaptiveLimiter:
+    '''
+    AIMD concurrency limit per key (server host) under a global cap.
+    the window grows by 1 per window of successful requests, and halves
+    on failures or when latency goes above the target, at most once per latency period.
+    '''
+    def __init__(self, global_limit: int, initial: int, min_limit: int, max_limit: int, target_latency: float):
+        self.global_limit = global_limit
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self._global = asyncio.Semaphore(global_limit)
+        self._windows: Dict[str, _Window] = {}
+
+    def _window(self, key: str) -> _Window:
+        if key not in self._windows:
+            self._windows[key] = _Window(self.initial)
+        return self._windows[key]
+
+    def _wakeup(self, window: _Window):
+        while window.waiting and window.running < int(window.limit):
+            fut = window.waiting.popleft()
+            if not fut.done():
+                window.running += 1
+                fut.set_result(None)
+
+    async def acquire(self, key: str):
+        window = self._window(key)
+        if window.running < int(window.limit) and not window.waiting:
+            window.running += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            window.waiting.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    window.running -= 1
+                    self._wakeup(window)
+                raise
+        try:
+            await self._global.acquire()
+        except asyncio.CancelledError:
+            window.running -= 1
+            self._wakeup(window)
+            raise
+
+    def release(self, key: str, latency: Optional[float] = None, ok: bool = True):
+        '''
+        frees the slot of key, latency None frees it without a sample
+        '''
+        self._global.release()
+        window = self._window(key)
+        window.running -= 1
+        if latency is None:
+            self._wakeup(window)
+            return
+        now = time.monotonic()
+        if ok:
+            window.success += 1
+            window.latency = latency if not window.latency else window.latency * 0.8 + latency * 0.2
+            window.min_latency = latency if not window.min_latency else min(window.min_latency * 1.01, latency)
+        else:
+            window.failure += 1
+        slow = ok and window.latency > max(self.target_latency, window.min_latency * 2)
+        if (not ok or slow) and now - window.last_decrease > max(window.latency, 1.0):
+            window.limit = max(self.min_limit, window.limit / 2)
+            window.last_decrease = now
+        elif ok and not slow:
+            window.limit = min(self.max_limit, window.limit + 1 / window.limit)
+        self._wakeup(window)
+
+    def limit(self, key_func: Callable[..., str], is_failure: Callable[[Exception], bool]):
+        def decorator(func):
+            async def wrapper(*args, **kwargs):
+                key = key_func(*args, **kwargs)
+                with tracer.span('limiter_wait'):
+                    await self.acquire(key)
+                start = time.monotonic()
+                try:
+                    ret = await func(*args, **kwargs)
+                except Exception as e:
+                    self.release(key, time.monotonic() - start, not is_failure(e))
+                    raise
+                except BaseException:
+                    # cancelled, says nothing about the server
+                    self.release(key)
+                    raise
+                self.release(key, time.monotonic() - start, True)
+                return ret
+            return wrapper
+        return decorator
+
+    def status(self) -> Dict[str, Tuple[int, int, int]]:
+        return {key: (window.running, len(window.waiting), int(window.limit)) for key, window in self._windows.items()}
@@ -0,0 +1,124 @@
+from typing import Callable, Dict, Optional, Set, Union
+import asyncio, atexit, os, threading, time
+from ..constants import STORAGE_FLUSH_DELAY
+from .logger import instance as logger
+
+'''
+write-behind text file storage.
+writes are queued and done by a dedicated I/O thread, writes to the same file within
+STORAGE_FLUSH_DELAY are coalesced into one, and files are replaced atomically.
+reads through `read` see queued writes.
+'''
+
+Content = Union[str, Callable[[], str]] # callables are serialized on the I/O thread
+
+def _atomic_write(path: str, content: str):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _materialize(content: Content) -> str:
+    return content() if callable(content) else content
+
+class storage:
+    def __init__(self, delay: float = STORAGE_FLUSH_DELAY):
+        self.delay = delay
+        self._pending: Dict[str, Content] = {}
+        self._writing: Dict[str, Content] = {} # taken by the I/O thread, not on disk yet
+        self._discarded: Set[str] = set() # prefixes discarded while a batch is being written
+        self._flushing = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.writes = 0
+        self.coalesced = 0
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='storage', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def write(self, path: str, content: Content):
+        with self._cond:
+            if path in self._pending:
+                self.coalesced += 1
+            self._pending[path] = content
+            self._start()
+            self._cond.notify_all()
+
+    def read(self, path: str) -> Optional[str]:
+        '''
+        content of the file including queued writes, None if it does not exist
+        '''
+        with self._cond:
+            content = self._pending.get(path, self._writing.get(path))
+        if content is not None:
+            return _materialize(content)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return f.read()
+
+    def exists(self, path: str) -> bool:
+        with self._cond:
+            if path in self._pending or path in self._writing:
+                return True
+        return os.path.exists(path)
+
+    def discard(self, prefix: str):
+        '''
+        drops queued writes of files under prefix, call before deleting them
+        '''
+        with self._cond:
+            for path in [path for path in self._pending if path.startswith(prefix)]:
+                self._pending.pop(path)
+            if any(path.startswith(prefix) for path in self._writing):
+                self._discarded.add(prefix)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.delay
+                while not self._flushing and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+                self._writing, self._pending = self._pending, {}
+            for path, content in self._writing.items():
+                try:
+                    _atomic_write(path, _materialize(content))
+                    self.writes += 1
+                except Exception:
+                    logger.exception(f"Failed to write {path}")
+            with self._cond:
+                for path in self._writing:
+                    if any(path.startswith(prefix) for prefix in self._discarded) and os.path.exists(path):
+                        os.remove(path)
+                self._writing = {}
+                self._discarded.clear()
+                self._cond.notify_all()
+
+    def flush(self):
+        '''
+        blocks until every queued write is on disk
+        '''
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                while self._pending or self._writing:
+                    self._cond.wait()
+            finally:
+                self._flushing -= 1
+
+    async def aflush(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    def status(self) -> Dict[str, int]:
+        with self._cond:
+            return {'pending': len(self._pending) + len(self._writing), 'writes': self.writes, 'coalesced': self.coalesced}
+
+instance = storage()
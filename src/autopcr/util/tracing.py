@@ -0,0 +1,86 @@
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, List, Tuple
+import time
+from ..constants import TRACING, TRACING_RESERVOIR_SIZE
+
+# waits: account_wait on the account mutex, client_wait on the apiclient request lock, limiter_wait on a server slot
+STAGES = ['account_wait', 'client_wait', 'limiter_wait', 'encode', 'pack', 'network', 'decode', 'offload_wait', 'unpack', 'parse', 'handler_update', 'total']
+QUANTILES = [0.5, 0.95, 0.99]
+
+# set by the request pipeline, so that spans deep in the stack know whom they belong to
+current_account: ContextVar[str] = ContextVar('current_account', default='')
+current_request: ContextVar[str] = ContextVar('current_request', default='')
+
+class _Summary:
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.samples: Deque[float] = deque(maxlen=TRACING_RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def quantiles(self) -> List[Tuple[float, float]]:
+        samples = sorted(self.samples)
+        if not samples:
+            return []
+        return [(q, samples[min(len(samples) - 1, int(q * len(samples)))]) for q in QUANTILES]
+
+class tracer:
+    def __init__(self):
+        self.by_request: Dict[Tuple[str, str], _Summary] = {}
+        self.by_account: Dict[Tuple[str, str], _Summary] = {}
+
+    def record(self, stage: str, request: str, account: str, seconds: float):
+        self.by_request.setdefault((stage, request), _Summary()).observe(seconds)
+        if account:
+            self.by_account.setdefault((stage, account), _Summary()).observe(seconds)
+
+    @contextmanager
+    def _span(self, stage: str, request: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, request or current_request.get(), current_account.get(), time.perf_counter() - start)
+
+    def span(self, stage: str, request: str = ''):
+        if not TRACING:
+            return nullcontext()
+        return self._span(stage, request)
+
+    def observe(self, stage: str, seconds: float, request: str = ''):
+        '''
+        a stage timed elsewhere, e.g. in an executor
+        '''
+        if TRACING:
+            self.record(stage, request or current_request.get(), current_account.get(), seconds)
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def _export(self, name: str, help: str, label: str, summaries: Dict[Tuple[str, str], _Summary]) -> Iterator[str]:
+        yield f'# HELP {name} {help}'
+        yield f'# TYPE {name} summary'
+        for (stage, value), summary in sorted(summaries.items()):
+            labels = f'stage="{stage}",{label}="{self._escape(value)}"'
+            for q, v in summary.quantiles():
+                yield f'{name}{{{labels},quantile="{q}"}} {v:.6f}'
+            yield f'{name}_sum{{{labels}}} {summary.sum:.6f}'
+            yield f'{name}_count{{{labels}}} {summary.count}'
+
+    def export(self) -> str:
+        '''
+        prometheus text exposition format
+        '''
+        lines = []
+        lines.extend(self._export('autopcr_request_stage_seconds', 'Time spent per request stage by request class', 'request', self.by_request))
+        lines.extend(self._export('autopcr_account_stage_seconds', 'Time spent per request stage by account', 'account', self.by_account))
+        return '\n'.join(lines) + '\n'
+
+instance = tracer()
@@ -0,0 +1,58 @@
+import asyncio, time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar('T')
+
+class TTLCache:
+    '''
+    async cache whose values expire after ttl seconds.
+    concurrent misses of the same key share one fetch.
+    '''
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._values: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        if key in self._values:
+            expire, value = self._values[key]
+            if expire > time.time():
+                self.hits += 1
+                return value
+            del self._values[key]
+        if key in self._inflight:
+            self.hits += 1
+            future = self._inflight[key]
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled(): # we are cancelled
+                    raise
+                return await self.get(key, fetch) # the fetching task is cancelled
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception() # waiters get it, no "never retrieved" warning without them
+            raise
+        else:
+            self._values[key] = (time.time() + self.ttl, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self, key: Hashable = None):
+        if key is None:
+            self._values.clear()
+        else:
+            self._values.pop(key, None)